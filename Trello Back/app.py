@@ -1,24 +1,75 @@
-from flask import Flask
+from flask import Flask, json
 from flask_sqlalchemy import SQLAlchemy
 from flask_jwt_extended import JWTManager
 from flask_socketio import SocketIO
 from config import Config
+from pubsub import message_queue_options
+from engines import engine_options, install_pragmas, sqlite_pragmas
 
+db = SQLAlchemy()
+jwt = JWTManager()
+socketio = SocketIO()
+
+# Routes, socket handlers and CLI commands register themselves on this instance
 app = Flask(__name__)
-app.config.from_object(Config)
 
-db = SQLAlchemy(app)
-jwt = JWTManager(app)
-socketio = SocketIO(app, cors_allowed_origins="*")
 
-import models
-import routes
-import auth
-import sockets  # Ensure this is imported
+def create_app():
+    """Configure the app, bind the extensions and load the modules that register on it.
+
+    Creating the schema is left to :func:`init_db` so that worker processes
+    can boot without touching it.
+    """
+    app.config.from_object(Config)
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(app.config)
+
+    db.init_app(app)
+    jwt.init_app(app)
+    socketio.init_app(app, cors_allowed_origins="*", json=json,
+                      http_compression=app.config['SOCKET_COMPRESSION'],
+                      compression_threshold=app.config['SOCKET_COMPRESSION_THRESHOLD'],
+                      **message_queue_options(app.config['SOCKETIO_MESSAGE_QUEUE']))
+    with app.app_context():
+        install_pragmas(db.engine, sqlite_pragmas(app.config))
+
+    import models
+    import routes
+    import batch
+    import patches
+    import transfer
+    import jobs
+    import archive
+    import auth
+    import sockets  # Ensure this is imported
+    import search
+    import stats
+    import metrics
+    return app
 
-# Create the database tables
-with app.app_context():
+
+# Create the database tables and the search index, upgrading tables left by older versions
+def init_db():
+    import search
+    import schema
+    existing = schema.existing_tables()
     db.create_all()
+    search.create_index()
+    return schema.upgrade(existing)
+
+
+@app.cli.command('init-db')
+def init_db_command():
+    """Create any missing tables and the search index, and upgrade existing ones."""
+    changes = init_db()
+    if changes:
+        print(f"Upgraded: {', '.join(changes)}")
+    print('Database initialized')
+
 
 if __name__ == '__main__':
-    socketio.run(app, debug=True)
+    # The route modules import this file as ``app``; run the development
+    # server through serve.py so they all share that one module
+    import serve
+    serve.main(['--dev'])
+else:
+    create_app()
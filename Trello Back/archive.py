@@ -0,0 +1,303 @@
+from datetime import datetime, timedelta
+from flask import request, jsonify
+from flask_jwt_extended import jwt_required, get_jwt_identity
+from sqlalchemy import and_, or_
+from app import app, db
+from models import Workspace, Task, SubTask, ArchivedTask, ArchivedSubTask, Tombstone
+from authz import workspace_role_required
+from pubsub import publish
+from routes import encode_cursor, decode_cursor, parse_page_size
+from serializers import TASK_FIELDS, SUBTASK_FIELDS, IN_CHUNK_SIZE, json_response, project
+from sync import bump_workspace_version
+import jobs
+import search
+import stats
+
+# Columns copied between the hot and cold tables; ids and parent ids are mapped separately
+TASK_COLUMNS = [column.key for column in Task.__table__.columns if column.key != 'id']
+SUBTASK_COLUMNS = [column.key for column in SubTask.__table__.columns if column.key not in ('id', 'task_id')]
+ARCHIVED_TASK_FIELDS = TASK_FIELDS + ('source_id', 'archived_at')
+ARCHIVED_SUBTASK_FIELDS = SUBTASK_FIELDS + ('source_id',)
+
+
+def _tombstones(workspace_id, entity_type, ids, version, now):
+    return [{'workspace_id': workspace_id, 'entity_type': entity_type, 'entity_id': entity_id,
+             'version': version, 'deleted_at': now} for entity_id in ids]
+
+
+def archive_tasks(session, workspace_id, task_ids, version, now):
+    """Move tasks of one workspace and their subtasks to the cold tables, in the caller's transaction.
+
+    Rows are copied with INSERT ... SELECT and deleted from the board. For
+    delta sync, aggregates and search they leave the same way deleted rows
+    do. Archive rows get ids of their own and keep the board id as
+    ``source_id``. Returns the number of subtasks moved.
+    """
+    moved = 0
+    for start in range(0, len(task_ids), IN_CHUNK_SIZE):
+        moved += _archive_chunk(session, workspace_id, task_ids[start:start + IN_CHUNK_SIZE], version, now)
+    return moved
+
+
+def _archive_chunk(session, workspace_id, task_ids, version, now):
+    subtask_ids = session.execute(db.select(SubTask.id).where(SubTask.task_id.in_(task_ids))).scalars().all()
+    before = stats.snapshot(session, task_ids, subtask_ids)
+
+    task_table, subtask_table, archived_table = Task.__table__, SubTask.__table__, ArchivedTask.__table__
+    # Older archive rows may carry one of these board ids too; the new ones are numbered after them
+    last_archived = session.execute(db.select(db.func.max(ArchivedTask.id))).scalar() or 0
+    session.execute(db.insert(ArchivedTask).from_select(
+        ['source_id'] + TASK_COLUMNS + ['archived_at'],
+        db.select(task_table.c.id, *[task_table.c[name] for name in TASK_COLUMNS], db.literal(now, db.DateTime))
+        .where(task_table.c.id.in_(task_ids))
+    ))
+    # Point subtasks at the archive rows just written
+    session.execute(db.insert(ArchivedSubTask).from_select(
+        ['source_id', 'task_id'] + SUBTASK_COLUMNS + ['workspace_id'],
+        db.select(subtask_table.c.id, archived_table.c.id, *[subtask_table.c[name] for name in SUBTASK_COLUMNS],
+                  db.literal(workspace_id))
+        .select_from(subtask_table.join(archived_table, archived_table.c.source_id == subtask_table.c.task_id))
+        .where(archived_table.c.source_id.in_(task_ids), archived_table.c.workspace_id == workspace_id,
+               archived_table.c.id > last_archived)
+    ))
+    session.execute(db.delete(SubTask).where(SubTask.task_id.in_(task_ids))
+                    .execution_options(synchronize_session=False))
+    session.execute(db.delete(Task).where(Task.id.in_(task_ids)).execution_options(synchronize_session=False))
+
+    session.bulk_insert_mappings(Tombstone, _tombstones(workspace_id, 'task', task_ids, version, now)
+                                 + _tombstones(workspace_id, 'subtask', subtask_ids, version, now))
+    search.unindex(session, task_ids, subtask_ids)
+    stats.apply_snapshot_diff(session, before, stats.snapshot(session, task_ids, subtask_ids))
+    return len(subtask_ids)
+
+
+def _cold_rows(table, columns, condition):
+    statement = db.select(*[table.c[name] for name in columns]).where(condition)
+    return [dict(row._mapping) for row in db.session.execute(statement)]
+
+
+def _insert_keeping_ids(session, model, rows):
+    # Keep each row's board id unless the hot table handed it out again meanwhile (possible on
+    # engines whose auto-increment counters can go back, such as MySQL before 8.0)
+    ids = [row['id'] for row in rows]
+    taken = set()
+    for start in range(0, len(ids), IN_CHUNK_SIZE):
+        taken.update(session.execute(db.select(model.id).where(model.id.in_(ids[start:start + IN_CHUNK_SIZE]))).scalars())
+    kept = [row for row in rows if row['id'] not in taken]
+    renumbered = [row for row in rows if row['id'] in taken]
+    if kept:
+        session.bulk_insert_mappings(model, kept)
+    if renumbered:
+        old_ids = [row.pop('id') for row in renumbered]
+        session.bulk_insert_mappings(model, renumbered, return_defaults=True)
+        return {old_id: row['id'] for old_id, row in zip(old_ids, renumbered)}
+    return {}
+
+
+def restore_tasks(session, workspace_id, archive_ids, version, now):
+    """Move archived tasks and their subtasks back onto the board, in the caller's transaction.
+
+    Restored rows get a new version and updated_at so every kind of delta
+    sync picks them up. Returns ``{archive id: (source id, id on the board)}``;
+    the two task ids differ only when the board handed the id out again in
+    the meantime.
+    """
+    moved = {}
+    for start in range(0, len(archive_ids), IN_CHUNK_SIZE):
+        moved.update(_restore_chunk(session, workspace_id, archive_ids[start:start + IN_CHUNK_SIZE], version, now))
+    return moved
+
+
+def _restore_chunk(session, workspace_id, archive_ids, version, now):
+    tasks = _cold_rows(ArchivedTask.__table__, ['id', 'source_id'] + TASK_COLUMNS, and_(
+        ArchivedTask.workspace_id == workspace_id, ArchivedTask.id.in_(archive_ids)))
+    if not tasks:
+        return {}
+    found = [task.pop('id') for task in tasks]
+    subtasks = _cold_rows(ArchivedSubTask.__table__, ['task_id', 'source_id'] + SUBTASK_COLUMNS,
+                          ArchivedSubTask.task_id.in_(found))
+
+    for row in tasks + subtasks:
+        row.update(id=row.pop('source_id'), sync_version=version, updated_at=now)
+    source_ids = [task['id'] for task in tasks]
+    old_subtask_ids = [row['id'] for row in subtasks]
+    _insert_keeping_ids(session, Task, tasks)
+    board_ids = {archive_id: task['id'] for archive_id, task in zip(found, tasks)}
+    for row in subtasks:
+        row['task_id'] = board_ids[row['task_id']]
+    if subtasks:
+        _insert_keeping_ids(session, SubTask, subtasks)
+
+    session.execute(db.delete(ArchivedSubTask).where(ArchivedSubTask.task_id.in_(found))
+                    .execution_options(synchronize_session=False))
+    session.execute(db.delete(ArchivedTask).where(ArchivedTask.id.in_(found))
+                    .execution_options(synchronize_session=False))
+    # The rows are live again; clients that synced the archiving see them as new changes
+    for entity_type, ids in (('task', source_ids), ('subtask', old_subtask_ids)):
+        for start in range(0, len(ids), IN_CHUNK_SIZE):
+            session.execute(db.delete(Tombstone).where(
+                Tombstone.workspace_id == workspace_id, Tombstone.entity_type == entity_type,
+                Tombstone.entity_id.in_(ids[start:start + IN_CHUNK_SIZE])))
+
+    restored = list(board_ids.values())
+    subtask_ids = [row['id'] for row in subtasks]
+    search.reindex(session, restored, subtask_ids)
+    stats.apply_snapshot_diff(session, {}, stats.snapshot(session, restored, subtask_ids))
+    return {archive_id: (source_id, board_ids[archive_id]) for archive_id, source_id in zip(found, source_ids)}
+
+
+def archivable(workspace_id, older_than_days):
+    # The archiving policy: done tasks nobody has touched for a while
+    cutoff = datetime.utcnow() - timedelta(days=older_than_days)
+    return and_(Task.workspace_id == workspace_id, Task.status.in_(app.config['TASK_DONE_STATUSES']),
+                Task.updated_at < cutoff)
+
+
+def archive_workspace(workspace_id, older_than_days, on_chunk=None):
+    """Archive a workspace's tasks matching the policy, one chunk per transaction."""
+    session = db.session
+    candidates = db.select(Task.id).where(archivable(workspace_id, older_than_days)) \
+        .order_by(Task.id).limit(app.config['JOB_CHUNK_SIZE'])
+    archived = 0
+    while True:
+        task_ids = session.execute(candidates).scalars().all()
+        if not task_ids:
+            session.rollback()
+            return archived
+        version = bump_workspace_version(session, workspace_id)
+        archive_tasks(session, workspace_id, task_ids, version, datetime.utcnow())
+        session.commit()
+        _announce_archived(workspace_id, task_ids, version)
+        archived += len(task_ids)
+        if on_chunk:
+            on_chunk(len(task_ids))
+
+
+def _announce_archived(workspace_id, task_ids, version):
+    publish('tasks_archived', {'task_ids': task_ids, 'version': version}, workspace_id)
+
+
+@jobs.handler('archive_tasks')
+def archive_tasks_job(workspace_id, params, progress):
+    older_than_days = params.get('older_than_days', app.config['ARCHIVE_AFTER_DAYS'])
+    progress.set_total(db.session.execute(
+        db.select(db.func.count(Task.id)).where(archivable(workspace_id, older_than_days))).scalar())
+    return {'tasks': archive_workspace(workspace_id, older_than_days, progress.advance)}
+
+
+# Helper function to read a bounded list of ids from the request body
+def _ids(data, key):
+    ids = data.get(key)
+    if not isinstance(ids, list) or not all(isinstance(value, int) for value in ids):
+        raise ValueError(f'{key} must be a list of integers')
+    if len(ids) > app.config['BATCH_MAX_OPERATIONS']:
+        raise ValueError(f"At most {app.config['BATCH_MAX_OPERATIONS']} {key} per request")
+    return list(dict.fromkeys(ids))
+
+
+@app.route('/workspaces/<int:workspace_id>/archive', methods=['GET'])
+@jwt_required()
+@workspace_role_required()
+def get_archive(workspace_id):
+    query = ArchivedTask.query.filter_by(workspace_id=workspace_id)
+    try:
+        limit = parse_page_size(request.args.get('limit'))
+        if request.args.get('cursor'):
+            archived_at, last_id = decode_cursor(request.args['cursor'])
+            query = query.filter(or_(
+                ArchivedTask.archived_at < archived_at,
+                and_(ArchivedTask.archived_at == archived_at, ArchivedTask.id < last_id)
+            ))
+    except (ValueError, UnicodeDecodeError):
+        return jsonify({"error": "Invalid pagination parameters"}), 400
+
+    # Most recently archived first; one extra row tells whether another page exists
+    tasks = project(query.order_by(ArchivedTask.archived_at.desc(), ArchivedTask.id.desc()).limit(limit + 1),
+                    ArchivedTask, ARCHIVED_TASK_FIELDS)
+    next_cursor = None
+    if len(tasks) > limit:
+        tasks = tasks[:limit]
+        next_cursor = encode_cursor(tasks[-1]['archived_at'], tasks[-1]['id'])
+
+    by_id = {task['id']: task for task in tasks}
+    for task in tasks:
+        task['subtasks'] = []
+    task_ids = list(by_id)
+    for start in range(0, len(task_ids), IN_CHUNK_SIZE):
+        subtask_query = ArchivedSubTask.query.filter(ArchivedSubTask.task_id.in_(task_ids[start:start + IN_CHUNK_SIZE]))
+        for subtask in project(subtask_query.order_by(ArchivedSubTask.position, ArchivedSubTask.id),
+                               ArchivedSubTask, ARCHIVED_SUBTASK_FIELDS):
+            by_id[subtask['task_id']]['subtasks'].append(subtask)
+    return json_response({'tasks': tasks, 'next_cursor': next_cursor}), 200
+
+
+@app.route('/workspaces/<int:workspace_id>/archive', methods=['POST'])
+@jwt_required()
+@workspace_role_required()
+def create_archive(workspace_id):
+    data = request.get_json(silent=True) or {}
+    if 'task_ids' not in data:
+        # Without ids the workspace's policy sweep runs as a background job
+        try:
+            older_than_days = int(data.get('older_than_days', app.config['ARCHIVE_AFTER_DAYS']))
+        except (TypeError, ValueError):
+            return jsonify({"error": "older_than_days must be an integer"}), 400
+        job = jobs.active_job('archive_tasks', workspace_id, older_than_days=older_than_days)
+        if job is None:
+            job = jobs.enqueue('archive_tasks', workspace_id, int(get_jwt_identity()), older_than_days=older_than_days)
+        return jobs.job_response(job)
+
+    try:
+        task_ids = _ids(data, 'task_ids')
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    session = db.session
+    found = []
+    for start in range(0, len(task_ids), IN_CHUNK_SIZE):
+        found += session.execute(db.select(Task.id).where(
+            Task.workspace_id == workspace_id, Task.id.in_(task_ids[start:start + IN_CHUNK_SIZE]))).scalars().all()
+    if not found:
+        return jsonify({"error": "No matching tasks on the board"}), 404
+
+    version = bump_workspace_version(session, workspace_id)
+    archive_tasks(session, workspace_id, found, version, datetime.utcnow())
+    session.commit()
+    _announce_archived(workspace_id, found, version)
+    return jsonify({'version': version, 'archived': found,
+                    'not_found': sorted(set(task_ids) - set(found))}), 200
+
+
+@app.route('/workspaces/<int:workspace_id>/archive/restore', methods=['POST'])
+@jwt_required()
+@workspace_role_required()
+def restore_archive(workspace_id):
+    # Takes the archive's own ids, as listed by GET .../archive
+    try:
+        archive_ids = _ids(request.get_json(silent=True) or {}, 'ids')
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    session = db.session
+    version = bump_workspace_version(session, workspace_id)
+    moved = restore_tasks(session, workspace_id, archive_ids, version, datetime.utcnow())
+    if not moved:
+        session.rollback()
+        return jsonify({"error": "No matching tasks in the archive"}), 404
+    session.commit()
+    restored = [board_id for _, board_id in moved.values()]
+    publish('tasks_restored', {'task_ids': restored, 'version': version}, workspace_id)
+    return jsonify({
+        'version': version,
+        'restored': restored,
+        # Board ids handed out again while the task was archived; the task came back under a new one
+        'renumbered': {str(source_id): board_id for source_id, board_id in moved.values() if source_id != board_id},
+        'not_found': sorted(set(archive_ids) - set(moved)),
+    }), 200
+
+
+@app.cli.command('archive-tasks')
+def archive_tasks_command():
+    """Archive done tasks not updated for ARCHIVE_AFTER_DAYS in every workspace."""
+    workspace_ids = db.session.execute(db.select(Workspace.id)).scalars().all()
+    archived = sum(archive_workspace(workspace_id, app.config['ARCHIVE_AFTER_DAYS']) for workspace_id in workspace_ids)
+    print(f'Archived {archived} tasks from {len(workspace_ids)} workspaces')
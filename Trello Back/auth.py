@@ -1,14 +1,14 @@
 from flask import request, jsonify
-from werkzeug.security import generate_password_hash, check_password_hash
 from app import app, db
 from models import User
+from passwords import hash_password, verify_password
 from flask_jwt_extended import create_access_token
 from sqlalchemy.exc import IntegrityError
 
 @app.route('/auth/signup', methods=['POST'])
 def signup():
     data = request.get_json()
-    hashed_password = generate_password_hash(data['password'], method='pbkdf2:sha256')
+    hashed_password = hash_password(data['password'])
     new_user = User(username=data['username'], email=data['email'], password_hash=hashed_password)
     
     try:
@@ -27,7 +27,7 @@ def signup():
 def login():
     data = request.get_json()
     user = User.query.filter_by(username=data['username']).first()
-    if not user or not check_password_hash(user.password_hash, data['password']):
+    if not user or not verify_password(user.password_hash, data['password']):
         return jsonify({'message': 'Invalid credentials'}), 401
     
     access_token = create_access_token(identity=user.id)
@@ -0,0 +1,150 @@
+import time
+from collections import OrderedDict
+from functools import wraps
+from flask import g, jsonify, abort
+from flask_jwt_extended import get_jwt_identity
+from app import app
+from locks import WorkerLock
+from models import Task, UserWorkspaceRole
+
+_MISSING = object()
+
+
+def validate_role(role):
+    """Check a membership role; any role other than 'admin' grants member access."""
+    if not isinstance(role, str) or not role:
+        raise ValueError('role must be a non-empty string')
+    if len(role) > UserWorkspaceRole.__table__.c.role.type.length:
+        raise ValueError('role is too long')
+    return role
+
+
+class TTLCache:
+    """Small thread-safe LRU cache whose entries expire after ``ttl`` seconds."""
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = WorkerLock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key, _MISSING)
+            if item is _MISSING:
+                return default
+            value, expires_at = item
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def delete_where(self, predicate):
+        with self._lock:
+            for key in [key for key, (value, _) in self._data.items() if predicate(key, value)]:
+                del self._data[key]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+# (user_id, workspace_id) -> role name, or None for non-members
+role_cache = TTLCache(app.config['AUTHZ_CACHE_SIZE'], app.config['AUTHZ_CACHE_TTL'])
+
+
+def _request_memo():
+    if 'authz_memo' not in g:
+        g.authz_memo = {}
+    return g.authz_memo
+
+
+def get_workspace_role(user_id, workspace_id):
+    key = (int(user_id), int(workspace_id))
+    memo = _request_memo()
+    if key in memo:
+        return memo[key]
+
+    role = role_cache.get(key, _MISSING)
+    if role is _MISSING:
+        user_role = UserWorkspaceRole.query.filter_by(user_id=key[0], workspace_id=key[1]).first()
+        role = user_role.role if user_role else None
+        role_cache.set(key, role)
+    memo[key] = role
+    return role
+
+
+def get_task_workspace_id(task_id):
+    # Not cached: a deleted or archived task's id can name another workspace's task later,
+    # and a stale mapping would authorize against the wrong workspace
+    return Task.query.with_entities(Task.workspace_id).filter_by(id=task_id).scalar()
+
+
+# Called as listener(user_id, workspace_id) after a membership changes, with
+# user_id None when the whole workspace changed; lets other layers drop their copies
+role_listeners = []
+
+
+def forget_roles(user_id, workspace_id):
+    """Drop this process's cached roles for one membership, or for a whole workspace when ``user_id`` is None."""
+    workspace_id = int(workspace_id)
+    if user_id is not None:
+        role_cache.delete((int(user_id), workspace_id))
+    else:
+        role_cache.delete_where(lambda key, role: key[1] == workspace_id)
+    if g:
+        memo = _request_memo()
+        for key in [key for key in memo if key[1] == workspace_id and user_id in (None, key[0])]:
+            del memo[key]
+
+
+def invalidate_role(user_id, workspace_id):
+    forget_roles(user_id, workspace_id)
+    for listener in role_listeners:
+        listener(int(user_id), int(workspace_id))
+
+
+def invalidate_workspace(workspace_id):
+    forget_roles(None, workspace_id)
+    for listener in role_listeners:
+        listener(None, int(workspace_id))
+
+
+def workspace_role_required(admin=False):
+    """Authorize the current user against the route's workspace_id or task_id.
+
+    Non-members get a 404, non-admins a 403 when ``admin`` is set. The
+    resolved role is available to the handler as ``g.workspace_role``.
+    """
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            workspace_id = kwargs.get('workspace_id')
+            if workspace_id is None:
+                workspace_id = get_task_workspace_id(kwargs['task_id'])
+                if workspace_id is None:
+                    abort(404)
+
+            role = get_workspace_role(get_jwt_identity(), workspace_id)
+            if role is None:
+                abort(404)
+            if admin and role != 'admin':
+                return jsonify({"error": "Not authorized"}), 403
+
+            g.workspace_id = workspace_id
+            g.workspace_role = role
+            return fn(*args, **kwargs)
+        return wrapper
+    return decorator
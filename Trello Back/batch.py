@@ -0,0 +1,267 @@
+from datetime import datetime
+from flask import request, jsonify
+from flask_jwt_extended import jwt_required
+from app import app, db
+from models import Task, SubTask, Tombstone
+from authz import workspace_role_required
+from pubsub import publish
+from routes import parse_datetime
+from serializers import TASK_UPDATE_FIELDS, SUBTASK_UPDATE_FIELDS
+from sync import bump_workspace_version
+import positions
+import search
+import stats
+
+
+def validate_values(model, values):
+    """Reject values the column would refuse or silently store as the wrong type."""
+    for field, value in values.items():
+        column = model.__table__.c[field]
+        if value is None:
+            if not column.nullable:
+                raise ValueError(f'{field} cannot be null')
+        elif isinstance(column.type, db.String):
+            if not isinstance(value, str):
+                raise ValueError(f'{field} must be a string')
+        elif isinstance(column.type, db.Boolean):
+            if not isinstance(value, bool):
+                raise ValueError(f'{field} must be a boolean')
+        # bool is an int subclass, so it is ruled out separately
+        elif isinstance(column.type, db.Integer):
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                raise ValueError(f'{field} must be a number')
+    return values
+
+
+def task_values(data):
+    values = {field: data[field] for field in TASK_UPDATE_FIELDS if field in data}
+    if 'due_date' in values:
+        if values['due_date'] is not None and not isinstance(values['due_date'], str):
+            raise ValueError('due_date must be a date string')
+        values['due_date'] = parse_datetime(values['due_date'])
+    return validate_values(Task, values)
+
+
+def subtask_values(data):
+    return validate_values(SubTask, {field: data[field] for field in SUBTASK_UPDATE_FIELDS if field in data})
+
+
+def _column_default(column):
+    default = column.default
+    if default is None:
+        return None
+    # Callable defaults are wrapped to take the execution context, which they ignore
+    return default.arg if default.is_scalar else default.arg(None)
+
+
+def insert_rows(session, model, rows):
+    """Insert ``rows`` with a single executemany.
+
+    The statement binds the same columns for every row, so columns that only
+    some rows set take their default in the others. Ids are not returned;
+    callers that need them select them afterwards.
+    """
+    columns = {key for row in rows for key in row}
+    for row in rows:
+        for key in columns - row.keys():
+            row[key] = _column_default(model.__table__.c[key])
+    session.execute(db.insert(model), rows)
+
+
+class BatchError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+# Helper function to tell ids apart from other JSON values; bool is an int subclass
+def _is_id(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def _plan(operations, workspace_id):
+    """Validate operations and sort them into bulk statements.
+
+    Returns the per-item results, with ``None`` for operations that are
+    applied, plus the rows for each bulk statement.
+    """
+    # Ids of any other type are reported per item below
+    task_ids = {op.get('id') for op in operations
+                if op.get('type', 'task') == 'task' and op.get('op') != 'create' and _is_id(op.get('id'))}
+    task_ids |= {op['data'].get('task_id') for op in operations if op.get('type') == 'subtask'
+                 and isinstance(op.get('data'), dict) and _is_id(op['data'].get('task_id'))}
+    known_tasks = {row.id for row in db.session.query(Task.id).filter(
+        Task.workspace_id == workspace_id, Task.id.in_(task_ids))}
+
+    subtask_ids = {op.get('id') for op in operations
+                   if op.get('type') == 'subtask' and op.get('op') != 'create' and _is_id(op.get('id'))}
+    known_subtasks = dict(db.session.query(SubTask.id, SubTask.task_id).join(Task).filter(
+        Task.workspace_id == workspace_id, SubTask.id.in_(subtask_ids)))
+
+    results = [None] * len(operations)
+    plan = {'task_create': [], 'task_update': [], 'task_delete': [],
+            'subtask_create': [], 'subtask_update': [], 'subtask_delete': []}
+    for index, op in enumerate(operations):
+        kind = op.get('type', 'task')
+        action = op.get('op')
+        data = op.get('data') or {}
+        try:
+            if not isinstance(data, dict):
+                raise BatchError('data must be an object')
+            if kind == 'task' and action == 'create':
+                if not data.get('title'):
+                    raise BatchError('Title is required')
+                values = task_values(data)
+                values.setdefault('description', '')
+                values.setdefault('status', 'Planned')
+                subtasks = data.get('subtasks', [])
+                if not isinstance(subtasks, list) or not all(isinstance(subtask, dict) for subtask in subtasks):
+                    raise BatchError('subtasks must be a list of objects')
+                subtasks = [subtask_values(subtask) for subtask in subtasks]
+                if any(not subtask.get('title') for subtask in subtasks):
+                    raise BatchError('Subtask title is required')
+                plan['task_create'].append((index, values, subtasks))
+            elif kind == 'task' and action in ('update', 'delete'):
+                if not _is_id(op.get('id')):
+                    raise BatchError('id must be an integer')
+                if op['id'] not in known_tasks:
+                    raise BatchError('Task not found', 404)
+                if action == 'update':
+                    plan['task_update'].append((index, dict(task_values(data), id=op['id'])))
+                else:
+                    plan['task_delete'].append((index, op['id']))
+            elif kind == 'subtask' and action == 'create':
+                if not _is_id(data.get('task_id')):
+                    raise BatchError('task_id must be an integer')
+                if data['task_id'] not in known_tasks:
+                    raise BatchError('Task not found', 404)
+                if not data.get('title'):
+                    raise BatchError('Title is required')
+                plan['subtask_create'].append((index, dict(subtask_values(data), task_id=data['task_id'])))
+            elif kind == 'subtask' and action in ('update', 'delete'):
+                if not _is_id(op.get('id')):
+                    raise BatchError('id must be an integer')
+                if op['id'] not in known_subtasks:
+                    raise BatchError('Subtask not found', 404)
+                if action == 'update':
+                    plan['subtask_update'].append((index, dict(subtask_values(data), id=op['id'])))
+                else:
+                    plan['subtask_delete'].append((index, op['id']))
+            else:
+                raise BatchError('Unknown operation')
+        except BatchError as e:
+            results[index] = {'index': index, 'status': e.status, 'error': str(e)}
+        except ValueError as e:
+            results[index] = {'index': index, 'status': 400, 'error': str(e)}
+    return results, plan
+
+
+@app.route('/workspaces/<int:workspace_id>/tasks:batch', methods=['POST'])
+@jwt_required()
+@workspace_role_required()
+def batch_tasks(workspace_id):
+    data = request.get_json()
+    operations = data.get('operations') if isinstance(data, dict) else None
+    if not isinstance(operations, list) or not all(isinstance(op, dict) for op in operations):
+        return jsonify({"error": "operations must be a list of objects"}), 400
+    if len(operations) > app.config['BATCH_MAX_OPERATIONS']:
+        return jsonify({"error": f"At most {app.config['BATCH_MAX_OPERATIONS']} operations per batch"}), 400
+
+    results, plan = _plan(operations, workspace_id)
+    if not any(plan.values()):
+        return jsonify({'version': None, 'results': results}), 200
+
+    now = datetime.utcnow()
+    session = db.session
+    version = bump_workspace_version(session, workspace_id)
+    # Rows whose aggregates change in place; created rows are added to the diff afterwards
+    touched_tasks = [values['id'] for _, values in plan['task_update']] + [task_id for _, task_id in plan['task_delete']]
+    touched_subtasks = [values['id'] for _, values in plan['subtask_update']]
+    touched_subtasks += [subtask_id for _, subtask_id in plan['subtask_delete']]
+    touched_subtasks += [row.id for row in session.query(SubTask.id).filter(
+        SubTask.task_id.in_([task_id for _, task_id in plan['task_delete']]))]
+    stats_before = stats.snapshot(session, touched_tasks, touched_subtasks)
+    stamp = {'sync_version': version, 'updated_at': now}
+
+    # Tasks first so that nested subtasks can pick up the generated ids
+    task_rows = [dict(values, workspace_id=workspace_id, created_at=now, **stamp)
+                 for _, values, _ in plan['task_create']]
+    if task_rows:
+        positions.assign_task_positions(session, workspace_id, task_rows)
+        insert_rows(session, Task, task_rows)
+        # Only this batch's rows carry the version it just took, and ids follow insert order
+        new_ids = session.execute(db.select(Task.id).where(
+            Task.workspace_id == workspace_id, Task.sync_version == version).order_by(Task.id)).scalars().all()
+        for row, task_id in zip(task_rows, new_ids):
+            row['id'] = task_id
+    nested_rows = []
+    for (index, _, subtasks), row in zip(plan['task_create'], task_rows):
+        results[index] = {'index': index, 'status': 201, 'id': row['id']}
+        nested_rows += [dict(subtask, task_id=row['id'], created_at=now, **stamp) for subtask in subtasks]
+
+    subtask_rows = [dict(values, created_at=now, **stamp) for _, values in plan['subtask_create']]
+    positions.assign_subtask_positions(session, subtask_rows)
+    positions.assign_subtask_positions(session, nested_rows, new_task_ids={row['id'] for row in task_rows})
+    if subtask_rows or nested_rows:
+        insert_rows(session, SubTask, subtask_rows + nested_rows)
+        new_ids = session.execute(db.select(SubTask.id).join(Task, Task.id == SubTask.task_id).where(
+            Task.workspace_id == workspace_id, SubTask.sync_version == version).order_by(SubTask.id)).scalars().all()
+        for row, subtask_id in zip(subtask_rows + nested_rows, new_ids):
+            row['id'] = subtask_id
+    for (index, _), row in zip(plan['subtask_create'], subtask_rows):
+        results[index] = {'index': index, 'status': 201, 'id': row['id']}
+
+    if plan['task_update']:
+        session.bulk_update_mappings(Task, [dict(values, **stamp) for _, values in plan['task_update']])
+    if plan['subtask_update']:
+        session.bulk_update_mappings(SubTask, [dict(values, **stamp) for _, values in plan['subtask_update']])
+    for index, values in plan['task_update'] + plan['subtask_update']:
+        results[index] = {'index': index, 'status': 200, 'id': values['id']}
+
+    deleted_tasks = [task_id for _, task_id in plan['task_delete']]
+    deleted_subtasks = [subtask_id for _, subtask_id in plan['subtask_delete']]
+    # Subtasks of deleted tasks go with them
+    orphaned = [row.id for row in session.query(SubTask.id).filter(SubTask.task_id.in_(deleted_tasks))]
+    if deleted_subtasks or orphaned:
+        session.execute(db.delete(SubTask).where(SubTask.id.in_(deleted_subtasks + orphaned)))
+    if deleted_tasks:
+        session.execute(db.delete(Task).where(Task.id.in_(deleted_tasks)))
+    tombstones = [{'workspace_id': workspace_id, 'entity_type': 'task', 'entity_id': task_id,
+                   'version': version, 'deleted_at': now} for task_id in deleted_tasks]
+    tombstones += [{'workspace_id': workspace_id, 'entity_type': 'subtask', 'entity_id': subtask_id,
+                    'version': version, 'deleted_at': now} for subtask_id in set(deleted_subtasks + orphaned)]
+    if tombstones:
+        session.bulk_insert_mappings(Tombstone, tombstones)
+
+    # Bulk statements skip the ORM flush hooks, so update the search index and stats here
+    created_task_ids = [row['id'] for row in task_rows]
+    nested_ids = [row['id'] for row in nested_rows]
+    search.unindex(session, deleted_tasks, set(deleted_subtasks + orphaned))
+    search.reindex(session,
+                   created_task_ids + [values['id'] for _, values in plan['task_update']],
+                   nested_ids + [row['id'] for row in subtask_rows] + [values['id'] for _, values in plan['subtask_update']])
+    for index, entity_id in plan['task_delete'] + plan['subtask_delete']:
+        results[index] = {'index': index, 'status': 204, 'id': entity_id}
+
+    stats.apply_snapshot_diff(session, stats_before, stats.snapshot(
+        session, touched_tasks + created_task_ids,
+        touched_subtasks + nested_ids + [row['id'] for row in subtask_rows]))
+
+    session.commit()
+
+    # One summary event; clients fetch the details with ?since_version
+    publish('tasks_batch', {
+        'message': 'Tasks updated in batch',
+        'version': version,
+        'tasks': {
+            'created': [row['id'] for row in task_rows],
+            'updated': [values['id'] for _, values in plan['task_update']],
+            'deleted': deleted_tasks
+        },
+        'subtasks': {
+            'created': [row['id'] for row in subtask_rows],
+            'updated': [values['id'] for _, values in plan['subtask_update']],
+            'deleted': sorted(set(deleted_subtasks + orphaned))
+        }
+    }, workspace_id)
+    return jsonify({'version': version, 'results': results}), 200
@@ -0,0 +1,848 @@
+"""Benchmark harness for the REST endpoints and Socket.IO events.
+
+Seeds a synthetic dataset into a scratch database, drives the real routes
+through the Flask test client and the socket handlers through the Socket.IO
+test client, and reports throughput, p50/p95/p99 latency and SQL queries per
+request as JSON that can be diffed between commits:
+
+    python bench.py --output before.json
+    python bench.py --output after.json --compare before.json
+    python bench.py --scenario search --tasks 100000 --workspaces 1
+    DATABASE_ENGINE_PROFILE=default python bench.py --scenario write_contention
+
+Scenarios that launch servers (``http``) are opt-in; see ``--list``.
+"""
+import argparse
+import contextlib
+import json
+import math
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+from datetime import datetime, timedelta
+
+PASSWORD = 'bench-password'
+WORDS = ('login', 'signup', 'board', 'card', 'socket', 'export', 'import', 'search', 'cache', 'index',
+         'deploy', 'review', 'design', 'mobile', 'payment', 'invoice', 'report', 'dashboard', 'email', 'backup',
+         'refactor', 'migration', 'release', 'sprint', 'planning', 'onboarding', 'billing', 'webhook', 'oauth', 'audit')
+STATUSES = ('Planned', 'In Progress', 'Done')
+PRIORITIES = ('low', 'medium', 'high')
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+SCENARIOS = {}
+
+
+def scenario(name, default=True):
+    """Register a benchmark; ``default=False`` ones only run when named explicitly."""
+    def register(fn):
+        SCENARIOS[name] = (fn, default)
+        return fn
+    return register
+
+
+# Helper functions for timing and summarizing
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    # Nearest-rank percentile
+    index = min(len(sorted_values) - 1, max(0, math.ceil(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def summarize(latencies, elapsed, queries=None, errors=0, **extra):
+    ordered = sorted(latencies)
+    result = {
+        'requests': len(latencies),
+        'errors': errors,
+        'throughput_rps': round(len(latencies) / elapsed, 2) if elapsed else None,
+        'mean_ms': round(sum(ordered) / len(ordered) * 1000, 3) if ordered else None,
+        'p50_ms': round(percentile(ordered, 0.50) * 1000, 3) if ordered else None,
+        'p95_ms': round(percentile(ordered, 0.95) * 1000, 3) if ordered else None,
+        'p99_ms': round(percentile(ordered, 0.99) * 1000, 3) if ordered else None,
+        'queries_per_request': round(queries / len(latencies), 2) if queries is not None and latencies else None,
+    }
+    result.update(extra)
+    return result
+
+
+class QueryCounter:
+    """Counts statements sent to the database engine."""
+
+    def __init__(self, engine):
+        from sqlalchemy import event
+        self.count = 0
+        event.listen(engine, 'before_cursor_execute', self._count)
+
+    def _count(self, *args):
+        self.count += 1
+
+
+def measure(ctx, fn, requests, warmup=3, **extra):
+    """Call ``fn(i)`` ``requests`` times; a falsy or 4xx/5xx result counts as an error."""
+    for i in range(min(warmup, requests)):
+        fn(i)
+    latencies, errors = [], 0
+    queries = ctx.queries.count
+    start = time.perf_counter()
+    for i in range(requests):
+        began = time.perf_counter()
+        response = fn(i)
+        latencies.append(time.perf_counter() - began)
+        status = getattr(response, 'status_code', 200 if response is not False else 500)
+        if status >= 400:
+            errors += 1
+    elapsed = time.perf_counter() - start
+    return summarize(latencies, elapsed, ctx.queries.count - queries, errors, **extra)
+
+
+@contextlib.contextmanager
+def response_cache(enabled):
+    """Run with the response cache on or off; listings measured with it on are served from memory."""
+    import cache
+    backend = cache.backend
+    if not enabled:
+        cache.backend = None
+    try:
+        yield
+    finally:
+        cache.backend = backend
+
+
+class Context:
+    """Everything a scenario needs: the app, clients, seeded ids and options."""
+
+    def __init__(self, args, app, db, socketio):
+        self.args = args
+        self.app = app
+        self.db = db
+        self.socketio = socketio
+        self.client = app.test_client()
+        with app.app_context():
+            self.queries = QueryCounter(db.engine)
+        self.workspace_ids = []
+        self.task_ids = {}
+        self.user_ids = []
+        self.token = None
+        self.random = random.Random(args.seed)
+
+    @property
+    def headers(self):
+        return {'Authorization': f'Bearer {self.token}'}
+
+    def socket_client(self):
+        return self.socketio.test_client(self.app, query_string=f'token={self.token}')
+
+
+# Helper functions for seeding the synthetic dataset
+def _words(rng, count):
+    return ' '.join(rng.choice(WORDS) for _ in range(count))
+
+
+def seed_workspace(ctx, name, tasks, subtasks_per_task):
+    """Insert one workspace with ``tasks`` tasks in bulk and index it; returns its id."""
+    from models import Workspace, Task, SubTask, UserWorkspaceRole
+    import search
+    import stats
+    db, rng = ctx.db, ctx.random
+    session = db.session
+    workspace = Workspace(name=name, description=_words(rng, 6))
+    session.add(workspace)
+    session.flush()
+    session.execute(db.insert(UserWorkspaceRole), [
+        {'user_id': user_id, 'workspace_id': workspace.id, 'role': 'admin' if index == 0 else 'member'}
+        for index, user_id in enumerate(ctx.user_ids) if index == 0 or rng.random() < 0.5
+    ])
+
+    now = datetime.utcnow()
+    for start in range(0, tasks, 5000):
+        session.execute(db.insert(Task), [{
+            'title': _words(rng, 4),
+            'description': _words(rng, 20),
+            'status': rng.choice(STATUSES),
+            'priority': rng.choice(PRIORITIES),
+            'estimated_time': rng.randint(1, 16),
+            'actual_time': rng.randint(0, 16),
+            'due_date': now + timedelta(days=rng.randint(-30, 60)),
+            'workspace_id': workspace.id,
+            'assignee_id': rng.choice(ctx.user_ids),
+            'sync_version': 1,
+            'created_at': now,
+            'updated_at': now - timedelta(seconds=rng.randint(0, 10 ** 6)),
+        } for _ in range(start, min(tasks, start + 5000))])
+    task_ids = session.execute(db.select(Task.id).where(Task.workspace_id == workspace.id)).scalars().all()
+
+    rows = [{'task_id': task_id, 'title': _words(rng, 3), 'is_completed': rng.random() < 0.4,
+             'assignee_id': rng.choice(ctx.user_ids), 'sync_version': 1, 'created_at': now, 'updated_at': now}
+            for task_id in task_ids for _ in range(subtasks_per_task)]
+    for start in range(0, len(rows), 5000):
+        session.execute(db.insert(SubTask), rows[start:start + 5000])
+
+    session.execute(db.update(Workspace).where(Workspace.id == workspace.id).values(version=1))
+    search.index_workspace(session, workspace.id)
+    stats.rebuild(session, workspace.id)
+    session.commit()
+    ctx.task_ids[workspace.id] = task_ids
+    return workspace.id
+
+
+def seed(ctx):
+    from flask_jwt_extended import create_access_token
+    from models import User
+    from passwords import hash_password
+    args, db = ctx.args, ctx.db
+    with ctx.app.app_context():
+        password_hash = hash_password(PASSWORD)
+        db.session.execute(db.insert(User), [
+            {'username': f'bench{i}', 'email': f'bench{i}@example.com', 'password_hash': password_hash}
+            for i in range(args.users)
+        ])
+        ctx.user_ids = db.session.execute(db.select(User.id).order_by(User.id)).scalars().all()
+        for i in range(args.workspaces):
+            ctx.workspace_ids.append(seed_workspace(ctx, f'Workspace {i}', args.tasks, args.subtasks))
+        ctx.token = create_access_token(identity=ctx.user_ids[0])
+
+
+# REST scenarios (read-only first; writers run after them)
+@scenario('list_tasks')
+def list_tasks(ctx):
+    """The full listing built from the database, then served from a warm response cache."""
+    workspace_id = ctx.workspace_ids[0]
+    results = {}
+    for label, enabled in (('cold', False), ('warm', True)):
+        with response_cache(enabled):
+            results[f'list_tasks[cache={label}]'] = measure(ctx, lambda i: ctx.client.get(
+                f'/workspaces/{workspace_id}/tasks', headers=ctx.headers), ctx.args.requests)
+    return results
+
+
+@scenario('list_tasks_page')
+def list_tasks_page(ctx):
+    workspace_id = ctx.workspace_ids[0]
+    with response_cache(False):
+        return {'list_tasks_page': measure(ctx, lambda i: ctx.client.get(
+            f'/workspaces/{workspace_id}/tasks?limit=50', headers=ctx.headers), ctx.args.requests)}
+
+
+@scenario('list_tasks_filtered')
+def list_tasks_filtered(ctx):
+    workspace_id = ctx.workspace_ids[0]
+    with response_cache(False):
+        return {'list_tasks_filtered': measure(ctx, lambda i: ctx.client.get(
+            f'/workspaces/{workspace_id}/tasks?status=Planned&sort=due_date', headers=ctx.headers),
+            ctx.args.requests)}
+
+
+@scenario('list_tasks_not_modified')
+def list_tasks_not_modified(ctx):
+    workspace_id = ctx.workspace_ids[0]
+    etag = ctx.client.get(f'/workspaces/{workspace_id}/tasks?limit=50', headers=ctx.headers).headers.get('ETag')
+    headers = dict(ctx.headers, **{'If-None-Match': etag})
+    return {'list_tasks_not_modified': measure(ctx, lambda i: ctx.client.get(
+        f'/workspaces/{workspace_id}/tasks?limit=50', headers=headers), ctx.args.requests)}
+
+
+@scenario('query_scaling')
+def query_scaling(ctx):
+    """Queries and latency of the full listing as the board grows, with the response cache off.
+
+    ``loading=per_row`` is the listing as it was before batching: every task's
+    ``to_dict`` loads its subtasks through the lazy relationship.
+    """
+    from flask import jsonify
+    from models import Task
+    results = {}
+    for size in ctx.args.scaling_sizes:
+        with ctx.app.app_context():
+            workspace_id = seed_workspace(ctx, f'Scaling {size}', size, ctx.args.subtasks)
+        requests = max(5, ctx.args.requests // 10)
+        with ctx.app.test_request_context():
+            def per_row(i):
+                response = jsonify([task.to_dict() for task in Task.query.filter_by(workspace_id=workspace_id)])
+                ctx.db.session.remove()
+                return response
+            results[f'query_scaling[tasks={size},loading=per_row]'] = measure(ctx, per_row, requests)
+        with response_cache(False):
+            results[f'query_scaling[tasks={size},loading=batched]'] = measure(ctx, lambda i: ctx.client.get(
+                f'/workspaces/{workspace_id}/tasks', headers=ctx.headers), requests)
+    return results
+
+
+@scenario('get_task')
+def get_task(ctx):
+    workspace_id = ctx.workspace_ids[0]
+    task_ids = ctx.task_ids[workspace_id]
+    return {'get_task': measure(ctx, lambda i: ctx.client.get(
+        f'/workspaces/{workspace_id}/tasks/{task_ids[i % len(task_ids)]}', headers=ctx.headers), ctx.args.requests)}
+
+
+@scenario('search')
+def search_tasks(ctx):
+    """Two-word queries against the search index, and the same matches found by a LIKE scan."""
+    from models import Task, SubTask
+    workspace_id = ctx.workspace_ids[0]
+    words = lambda i: (WORDS[i % len(WORDS)], WORDS[(i * 7) % len(WORDS)])
+
+    def matches(model, columns, i):
+        return model.query.filter(*[ctx.db.or_(*[column.ilike(f'%{word}%') for column in columns])
+                                    for word in words(i)])
+
+    def scan(i):
+        # Ranking needs every match, so the scan cannot stop at the first page
+        tasks = matches(Task, (Task.title, Task.description), i).filter(Task.workspace_id == workspace_id)
+        subtasks = matches(SubTask, (SubTask.title,), i).join(Task).filter(Task.workspace_id == workspace_id)
+        found = [row.id for row in tasks.with_entities(Task.id)] + [row.id for row in subtasks.with_entities(SubTask.id)]
+        ctx.db.session.remove()
+        return found
+
+    with ctx.app.app_context():
+        scanned = measure(ctx, scan, max(5, ctx.args.requests // 10))
+    return {
+        'search': measure(ctx, lambda i: ctx.client.get(
+            f'/workspaces/{workspace_id}/search?q={"+".join(words(i))}', headers=ctx.headers), ctx.args.requests),
+        'search[scan=like]': scanned,
+    }
+
+
+@scenario('stats')
+def workspace_stats(ctx):
+    workspace_id = ctx.workspace_ids[0]
+    return {'stats': measure(ctx, lambda i: ctx.client.get(
+        f'/workspaces/{workspace_id}/stats', headers=ctx.headers), ctx.args.requests)}
+
+
+@scenario('serialization')
+def serialization(ctx):
+    """Rows per second of the ORM to_dict path against the column projection path, per list endpoint."""
+    from flask import jsonify
+    from sqlalchemy.orm import selectinload
+    from models import Task, SubTask, User
+    from serializers import json_response, task_dicts, subtask_dicts, user_dicts
+    workspace_id = ctx.workspace_ids[0]
+    # Listing -> query for it, and its projection serializer
+    listings = {
+        # Subtasks are loaded in one query on both paths, so only the serialization differs
+        'tasks': (lambda: Task.query.filter_by(workspace_id=workspace_id).options(selectinload(Task.subtasks)),
+                  task_dicts),
+        'subtasks': (lambda: SubTask.query.join(Task).filter(Task.workspace_id == workspace_id), subtask_dicts),
+        'users': (lambda: User.query, user_dicts),
+    }
+    results = {}
+    for listing, (query, serialize) in listings.items():
+        with ctx.app.app_context():
+            rows = query().count()
+        paths = {
+            'orm': lambda: jsonify([row.to_dict() for row in query()]),
+            'projection': lambda: json_response(serialize(query())),
+        }
+        for label, build in paths.items():
+            with ctx.app.test_request_context():
+                def run(i):
+                    response = build()
+                    ctx.db.session.remove()
+                    return response
+                result = measure(ctx, run, max(5, ctx.args.requests // 10))
+            result['rows_per_second'] = round(rows / (result['mean_ms'] / 1000), 1) if result['mean_ms'] else None
+            results[f'serialization[{listing},{label}]'] = result
+    return results
+
+
+@scenario('login')
+def login(ctx):
+    return {'login': measure(ctx, lambda i: ctx.client.post('/auth/login', json={
+        'username': f'bench{i % len(ctx.user_ids)}', 'password': PASSWORD}), ctx.args.login_requests, warmup=1)}
+
+
+@scenario('create_task')
+def create_task(ctx):
+    workspace_id = ctx.workspace_ids[-1]
+    return {'create_task': measure(ctx, lambda i: ctx.client.post(
+        f'/workspaces/{workspace_id}/tasks', json={'title': _words(ctx.random, 4), 'description': _words(ctx.random, 20),
+                                                  'priority': 'medium', 'due_date': '2030-01-01T00:00:00.000Z'},
+        headers=ctx.headers), ctx.args.requests)}
+
+
+@scenario('update_task')
+def update_task(ctx):
+    workspace_id = ctx.workspace_ids[-1]
+    task_ids = ctx.task_ids[workspace_id]
+    return {'update_task': measure(ctx, lambda i: ctx.client.put(
+        f'/workspaces/{workspace_id}/tasks/{task_ids[i % len(task_ids)]}',
+        json={'title': _words(ctx.random, 4), 'status': STATUSES[i % len(STATUSES)], 'priority': 'high'},
+        headers=ctx.headers), ctx.args.requests)}
+
+
+@scenario('batch')
+def batch(ctx):
+    workspace_id = ctx.workspace_ids[-1]
+    size = ctx.args.batch_size
+    operations = lambda i: [{'op': 'create', 'data': {'title': _words(ctx.random, 4),
+                                                       'subtasks': [{'title': 'step'}] * ctx.args.subtasks}}
+                            for _ in range(size)]
+    result = measure(ctx, lambda i: ctx.client.post(
+        f'/workspaces/{workspace_id}/tasks:batch', json={'operations': operations(i)}, headers=ctx.headers),
+        max(3, ctx.args.requests // 20), warmup=1, operations_per_request=size)
+    result['operations_per_second'] = round(size / (result['mean_ms'] / 1000), 1) if result['mean_ms'] else None
+    return {'batch': result}
+
+
+# Socket.IO scenarios
+def _connect(ctx, count, workspace_id):
+    clients = []
+    for _ in range(count):
+        client = ctx.socket_client()
+        if workspace_id is not None:
+            client.emit('join_workspace', {'workspace_id': workspace_id})
+        client.get_received()
+        clients.append(client)
+    return clients
+
+
+@scenario('socket_events')
+def socket_events(ctx):
+    """Events per second a single connection gets through, and the queries each one costs."""
+    workspace_id = ctx.workspace_ids[0]
+    task_ids = ctx.task_ids[workspace_id]
+    ctx.app.config['SOCKET_COALESCE_INTERVAL'] = 0
+    client = _connect(ctx, 1, workspace_id)[0]
+    results = {
+        # Pure authorization: answered from the connection's session
+        'socket_events[join_workspace]': measure(
+            ctx, lambda i: client.emit('join_workspace', {'workspace_id': workspace_id}), ctx.args.requests),
+        'socket_events[update_task]': measure(
+            ctx, lambda i: client.emit('update_task', {'id': task_ids[i % len(task_ids)], 'title': f'event {i}'}),
+            ctx.args.requests),
+    }
+    client.disconnect()
+    ctx.app.config['SOCKET_COALESCE_INTERVAL'] = ctx.coalesce_interval
+    return results
+
+
+@scenario('socket_fanout')
+def socket_fanout(ctx):
+    """Cost of one task update as total connections grow but the room stays the same size.
+
+    ``emit=room`` and ``emit=broadcast`` time the emit alone: to the
+    workspace's room, and to every connection as task events were sent
+    before rooms.
+    """
+    from pubsub import publish
+    room_size = ctx.args.room_size
+    workspace_id = ctx.workspace_ids[0]
+    others = ctx.workspace_ids[1:]
+    task_id = ctx.task_ids[workspace_id][0]
+    payload = {'message': 'Task updated successfully', 'task': {'id': task_id, 'title': 'fanout'}}
+    ctx.app.config['SOCKET_COALESCE_INTERVAL'] = 0
+    results = {}
+    for connections in (room_size, room_size * 10):
+        members = _connect(ctx, room_size, workspace_id)
+        bystanders = [client for index in range(connections - room_size)
+                      for client in _connect(ctx, 1, others[index % len(others)] if others else None)]
+        sender = members[0]
+        # Label suffix -> one update; the bare label is the whole update_task handler
+        emitters = {
+            '': lambda i: sender.emit('update_task', {'id': task_id, 'title': f'fanout {i}'}),
+            ',emit=room': lambda i: publish('task_response', payload, workspace_id),
+            ',emit=broadcast': lambda i: ctx.socketio.emit('task_response', payload),
+        }
+        for suffix, emit in emitters.items():
+            with ctx.app.app_context():
+                result = measure(ctx, emit, ctx.args.requests)
+            result['deliveries_per_emit'] = round(
+                sum(len(client.get_received()) for client in members + bystanders) / (ctx.args.requests + 3), 2)
+            results[f'socket_fanout[room={room_size},connections={connections}{suffix}]'] = result
+        for client in members + bystanders:
+            client.disconnect()
+    ctx.app.config['SOCKET_COALESCE_INTERVAL'] = ctx.coalesce_interval
+    return results
+
+
+@scenario('socket_updates')
+def socket_updates(ctx):
+    """Emits and bytes a room member receives for a burst of edits to one task.
+
+    ``payload=full_task`` replays the burst as updates were sent before
+    field-level diffs: the whole task, subtasks included, on every edit.
+    """
+    from models import Task
+    from pubsub import publish
+    workspace_id = ctx.workspace_ids[0]
+    task_id = ctx.task_ids[workspace_id][1 % len(ctx.task_ids[workspace_id])]
+
+    def send_full(i):
+        task = Task.query.get(task_id)
+        task.title = f'typing {i}'
+        ctx.db.session.commit()
+        publish('task_response', {'message': 'Task updated successfully', 'task': task.to_dict()}, workspace_id)
+        ctx.db.session.remove()
+
+    results = {}
+    runs = [(0, 'full_task')] + [(interval, 'diff') for interval in sorted({0, ctx.coalesce_interval})]
+    for interval, payload in runs:
+        ctx.app.config['SOCKET_COALESCE_INTERVAL'] = interval
+        sender, receiver = _connect(ctx, 2, workspace_id)
+        with ctx.app.app_context():
+            if payload == 'full_task':
+                result = measure(ctx, send_full, ctx.args.requests, warmup=0)
+            else:
+                result = measure(ctx, lambda i: sender.emit('update_task', {'id': task_id, 'title': f'typing {i}'}),
+                                 ctx.args.requests, warmup=0)
+        ctx.socketio.sleep(interval * 2 + 0.01)
+        received = [message for message in receiver.get_received() if message['name'] == 'task_response']
+        size = sum(len(json.dumps(message['args'], default=str)) for message in received)
+        result.update(emits_received=len(received), bytes_received=size,
+                      bytes_per_update=round(size / ctx.args.requests, 1))
+        label = f'coalesce={interval}' if payload == 'diff' else f'coalesce={interval},payload={payload}'
+        results[f'socket_updates[{label}]'] = result
+        sender.disconnect()
+        receiver.disconnect()
+    ctx.app.config['SOCKET_COALESCE_INTERVAL'] = ctx.coalesce_interval
+    return results
+
+
+@scenario('socket_wire')
+def socket_wire(ctx):
+    """Bytes on the wire and encode time per event for each negotiable encoding, plain and deflated."""
+    import zlib
+    from socketio import packet
+    from models import Task
+    from serializers import task_update_payload, task_dicts
+    import wire
+    workspace_id = ctx.workspace_ids[0]
+    task_ids = ctx.task_ids[workspace_id]
+    results = {}
+    with ctx.app.app_context():
+        task = Task.query.get(task_ids[0])
+        events = {
+            'task_created': {'message': 'Task created successfully', 'task': task.to_dict()},
+            'task_updated': task_update_payload(task.id, task.sync_version + 1, datetime.utcnow(),
+                                                {'title': task.title, 'status': 'Done'}),
+            'task_moved': {'id': task.id, 'position': 'i8', 'version': task.sync_version + 1,
+                           'updated_at': datetime.utcnow()},
+            'board': {'tasks': task_dicts(Task.query.filter(Task.id.in_(task_ids[:50])))},
+        }
+        packet_class = ctx.socketio.server.packet_class
+        for event, payload in events.items():
+            for encoding in wire.ENCODINGS:
+                def encode(i):
+                    return packet_class(packet.EVENT, data=[event, wire.encode(payload, encoding)],
+                                        namespace='/').encode()
+                result = measure(ctx, encode, ctx.args.requests)
+                # A binary event is a text header frame plus one frame per attachment
+                frames = encode(0)
+                frames = frames if isinstance(frames, list) else [frames]
+                sizes = [len(frame.encode() if isinstance(frame, str) else frame) for frame in frames]
+                # As the first permessage-deflate message of a connection
+                compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -zlib.MAX_WBITS)
+                deflated = 0
+                for frame in frames:
+                    data = frame.encode() if isinstance(frame, str) else frame
+                    deflated += len(compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)) - 4
+                result.update(bytes_per_event=sum(sizes), deflated_bytes_per_event=deflated,
+                              encode_us=round(result['mean_ms'] * 1000, 1))
+                results[f'socket_wire[{event},{encoding}]'] = result
+    return results
+
+
+@scenario('login_burst')
+def login_burst(ctx):
+    """Event loop lag seen by socket traffic while logins hash passwords concurrently.
+
+    ``hashing=inline`` hashes on the event loop, as logins did before the
+    hashing pool.
+    """
+    import passwords
+    workspace_id = ctx.workspace_ids[0]
+    tick = 0.005
+    results = {}
+    run = passwords._run
+    for burst, hashing in ((0, 'pool'), (ctx.args.burst, 'inline'), (ctx.args.burst, 'pool')):
+        passwords._run = run if hashing == 'pool' else lambda fn, *args: fn(*args)
+        stop = []
+        logins = []
+
+        def log_in(index):
+            client = ctx.app.test_client()
+            while not stop:
+                client.post('/auth/login', json={'username': f'bench{index % len(ctx.user_ids)}', 'password': PASSWORD})
+                logins.append(1)
+                # A served request yields while writing its response
+                ctx.socketio.sleep(0)
+
+        for index in range(burst):
+            ctx.socketio.start_background_task(log_in, index)
+        listener = _connect(ctx, 1, workspace_id)[0]
+        lags = []
+        start = time.perf_counter()
+        for _ in range(ctx.args.requests):
+            began = time.perf_counter()
+            ctx.socketio.sleep(tick)
+            listener.emit('leave_workspace', {'workspace_id': workspace_id})
+            lags.append(max(0.0, time.perf_counter() - began - tick))
+        elapsed = time.perf_counter() - start
+        stop.append(True)
+        ctx.socketio.sleep(0.5)
+        listener.disconnect()
+        label = f'logins={burst}' if not burst else f'logins={burst},hashing={hashing}'
+        results[f'login_burst[{label}]'] = summarize(lags, elapsed, logins_completed=len(logins))
+    passwords._run = run
+    return results
+
+
+# Database and server scenarios
+@scenario('write_contention')
+def write_contention(ctx):
+    """Concurrent task writes from real threads: Flask-SQLAlchemy's default engine, then the configured profile."""
+    from sqlalchemy import create_engine
+    from sqlalchemy.exc import OperationalError
+    from engines import ENGINE_PROFILES, engine_profile, install_pragmas, sqlite_pragmas
+    from models import Task
+    workspace_id = ctx.workspace_ids[-1]
+    task_ids = ctx.task_ids[workspace_id]
+    uri = ctx.app.config['SQLALCHEMY_DATABASE_URI']
+    results = {}
+    for profile in dict.fromkeys(('default', engine_profile(ctx.app.config))):
+        config = dict(ctx.app.config, DATABASE_ENGINE_PROFILE=profile)
+        with ctx.app.app_context():
+            ctx.db.session.remove()
+            ctx.db.engine.dispose()
+        engine = create_engine(uri, **ENGINE_PROFILES[profile](config))
+        install_pragmas(engine, sqlite_pragmas(config))
+        if uri.startswith('sqlite') and profile == 'default':
+            # WAL outlives the connections that turned it on; go back to the rollback journal
+            with engine.connect() as connection:
+                connection.exec_driver_sql('PRAGMA journal_mode = DELETE')
+        session = ctx.db.create_scoped_session(options={'bind': engine})
+        latencies, errors = [], []
+
+        def write(count):
+            with ctx.app.app_context():
+                for i in range(count):
+                    began = time.perf_counter()
+                    try:
+                        task = session.query(Task).get(task_ids[i % len(task_ids)])
+                        task.title = f'contended {i}'
+                        session.add(Task(title=f'writer {i}', workspace_id=workspace_id))
+                        session.commit()
+                        latencies.append(time.perf_counter() - began)
+                    except OperationalError:
+                        session.rollback()
+                        errors.append(1)
+                session.remove()
+
+        threads = [threading.Thread(target=write, args=(ctx.args.requests // ctx.args.threads,))
+                   for _ in range(ctx.args.threads)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        engine.dispose()
+        results[f'write_contention[{profile},threads={ctx.args.threads}]'] = summarize(
+            latencies, elapsed, errors=len(errors))
+    return results
+
+
+def _run_python(code, env):
+    began = time.perf_counter()
+    subprocess.run([sys.executable, '-c', code], cwd=BASE_DIR, env=env, check=True,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return time.perf_counter() - began
+
+
+@scenario('startup')
+def startup(ctx):
+    """Process start to a ready app, with and without creating the schema on boot."""
+    env = dict(os.environ, DATABASE_URL=ctx.args.database_url)
+    runs = max(3, ctx.args.requests // 50)
+    results = {}
+    for label, code in (('import', 'import app'),
+                        ('import+init_db', 'import app\nwith app.app.app_context(): app.init_db()')):
+        timings = [_run_python(code, env) for _ in range(runs)]
+        results[f'startup[{label}]'] = summarize(timings, sum(timings))
+    return results
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def _wait_for(url, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            urllib.request.urlopen(url, timeout=1)
+            return
+        except urllib.error.HTTPError:
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f'Server did not start: {url}')
+
+
+@scenario('http', default=False)
+def http(ctx):
+    """Throughput over real sockets: the debug server against gunicorn workers, with the response cache off."""
+    ctx.db.session.remove()
+    results = {}
+    modes = [('dev', ['--dev'])] + [(f'gunicorn,workers={workers}', ['--workers', str(workers)])
+                                    for workers in ctx.args.server_workers]
+    for label, options in modes:
+        port = _free_port()
+        # Each worker would fill its own local cache; measure the requests rather than the caches
+        env = dict(os.environ, DATABASE_URL=ctx.args.database_url, SOCKETIO_MESSAGE_QUEUE='local://',
+                   RESPONSE_CACHE='none')
+        process = subprocess.Popen([sys.executable, 'serve.py', '--bind', f'127.0.0.1:{port}'] + options,
+                                   cwd=BASE_DIR, env=env, start_new_session=True,
+                                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            url = f'http://127.0.0.1:{port}/workspaces/{ctx.workspace_ids[0]}/tasks?limit=50'
+            _wait_for(url)
+            latencies, errors = [], []
+            lock = threading.Lock()
+
+            def fetch(count):
+                for _ in range(count):
+                    request = urllib.request.Request(url, headers=ctx.headers)
+                    began = time.perf_counter()
+                    try:
+                        urllib.request.urlopen(request, timeout=30).read()
+                    except OSError:
+                        errors.append(1)
+                    with lock:
+                        latencies.append(time.perf_counter() - began)
+
+            threads = [threading.Thread(target=fetch, args=(ctx.args.requests // ctx.args.threads,))
+                       for _ in range(ctx.args.threads)]
+            start = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            results[f'http[{label}]'] = summarize(latencies, time.perf_counter() - start, errors=len(errors))
+        finally:
+            os.killpg(process.pid, 15)
+            process.wait()
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BASE_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline):
+    """Print the change in p50 latency and throughput against an earlier results file."""
+    for name, result in results['scenarios'].items():
+        before = baseline.get('scenarios', {}).get(name)
+        if not before:
+            continue
+        changes = []
+        for key in ('p50_ms', 'throughput_rps', 'queries_per_request'):
+            if before.get(key) and result.get(key) is not None:
+                changes.append(f'{key} {before[key]} -> {result[key]} ({(result[key] - before[key]) / before[key]:+.1%})')
+        print(f'{name}: ' + ', '.join(changes), file=sys.stderr)
+
+
+def parse_args(argv):
+    sizes = lambda value: [int(size) for size in value.split(',') if size]
+    parser = argparse.ArgumentParser(description='Benchmark the Trello API against a seeded scratch database.')
+    parser.add_argument('--scenario', action='append', help='scenario to run (repeatable; default: all default ones)')
+    parser.add_argument('--list', action='store_true', help='list scenarios and exit')
+    parser.add_argument('--database-url', help='database to seed (default: a temporary SQLite file)')
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--workspaces', type=int, default=3)
+    parser.add_argument('--tasks', type=int, default=500, help='tasks per workspace')
+    parser.add_argument('--subtasks', type=int, default=3, help='subtasks per task')
+    parser.add_argument('--requests', type=int, default=200, help='requests per scenario')
+    parser.add_argument('--login-requests', type=int, default=20)
+    parser.add_argument('--batch-size', type=int, default=100)
+    parser.add_argument('--scaling-sizes', type=sizes, default=[10, 100, 1000])
+    parser.add_argument('--room-size', type=int, default=10)
+    parser.add_argument('--burst', type=int, default=8, help='concurrent logins in login_burst')
+    parser.add_argument('--threads', type=int, default=8, help='concurrent writers/clients')
+    parser.add_argument('--server-workers', type=sizes, default=sorted({1, os.cpu_count() or 2}),
+                        help='gunicorn worker counts for http (default: 1 and one per CPU)')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help='write JSON results here instead of stdout')
+    parser.add_argument('--compare', help='earlier JSON results to compare against')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.list:
+        for name, (fn, default) in SCENARIOS.items():
+            print(f"{name}{'' if default else ' (opt-in)'}: {(fn.__doc__ or '').strip()}")
+        return
+    names = args.scenario or [name for name, (_, default) in SCENARIOS.items() if default]
+    unknown = [name for name in names if name not in SCENARIOS]
+    if unknown:
+        raise SystemExit(f'Unknown scenario(s): {", ".join(unknown)}')
+
+    scratch = None
+    if not args.database_url:
+        scratch = tempfile.mkdtemp(prefix='trello-bench-')
+        args.database_url = f'sqlite:///{os.path.join(scratch, "bench.db")}'
+    # The app reads its configuration on import
+    os.environ['DATABASE_URL'] = args.database_url
+
+    # Socket handlers print to stdout; keep it clean for the JSON results
+    with contextlib.redirect_stdout(sys.stderr):
+        from app import app, db, socketio, init_db
+        from engines import engine_profile
+        with app.app_context():
+            init_db()
+        ctx = Context(args, app, db, socketio)
+        ctx.coalesce_interval = app.config['SOCKET_COALESCE_INTERVAL']
+        began = time.perf_counter()
+        seed(ctx)
+        seconds = time.perf_counter() - began
+        print(f'Seeded {args.workspaces} x {args.tasks} tasks in {seconds:.1f}s', file=sys.stderr)
+
+        scenarios = {}
+        for name in names:
+            for label, result in SCENARIOS[name][0](ctx).items():
+                scenarios[label] = result
+                print(f"{label:55} {result['throughput_rps'] or 0:>10.1f} rps  p50 {result['p50_ms']} ms  "
+                      f"p99 {result['p99_ms']} ms  queries {result['queries_per_request']}", file=sys.stderr)
+
+    results = {
+        'meta': {
+            'commit': git_commit(),
+            'timestamp': datetime.utcnow().isoformat() + 'Z',
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'engine_profile': engine_profile(app.config),
+            'database': args.database_url.split('://')[0],
+            'async_mode': socketio.async_mode,
+            'dataset': {'users': args.users, 'workspaces': args.workspaces, 'tasks': args.tasks,
+                        'subtasks': args.subtasks, 'seed': args.seed, 'seed_seconds': round(seconds, 2)},
+        },
+        'scenarios': scenarios,
+    }
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+    output = json.dumps(results, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
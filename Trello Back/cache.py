@@ -0,0 +1,103 @@
+from collections import OrderedDict
+from flask import request
+from app import app
+from locks import WorkerLock
+import metrics
+
+try:
+    import redis
+except ImportError:  # pragma: no cover - redis is only needed for a shared cache
+    redis = None
+
+
+class LocalCache:
+    """In-process LRU of response bodies bounded by their total size in bytes."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._data = OrderedDict()
+        self._lock = WorkerLock()
+
+    def get(self, key):
+        with self._lock:
+            body = self._data.get(key)
+            if body is not None:
+                self._data.move_to_end(key)
+            return body
+
+    def set(self, key, body):
+        with self._lock:
+            previous = self._data.pop(key, None)
+            if previous is not None:
+                self.size -= len(previous)
+            self._data[key] = body
+            self.size += len(body)
+            while self.size > self.max_bytes:
+                _, evicted = self._data.popitem(last=False)
+                self.size -= len(evicted)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.size = 0
+
+
+class RedisCache:
+    """Shared cache for several workers; stale generations simply expire."""
+
+    def __init__(self, url, ttl):
+        if redis is None:
+            raise RuntimeError('RESPONSE_CACHE points at Redis but the redis package is not installed')
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl
+
+    def get(self, key):
+        return self.client.get(key)
+
+    def set(self, key, body):
+        self.client.set(key, body, ex=self.ttl)
+
+    def clear(self):
+        for key in self.client.scan_iter('trello:response:*'):
+            self.client.delete(key)
+
+
+def _select_backend():
+    setting = app.config['RESPONSE_CACHE']
+    if setting == 'none':
+        return None
+    if setting == 'local':
+        return LocalCache(app.config['RESPONSE_CACHE_MAX_BYTES'])
+    return RedisCache(setting, app.config['RESPONSE_CACHE_TTL'])
+
+
+backend = _select_backend()
+
+
+def cached_response(kind, generation, view):
+    """Serve ``view``'s JSON body from the cache, keyed on the generation and the query string.
+
+    ``generation`` must change whenever the underlying data does; every write
+    path bumps the workspace version, so old entries are never read again and
+    just age out. Only 200 responses are stored.
+    """
+    if backend is None:
+        return view()
+
+    key = f'trello:response:{kind}:{generation}:{request.query_string.decode()}'
+    body = backend.get(key)
+    if body is not None:
+        metrics.cache_requests.inc(kind, 'hit')
+        response = app.response_class(body, mimetype='application/json')
+        response.headers['X-Cache'] = 'HIT'
+        return response, 200
+
+    metrics.cache_requests.inc(kind, 'miss')
+    response, status = view()
+    if status == 200 and not response.is_streamed:
+        body = response.get_data()
+        if len(body) <= app.config['RESPONSE_CACHE_MAX_ENTRY_BYTES']:
+            backend.set(key, body)
+        response.headers['X-Cache'] = 'MISS'
+    return response, status
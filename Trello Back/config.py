@@ -1,4 +1,5 @@
 import os
+import tempfile
 
 basedir = os.path.abspath(os.path.dirname(__file__))
 
@@ -6,5 +7,71 @@ class Config:
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'supersecretkey'
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or 'sqlite:///' + os.path.join(basedir, 'app.db')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # default, sqlite-wal or mysql-pooled (see engines.py); auto picks one from the URL
+    DATABASE_ENGINE_PROFILE = os.environ.get('DATABASE_ENGINE_PROFILE', 'auto')
+    DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 10))
+    DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', 20))
+    DB_POOL_TIMEOUT = int(os.environ.get('DB_POOL_TIMEOUT', 30))
+    DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', 280))
+    SQLITE_BUSY_TIMEOUT = int(os.environ.get('SQLITE_BUSY_TIMEOUT', 5000))
+    SQLITE_MMAP_SIZE = int(os.environ.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024))
     JWT_SECRET_KEY = os.environ.get('JWT_SECRET_KEY') or 'supersecretjwtkey'
     JWT_ACCESS_TOKEN_EXPIRES = 7200
+    # None for a single process, local:// for the in-process stand-in, or a
+    # broker URL such as redis://host:6379/0 to share events between workers
+    SOCKETIO_MESSAGE_QUEUE = os.environ.get('SOCKETIO_MESSAGE_QUEUE')
+    # pbkdf2 work factor and the size of the thread pool hashing runs on
+    PASSWORD_HASH_ITERATIONS = int(os.environ.get('PASSWORD_HASH_ITERATIONS', 260000))
+    PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', 4))
+    # Statuses that count as finished, e.g. for overdue filtering
+    TASK_DONE_STATUSES = os.environ.get('TASK_DONE_STATUSES', 'Done,Completed').split(',')
+    BATCH_MAX_OPERATIONS = int(os.environ.get('BATCH_MAX_OPERATIONS', 5000))
+    EXPORT_CHUNK_SIZE = int(os.environ.get('EXPORT_CHUNK_SIZE', 1000))
+    IMPORT_BATCH_SIZE = int(os.environ.get('IMPORT_BATCH_SIZE', 500))
+    # auto picks SQLite FTS5 on SQLite and the portable token table elsewhere
+    SEARCH_BACKEND = os.environ.get('SEARCH_BACKEND', 'auto')
+    AUTHZ_CACHE_SIZE = int(os.environ.get('AUTHZ_CACHE_SIZE', 10000))
+    AUTHZ_CACHE_TTL = int(os.environ.get('AUTHZ_CACHE_TTL', 60))
+    # Seconds over which rapid updates to the same task are merged into one emit; 0 emits immediately
+    SOCKET_COALESCE_INTERVAL = float(os.environ.get('SOCKET_COALESCE_INTERVAL', 0.05))
+    # Encodings clients may negotiate with ?encoding= on connect; JSON stays the default. msgpack is
+    # opt-in (json,msgpack): behind a message queue every broadcast is then packed for it too
+    SOCKET_ENCODINGS = tuple(os.environ.get('SOCKET_ENCODINGS', 'json').split(','))
+    # Engine.IO's http_compression: gzip long-polling responses of at least this many bytes
+    SOCKET_COMPRESSION = os.environ.get('SOCKET_COMPRESSION', 'true').lower() in ('1', 'true', 'yes')
+    SOCKET_COMPRESSION_THRESHOLD = int(os.environ.get('SOCKET_COMPRESSION_THRESHOLD', 1024))
+    # serve.py: gunicorn worker processes, listen address, open connections per worker and request timeout
+    SERVER_WORKERS = int(os.environ.get('SERVER_WORKERS', os.environ.get('WEB_CONCURRENCY', 1)))
+    SERVER_BIND = os.environ.get('SERVER_BIND', '0.0.0.0:5000')
+    SERVER_WORKER_CONNECTIONS = int(os.environ.get('SERVER_WORKER_CONNECTIONS', 1000))
+    SERVER_TIMEOUT = int(os.environ.get('SERVER_TIMEOUT', 30))
+    # Requests/socket events and SQL statements slower than these are logged
+    SLOW_REQUEST_MS = float(os.environ.get('SLOW_REQUEST_MS', 500))
+    SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', 100))
+    # Fraction of requests run under cProfile; profiles slower than the threshold are logged
+    PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))
+    PROFILE_THRESHOLD_MS = float(os.environ.get('PROFILE_THRESHOLD_MS', 1000))
+    # GET /metrics requires "Authorization: Bearer <token>"; unset, the endpoint is not served
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+    # Listing response cache: 'local' (per-process LRU), 'none', or a redis:// URL shared by all workers
+    RESPONSE_CACHE = os.environ.get('RESPONSE_CACHE', 'local')
+    RESPONSE_CACHE_MAX_BYTES = int(os.environ.get('RESPONSE_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+    RESPONSE_CACHE_MAX_ENTRY_BYTES = int(os.environ.get('RESPONSE_CACHE_MAX_ENTRY_BYTES', 4 * 1024 * 1024))
+    RESPONSE_CACHE_TTL = int(os.environ.get('RESPONSE_CACHE_TTL', 300))
+    # User directory prefix search: 'memory' keeps a sorted index per process, 'database' uses index range scans;
+    # the in-memory index picks up other processes' user changes at most this many seconds late
+    USER_DIRECTORY_INDEX = os.environ.get('USER_DIRECTORY_INDEX', 'memory')
+    USER_DIRECTORY_REFRESH = float(os.environ.get('USER_DIRECTORY_REFRESH', 5))
+    # Background jobs: runners per process, queue polling interval, rows per step and where exports are written
+    JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 2))
+    JOB_POLL_INTERVAL = float(os.environ.get('JOB_POLL_INTERVAL', 0.5))
+    JOB_CHUNK_SIZE = int(os.environ.get('JOB_CHUNK_SIZE', 500))
+    JOB_EXPORT_DIR = os.environ.get('JOB_EXPORT_DIR') or os.path.join(tempfile.gettempdir(), 'trello-exports')
+    # Export files are deleted this many seconds after they were written
+    JOB_EXPORT_RETENTION = int(os.environ.get('JOB_EXPORT_RETENTION', 24 * 3600))
+    # A running job whose runner has not reported progress for this many seconds is requeued
+    JOB_LEASE_SECONDS = int(os.environ.get('JOB_LEASE_SECONDS', 300))
+    # A move producing a position key longer than this queues a background rebalance of the list
+    POSITION_MAX_LENGTH = int(os.environ.get('POSITION_MAX_LENGTH', 16))
+    # Done tasks not updated for this many days move to the archive tables (flask archive-tasks, POST .../archive)
+    ARCHIVE_AFTER_DAYS = int(os.environ.get('ARCHIVE_AFTER_DAYS', 30))
@@ -0,0 +1,244 @@
+import base64
+import bisect
+import heapq
+import time
+from sqlalchemy import event, and_, or_
+from app import app, db
+from locks import WorkerLock
+from authz import role_listeners
+from models import User, UserWorkspaceRole
+from serializers import USER_FIELDS, IN_CHUNK_SIZE
+
+# Index entries handed to the membership filter per query
+SCAN_BATCH_SIZE = 200
+
+
+class PrefixIndex:
+    """Sorted ``(key, user_id)`` entries over lowercased usernames and emails, one list per workspace.
+
+    Every user's keys are loaded once and kept current; a workspace's entries
+    are built from its members the first time it is searched, so a prefix
+    lookup is a bisect plus a walk over the matching slices of the caller's
+    workspaces only. Each process keeps its own copy: local writes are
+    applied through mapper events and membership listeners, and other
+    processes' writes are picked up by :meth:`refresh` and by rebuilding
+    entries older than USER_DIRECTORY_REFRESH.
+    """
+
+    def __init__(self):
+        self.keys = {}
+        # workspace_id -> (built_at, entries); user_id -> ids of the built workspaces listing them
+        self.workspaces = {}
+        self.member_of = {}
+        self.lock = WorkerLock()
+        self.refresh_lock = WorkerLock()
+        self.refreshing = False
+        self.watermark = None
+        self.checked = None
+
+    def _set_keys(self, user_id, keys):
+        if self.keys.get(user_id) == keys:
+            return
+        if keys is None:
+            self.keys.pop(user_id, None)
+        else:
+            self.keys[user_id] = keys
+        # Lists are rebuilt rather than edited, so a scan can keep walking the one it has
+        for workspace_id in self.member_of.pop(user_id, ()):
+            self.workspaces.pop(workspace_id, None)
+
+    def put(self, user_id, username, email):
+        with self.lock:
+            self._set_keys(user_id, {username.lower(), email.lower()})
+
+    def discard(self, user_id):
+        with self.lock:
+            self._set_keys(user_id, None)
+
+    def forget_workspace(self, workspace_id):
+        with self.lock:
+            self.workspaces.pop(workspace_id, None)
+
+    def refresh(self, force=False):
+        """Load the keys on first use, then fold in users changed since the last check."""
+        now = time.monotonic()
+        if not force and self.checked is not None and now - self.checked < app.config['USER_DIRECTORY_REFRESH']:
+            return
+        # The lock only claims the refresh and is never held across the query; once the index
+        # is loaded, callers arriving mid-refresh keep serving it instead of waiting
+        with self.refresh_lock:
+            if self.refreshing and self.watermark is not None:
+                return
+            self.refreshing = True
+        try:
+            watermark = self.watermark
+            statement = db.select(User.id, User.username, User.email, User.updated_at)
+            if watermark is not None:
+                # >= so rows sharing the last timestamp are not missed; putting them again is harmless
+                statement = statement.where(User.updated_at >= watermark)
+            rows = db.session.execute(statement).all()
+            newest = max((row.updated_at for row in rows if row.updated_at is not None), default=None)
+            with self.lock:
+                if self.watermark is None:
+                    self.keys = {row.id: {row.username.lower(), row.email.lower()} for row in rows}
+                    self.workspaces, self.member_of = {}, {}
+                else:
+                    for row in rows:
+                        self._set_keys(row.id, {row.username.lower(), row.email.lower()})
+                if newest is not None and (self.watermark is None or newest > self.watermark):
+                    self.watermark = newest
+                self.checked = now
+        finally:
+            with self.refresh_lock:
+                self.refreshing = False
+
+    def workspace_entries(self, workspace_ids):
+        """Return the entry lists of ``workspace_ids``, building missing and expired ones with one query."""
+        now = time.monotonic()
+        max_age = app.config['USER_DIRECTORY_REFRESH']
+        with self.lock:
+            stale = [workspace_id for workspace_id in workspace_ids if workspace_id not in self.workspaces
+                     or now - self.workspaces[workspace_id][0] >= max_age]
+        if stale:
+            members = {workspace_id: [] for workspace_id in stale}
+            for start in range(0, len(stale), IN_CHUNK_SIZE):
+                for workspace_id, user_id in db.session.execute(
+                    db.select(UserWorkspaceRole.workspace_id, UserWorkspaceRole.user_id)
+                    .where(UserWorkspaceRole.workspace_id.in_(stale[start:start + IN_CHUNK_SIZE]))
+                ):
+                    members[workspace_id].append(user_id)
+            with self.lock:
+                for workspace_id, user_ids in members.items():
+                    entries = sorted((key, user_id) for user_id in user_ids for key in self.keys.get(user_id, ()))
+                    self.workspaces[workspace_id] = (now, entries)
+                    for user_id in user_ids:
+                        self.member_of.setdefault(user_id, set()).add(workspace_id)
+        with self.lock:
+            return [self.workspaces[workspace_id][1] for workspace_id in workspace_ids
+                    if workspace_id in self.workspaces]
+
+    def scan(self, lists, prefix, after=None):
+        """Yield batches of the entries in ``lists`` whose key starts with ``prefix``, in key order, after ``after``."""
+        position = (prefix, -1) if after is None or after < (prefix, -1) else after
+
+        def matching(entries):
+            for index in range(bisect.bisect_right(entries, position), len(entries)):
+                if not entries[index][0].startswith(prefix):
+                    return
+                yield entries[index]
+
+        batch, previous = [], None
+        for entry in heapq.merge(*(matching(entries) for entries in lists)):
+            # A user sharing several of the workspaces is listed in each of them
+            if entry == previous:
+                continue
+            previous = entry
+            batch.append(entry)
+            if len(batch) == SCAN_BATCH_SIZE:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def is_secondary(self, key, user_id, prefix):
+        # A user matching on both keys is listed once, at the lower key
+        return any(other < key and other.startswith(prefix) for other in self.keys.get(user_id, ()))
+
+
+index = PrefixIndex()
+
+
+@event.listens_for(User, 'after_insert')
+@event.listens_for(User, 'after_update')
+def _index_user(mapper, connection, user):
+    if index.checked is not None:
+        index.put(user.id, user.username, user.email)
+
+
+@event.listens_for(User, 'after_delete')
+def _unindex_user(mapper, connection, user):
+    index.discard(user.id)
+
+
+# Membership changes made in this process rebuild the workspace's entries on its next search
+role_listeners.append(lambda user_id, workspace_id: index.forget_workspace(workspace_id))
+
+
+def warm():
+    if app.config['USER_DIRECTORY_INDEX'] == 'memory':
+        index.refresh(force=True)
+
+
+# Helper functions for opaque keyset cursors over a (sort key, id) pair
+def encode_cursor(key, user_id):
+    return base64.urlsafe_b64encode(f'{key}|{user_id}'.encode()).decode()
+
+
+def decode_cursor(cursor):
+    key, user_id = base64.urlsafe_b64decode(cursor.encode()).decode().rsplit('|', 1)
+    return key, int(user_id)
+
+
+def members(scope):
+    # Users belonging to any of the workspaces selected by ``scope``
+    return db.select(UserWorkspaceRole.user_id).where(UserWorkspaceRole.workspace_id.in_(scope))
+
+
+def _user_rows(query):
+    return [dict(zip(USER_FIELDS, row)) for row in db.session.execute(query)]
+
+
+def _prefix_range(column, prefix):
+    # A range instead of LIKE so every backend can seek the unique index
+    return and_(column >= prefix, column < prefix[:-1] + chr(ord(prefix[-1]) + 1))
+
+
+def _scope_ids(scope):
+    return list(scope) if isinstance(scope, (list, tuple)) else db.session.execute(scope).scalars().all()
+
+
+def find_users(scope, prefix, limit, cursor=None):
+    """Return one page of users in ``scope`` whose username or email starts with ``prefix``.
+
+    ``scope`` is a list or a select of workspace ids. Returns ``(users, next_cursor)``.
+    """
+    if not prefix or app.config['USER_DIRECTORY_INDEX'] != 'memory':
+        # The database compares with the columns' collation, so case handling follows the backend
+        return _find_users_in_database(scope, prefix, limit, cursor)
+
+    prefix = prefix.lower()
+    index.refresh()
+    lists = index.workspace_entries(_scope_ids(scope))
+    users, last = [], None
+    for batch in index.scan(lists, prefix, decode_cursor(cursor) if cursor else None):
+        candidates = [user_id for key, user_id in batch if not index.is_secondary(key, user_id, prefix)]
+        rows = {user['id']: user for user in _user_rows(
+            db.select(*[getattr(User, field) for field in USER_FIELDS])
+            .where(User.id.in_(candidates), User.id.in_(members(scope)))
+        )}
+        for key, user_id in batch:
+            user = rows.get(user_id)
+            # The index can lag a rename made by another process; the row has the final say
+            if user is None or index.is_secondary(key, user_id, prefix) or not (
+                    user['username'].lower().startswith(prefix) or user['email'].lower().startswith(prefix)):
+                continue
+            if len(users) == limit:
+                return users, encode_cursor(*last)
+            users.append(user)
+            last = (key, user_id)
+    return users, None
+
+
+def _find_users_in_database(scope, prefix, limit, cursor):
+    statement = db.select(*[getattr(User, field) for field in USER_FIELDS]).where(User.id.in_(members(scope)))
+    if prefix:
+        statement = statement.where(or_(_prefix_range(User.username, prefix), _prefix_range(User.email, prefix)))
+    if cursor:
+        username, last_id = decode_cursor(cursor)
+        statement = statement.where(or_(User.username > username, and_(User.username == username, User.id > last_id)))
+    users = _user_rows(statement.order_by(User.username, User.id).limit(limit + 1))
+    next_cursor = None
+    if len(users) > limit:
+        users = users[:limit]
+        next_cursor = encode_cursor(users[-1]['username'], users[-1]['id'])
+    return users, next_cursor
@@ -0,0 +1,79 @@
+from sqlalchemy import event
+from sqlalchemy.pool import QueuePool
+
+
+def _sqlite_wal(config):
+    # Flask-SQLAlchemy falls back to NullPool for SQLite files; reuse connections
+    # so the PRAGMAs below run once per connection rather than once per request
+    return {
+        'poolclass': QueuePool,
+        'pool_size': config['DB_POOL_SIZE'],
+        'max_overflow': config['DB_MAX_OVERFLOW'],
+        'pool_timeout': config['DB_POOL_TIMEOUT'],
+        'connect_args': {'check_same_thread': False},
+    }
+
+
+def _mysql_pooled(config):
+    return {
+        'pool_size': config['DB_POOL_SIZE'],
+        'max_overflow': config['DB_MAX_OVERFLOW'],
+        'pool_timeout': config['DB_POOL_TIMEOUT'],
+        'pool_recycle': config['DB_POOL_RECYCLE'],
+        'pool_pre_ping': True,
+    }
+
+
+# Profile name -> engine options builder; 'default' keeps Flask-SQLAlchemy's choices
+ENGINE_PROFILES = {
+    'default': lambda config: {},
+    'sqlite-wal': _sqlite_wal,
+    'mysql-pooled': _mysql_pooled,
+}
+
+
+def engine_profile(config):
+    """Resolve DATABASE_ENGINE_PROFILE, picking one from the database URL for ``auto``."""
+    profile = config['DATABASE_ENGINE_PROFILE']
+    if profile == 'auto':
+        uri = config['SQLALCHEMY_DATABASE_URI']
+        if uri.startswith('sqlite') and ':memory:' not in uri and uri.rstrip('/') != 'sqlite:':
+            return 'sqlite-wal'
+        if uri.startswith('mysql'):
+            return 'mysql-pooled'
+        return 'default'
+    if profile not in ENGINE_PROFILES:
+        raise ValueError(f'Unknown DATABASE_ENGINE_PROFILE {profile!r}; expected one of {sorted(ENGINE_PROFILES)}')
+    return profile
+
+
+def engine_options(config):
+    options = ENGINE_PROFILES[engine_profile(config)](config)
+    options.update(config.get('SQLALCHEMY_ENGINE_OPTIONS') or {})
+    return options
+
+
+def sqlite_pragmas(config):
+    if engine_profile(config) != 'sqlite-wal':
+        return {}
+    return {
+        'journal_mode': 'WAL',
+        # WAL keeps the database consistent at NORMAL; only the last commits can be lost on power failure
+        'synchronous': 'NORMAL',
+        'busy_timeout': config['SQLITE_BUSY_TIMEOUT'],
+        'mmap_size': config['SQLITE_MMAP_SIZE'],
+        'temp_store': 'MEMORY',
+    }
+
+
+def install_pragmas(engine, pragmas):
+    """Run ``PRAGMA name = value`` on every new DBAPI connection of ``engine``."""
+    if not pragmas:
+        return
+
+    @event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f'PRAGMA {name} = {value}')
+        cursor.close()
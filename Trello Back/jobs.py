@@ -0,0 +1,462 @@
+import json
+import os
+import time
+from datetime import datetime, timedelta
+from flask import request, jsonify, send_file
+from flask_jwt_extended import jwt_required, get_jwt_identity
+from sqlalchemy import and_, or_
+from app import app, db, socketio
+from locks import WorkerLock
+from models import Job, Workspace, Task, SubTask, ArchivedTask, ArchivedSubTask, Tombstone, User, UserWorkspaceRole
+from authz import workspace_role_required, get_workspace_role, invalidate_workspace, invalidate_role
+from pubsub import publish
+from sync import bump_workspace_version
+from transfer import export_records, load_workspace_row
+import positions
+import search
+import stats
+import directory
+
+ACTIVE_STATUSES = ('queued', 'running')
+# Seconds between sweeps for expired export files
+EXPORT_PURGE_INTERVAL = 60
+# Job kinds members may start through POST /workspaces/<id>/jobs
+WORKSPACE_JOB_KINDS = ('export', 'rebuild_stats')
+
+HANDLERS = {}
+
+
+def handler(kind):
+    def decorator(fn):
+        HANDLERS[kind] = fn
+        return fn
+    return decorator
+
+
+class LeaseLost(Exception):
+    """The job's lease lapsed and another runner claimed it."""
+
+
+class Progress:
+    """Records how far a job got and broadcasts it to the job's workspace room.
+
+    Updates go through their own connection so they are visible while the
+    handler's session is still inside a transaction or reading a cursor.
+    Each one renews the job's lease, and raises LeaseLost once another
+    runner has claimed the job.
+    """
+
+    def __init__(self, job):
+        self.job_id = job.id
+        # Identifies this claim; a reclaim stamps a new one
+        self.claim = job.started_at
+        self.state = job.to_dict()
+
+    def set_total(self, total):
+        self.update(total=total)
+
+    def advance(self, count):
+        self.update(progress=self.state['progress'] + count)
+        # Let other green threads run between chunks
+        socketio.sleep(0)
+
+    def update(self, **values):
+        with db.engine.begin() as connection:
+            updated = connection.execute(
+                db.update(Job).where(Job.id == self.job_id, Job.started_at == self.claim)
+                .values(claimed_at=datetime.utcnow(), **values)
+            ).rowcount
+        if not updated:
+            raise LeaseLost(f'Job {self.job_id} was claimed by another runner')
+        for key, value in values.items():
+            self.state[key] = json.loads(value) if key == 'result' and value else value
+        self.announce()
+
+    def announce(self):
+        if self.state['workspace_id'] is not None:
+            publish('job_response', self.state, self.state['workspace_id'])
+
+
+def enqueue(kind, workspace_id=None, requested_by=None, **params):
+    job = Job(kind=kind, workspace_id=workspace_id, user_id=requested_by, params=json.dumps(params))
+    db.session.add(job)
+    db.session.commit()
+    runner.start()
+    return job
+
+
+def active_job(kind, workspace_id=None, **params):
+    query = Job.query.filter(Job.kind == kind, Job.status.in_(ACTIVE_STATUSES))
+    if workspace_id is not None:
+        query = query.filter(Job.workspace_id == workspace_id)
+    if params:
+        query = query.filter(Job.params == json.dumps(params))
+    return query.order_by(Job.id).first()
+
+
+def claimable():
+    # Queued jobs, and running ones whose runner died: its lease was not renewed in time
+    expired = datetime.utcnow() - timedelta(seconds=app.config['JOB_LEASE_SECONDS'])
+    return or_(Job.status == 'queued', and_(
+        Job.status == 'running', or_(Job.claimed_at.is_(None), Job.claimed_at < expired)))
+
+
+def claim_next():
+    """Mark the oldest claimable job as running and return its id.
+
+    The conditional UPDATE lets several processes poll the same table
+    without running a job twice. A reclaimed job starts over.
+    """
+    while True:
+        condition = claimable()
+        job_id = db.session.execute(
+            db.select(Job.id).where(condition).order_by(Job.id).limit(1)
+        ).scalar()
+        if job_id is None:
+            db.session.rollback()
+            return None
+        now = datetime.utcnow()
+        claimed = db.session.execute(
+            db.update(Job).where(Job.id == job_id, condition)
+            .values(status='running', started_at=now, claimed_at=now, progress=0)
+        ).rowcount
+        db.session.commit()
+        if claimed:
+            return job_id
+
+
+def run_next():
+    job_id = claim_next()
+    if job_id is None:
+        return False
+
+    job = Job.query.get(job_id)
+    progress = Progress(job)
+    progress.announce()
+    try:
+        try:
+            result = HANDLERS[job.kind](job.workspace_id, json.loads(job.params or '{}'), progress)
+        except LeaseLost:
+            raise
+        except Exception as e:
+            db.session.rollback()
+            app.logger.exception('Job %s (%s) failed', job_id, progress.state['kind'])
+            progress.update(status='failed', error=str(e)[:500], finished_at=datetime.utcnow())
+        else:
+            progress.update(status='succeeded', result=json.dumps(result) if result is not None else None,
+                            finished_at=datetime.utcnow())
+    except LeaseLost:
+        # The runner that reclaimed the job reports its outcome
+        db.session.rollback()
+        app.logger.warning('Job %s (%s) was reclaimed while running', job_id, progress.state['kind'])
+    finally:
+        db.session.remove()
+    return True
+
+
+class Runner:
+    """A pool of background tasks draining the job table.
+
+    Started when a server process boots (see serve.py) so jobs queued before
+    a restart are picked up; enqueue starts it too in processes that did not.
+    """
+
+    def __init__(self):
+        self.lock = WorkerLock()
+        self.started = False
+        self.purged_at = 0
+
+    def start(self):
+        with self.lock:
+            if self.started:
+                return
+            self.started = True
+        for _ in range(app.config['JOB_WORKERS']):
+            socketio.start_background_task(self.work)
+
+    def work(self):
+        while True:
+            with app.app_context():
+                ran = run_next()
+                if not ran:
+                    self.purge()
+            if not ran:
+                socketio.sleep(app.config['JOB_POLL_INTERVAL'])
+
+    def purge(self):
+        # Expired exports are swept while idle, at most once per EXPORT_PURGE_INTERVAL
+        now = time.monotonic()
+        if now - self.purged_at >= EXPORT_PURGE_INTERVAL:
+            self.purged_at = now
+            purge_exports()
+
+
+runner = Runner()
+
+
+# Helper function to delete rows of one model in id chunks, committing after each
+def _delete_in_chunks(session, model, id_query, progress, on_chunk=None):
+    chunk_size = app.config['JOB_CHUNK_SIZE']
+    deleted = 0
+    while True:
+        ids = session.execute(id_query.limit(chunk_size)).scalars().all()
+        if not ids:
+            return deleted
+        if on_chunk:
+            on_chunk(ids)
+        session.execute(db.delete(model).where(model.id.in_(ids)).execution_options(synchronize_session=False))
+        session.commit()
+        deleted += len(ids)
+        progress.advance(len(ids))
+
+
+@handler('delete_workspace')
+def delete_workspace(workspace_id, params, progress):
+    """Delete a workspace with set-based statements instead of loading it through its relationships."""
+    session = db.session
+    task_ids = db.select(Task.id).where(Task.workspace_id == workspace_id)
+    subtask_ids = db.select(SubTask.id).where(SubTask.task_id.in_(task_ids))
+    archived_task_ids = db.select(ArchivedTask.id).where(ArchivedTask.workspace_id == workspace_id)
+    archived_subtask_ids = db.select(ArchivedSubTask.id).where(ArchivedSubTask.workspace_id == workspace_id)
+    progress.set_total(sum(
+        session.execute(db.select(db.func.count()).select_from(ids.subquery())).scalar()
+        for ids in (task_ids, subtask_ids, archived_task_ids, archived_subtask_ids)
+    ))
+
+    _delete_in_chunks(session, ArchivedSubTask, archived_subtask_ids, progress)
+    archived = _delete_in_chunks(session, ArchivedTask, archived_task_ids, progress)
+
+    subtasks = _delete_in_chunks(session, SubTask, subtask_ids, progress,
+                                 lambda ids: search.unindex(session, subtask_ids=ids))
+
+    def forget_tasks(ids):
+        search.unindex(session, task_ids=ids)
+    tasks = _delete_in_chunks(session, Task, task_ids, progress, forget_tasks)
+
+    # Rows written while the chunks ran go with the workspace in the final transaction
+    session.execute(db.delete(SubTask).where(SubTask.task_id.in_(task_ids)).execution_options(synchronize_session=False))
+    session.execute(db.delete(Task).where(Task.workspace_id == workspace_id).execution_options(synchronize_session=False))
+    session.execute(db.delete(Tombstone).where(Tombstone.workspace_id == workspace_id))
+    # Tasks archived while the chunks ran
+    session.execute(db.delete(ArchivedSubTask).where(ArchivedSubTask.workspace_id == workspace_id)
+                    .execution_options(synchronize_session=False))
+    session.execute(db.delete(ArchivedTask).where(ArchivedTask.workspace_id == workspace_id)
+                    .execution_options(synchronize_session=False))
+    session.execute(db.delete(UserWorkspaceRole).where(UserWorkspaceRole.workspace_id == workspace_id)
+                    .execution_options(synchronize_session=False))
+    stats.clear(session, workspace_id)
+    session.execute(db.delete(Workspace).where(Workspace.id == workspace_id).execution_options(synchronize_session=False))
+    session.commit()
+    # Announce before invalidating, which takes the members' connections out of the room
+    publish('workspace_response', {'message': 'Workspace deleted successfully', 'id': workspace_id}, workspace_id)
+    invalidate_workspace(workspace_id)
+    return {'tasks': tasks, 'subtasks': subtasks, 'archived_tasks': archived}
+
+
+@handler('delete_user')
+def delete_user(workspace_id, params, progress):
+    """Unassign a user's tasks workspace by workspace, then drop the memberships and the user."""
+    session = db.session
+    user_id = params['user_id']
+    workspace_ids = set(session.execute(
+        db.select(Task.workspace_id).where(Task.assignee_id == user_id).distinct()
+    ).scalars())
+    workspace_ids |= set(session.execute(
+        db.select(Task.workspace_id).join(SubTask, SubTask.task_id == Task.id)
+        .where(SubTask.assignee_id == user_id).distinct()
+    ).scalars())
+    progress.set_total(len(workspace_ids) + 1)
+
+    for assigned_workspace_id in sorted(workspace_ids):
+        # Stamp the unassigned rows so both ?since_version and ?since delta syncs pick them up
+        version = bump_workspace_version(session, assigned_workspace_id)
+        now = datetime.utcnow()
+        session.execute(
+            db.update(Task).where(Task.workspace_id == assigned_workspace_id, Task.assignee_id == user_id)
+            .values(assignee_id=None, sync_version=version, updated_at=now)
+            .execution_options(synchronize_session=False)
+        )
+        session.execute(
+            db.update(SubTask).where(
+                SubTask.assignee_id == user_id,
+                SubTask.task_id.in_(db.select(Task.id).where(Task.workspace_id == assigned_workspace_id))
+            ).values(assignee_id=None, sync_version=version, updated_at=now)
+            .execution_options(synchronize_session=False)
+        )
+        session.commit()
+        progress.advance(1)
+
+    member_of = session.execute(
+        db.select(UserWorkspaceRole.workspace_id).where(UserWorkspaceRole.user_id == user_id)
+    ).scalars().all()
+    for member_workspace_id in member_of:
+        bump_workspace_version(session, member_workspace_id)
+    # Archived rows are outside delta sync; they only need to stop pointing at the user
+    for model in (ArchivedTask, ArchivedSubTask):
+        session.execute(db.update(model).where(model.assignee_id == user_id).values(assignee_id=None)
+                        .execution_options(synchronize_session=False))
+    session.execute(db.delete(UserWorkspaceRole).where(UserWorkspaceRole.user_id == user_id)
+                    .execution_options(synchronize_session=False))
+    session.execute(db.delete(User).where(User.id == user_id).execution_options(synchronize_session=False))
+    session.commit()
+    for member_workspace_id in member_of:
+        invalidate_role(user_id, member_workspace_id)
+    directory.index.discard(user_id)
+    progress.advance(1)
+    return {'unassigned_workspaces': len(workspace_ids), 'memberships': len(member_of)}
+
+
+def export_path(job_id):
+    return os.path.join(app.config['JOB_EXPORT_DIR'], f'job-{job_id}.ndjson')
+
+
+def purge_exports():
+    """Delete export files, and parts left by dead runners, older than JOB_EXPORT_RETENTION."""
+    directory_path = app.config['JOB_EXPORT_DIR']
+    if not os.path.isdir(directory_path):
+        return 0
+    cutoff = time.time() - app.config['JOB_EXPORT_RETENTION']
+    purged = 0
+    for entry in os.scandir(directory_path):
+        try:
+            if entry.is_file() and entry.stat().st_mtime < cutoff:
+                os.remove(entry.path)
+                purged += 1
+        except FileNotFoundError:
+            # Another runner got to it first
+            pass
+    return purged
+
+
+@handler('export')
+def export_workspace(workspace_id, params, progress):
+    """Write the NDJSON export to a file that GET /jobs/<id>/download serves."""
+    workspace = load_workspace_row(workspace_id)
+    if workspace is None:
+        raise LookupError('Workspace not found')
+    session = db.session
+    task_ids = db.select(Task.id).where(Task.workspace_id == workspace_id)
+    progress.set_total(1 + sum(
+        session.execute(db.select(db.func.count()).select_from(query.subquery())).scalar()
+        for query in (db.select(UserWorkspaceRole.id).where(UserWorkspaceRole.workspace_id == workspace_id),
+                      task_ids, db.select(SubTask.id).where(SubTask.task_id.in_(task_ids)))
+    ))
+
+    path = export_path(progress.job_id)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    size = 0
+    with open(path + '.part', 'wb') as f:
+        for chunk in export_records(workspace_id, workspace, app.config['JOB_CHUNK_SIZE']):
+            f.write(chunk)
+            size += len(chunk)
+            progress.advance(chunk.count(b'\n'))
+    os.replace(path + '.part', path)
+    return {'bytes': size, 'download': f'/jobs/{progress.job_id}/download'}
+
+
+@handler('rebuild_stats')
+def rebuild_stats(workspace_id, params, progress):
+    progress.set_total(1)
+    stats.rebuild(db.session, workspace_id)
+    db.session.commit()
+    progress.advance(1)
+    return stats.workspace_stats(workspace_id)
+
+
+@handler('rebalance_positions')
+def rebalance_positions(workspace_id, params, progress):
+    """Respace the keys of one column (``status``) or of one task's subtasks (``task_id``).
+
+    Old and new keys do not interleave in order, so all chunks go into one
+    transaction and clients see the whole list change at once.
+    """
+    session = db.session
+    if 'task_id' in params:
+        model, scope = SubTask, positions.list_scope(SubTask, workspace_id, task_id=params['task_id'])
+    else:
+        model, scope = Task, positions.list_scope(Task, workspace_id, status=params['status'])
+    rows = positions.rebalanced_rows(session, model, scope)
+    progress.set_total(len(rows))
+    version = bump_workspace_version(session, workspace_id)
+    stamp = {'sync_version': version, 'updated_at': datetime.utcnow()}
+    chunk_size = app.config['JOB_CHUNK_SIZE']
+    for start in range(0, len(rows), chunk_size):
+        session.bulk_update_mappings(model, [dict(row, **stamp) for row in rows[start:start + chunk_size]])
+    session.commit()
+    progress.advance(len(rows))
+    # Clients reload the list instead of receiving every new key
+    publish('positions_rebalanced', dict(params, version=version), workspace_id)
+    return {'rows': len(rows), 'version': version}
+
+
+def job_response(job):
+    response = jsonify(job.to_dict())
+    response.headers['Location'] = f'/jobs/{job.id}'
+    return response, 202
+
+
+# Helper function to check the caller started the job or belongs to its workspace
+def _visible_job(job_id):
+    job = Job.query.get(job_id)
+    if job is None:
+        return None
+    user_id = int(get_jwt_identity())
+    if job.user_id == user_id:
+        return job
+    if job.workspace_id is not None and get_workspace_role(user_id, job.workspace_id) is not None:
+        return job
+    return None
+
+
+@app.route('/workspaces/<int:workspace_id>/jobs', methods=['POST'])
+@jwt_required()
+@workspace_role_required()
+def create_workspace_job(workspace_id):
+    data = request.get_json(silent=True) or {}
+    kind = data.get('kind')
+    if kind not in WORKSPACE_JOB_KINDS:
+        return jsonify({"error": f"kind must be one of {', '.join(WORKSPACE_JOB_KINDS)}"}), 400
+    job = active_job(kind, workspace_id) if kind == 'rebuild_stats' else None
+    if job is None:
+        job = enqueue(kind, workspace_id, int(get_jwt_identity()))
+    return job_response(job)
+
+
+@app.route('/workspaces/<int:workspace_id>/jobs', methods=['GET'])
+@jwt_required()
+@workspace_role_required()
+def get_workspace_jobs(workspace_id):
+    jobs = Job.query.filter_by(workspace_id=workspace_id).order_by(Job.id.desc()).limit(50)
+    return jsonify([job.to_dict() for job in jobs]), 200
+
+
+@app.route('/jobs/<int:job_id>', methods=['GET'])
+@jwt_required()
+def get_job(job_id):
+    job = _visible_job(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job.to_dict()), 200
+
+
+@app.route('/jobs/<int:job_id>/download', methods=['GET'])
+@jwt_required()
+def download_job_result(job_id):
+    job = _visible_job(job_id)
+    if job is None or job.kind != 'export':
+        return jsonify({"error": "Job not found"}), 404
+    if job.status != 'succeeded':
+        return jsonify({"error": f"Job is {job.status}"}), 409
+    if not os.path.exists(export_path(job.id)):
+        return jsonify({"error": "Export has expired"}), 410
+    return send_file(export_path(job.id), mimetype='application/x-ndjson', as_attachment=True,
+                     download_name=f'workspace-{job.workspace_id}.ndjson')
+
+
+@app.cli.command('run-jobs')
+def run_jobs_command():
+    """Process queued background jobs in the foreground until interrupted."""
+    while True:
+        if not run_next():
+            runner.purge()
+            time.sleep(app.config['JOB_POLL_INTERVAL'])
@@ -0,0 +1,42 @@
+"""Locks owned by module-level objects, recreated in each server worker.
+
+The gunicorn master preloads the app without monkey patching (see serve.py),
+so a ``threading.Lock`` created at import time is a real OS lock and stays
+one in the forked workers. Blocking on it there stalls every green thread in
+the worker. :func:`reset_all` runs after the worker has patched the standard
+library and swaps each lock for a fresh one of the patched kind.
+"""
+import threading
+import weakref
+
+_locks = weakref.WeakSet()
+
+
+class WorkerLock:
+    """A ``threading.Lock`` that :func:`reset_all` can replace."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        _locks.add(self)
+
+    def reset(self):
+        self._lock = threading.Lock()
+
+    def acquire(self, blocking=True, timeout=-1):
+        return self._lock.acquire(blocking, timeout)
+
+    def release(self):
+        self._lock.release()
+
+    def __enter__(self):
+        self._lock.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._lock.release()
+
+
+def reset_all():
+    # Only called while nothing holds a lock: before the worker serves or starts background tasks
+    for lock in list(_locks):
+        lock.reset()
@@ -0,0 +1,222 @@
+import cProfile
+import hmac
+import inspect
+import io
+import json
+import pstats
+import random
+from contextvars import ContextVar
+from functools import wraps
+from time import perf_counter
+from flask import request, abort
+from sqlalchemy import event
+from app import app, db
+from locks import WorkerLock
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SIZE_BUCKETS = (100, 1000, 10000, 100000, 1000000, 10000000)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=''):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name, self.help, self.label_names = name, help, labels
+        self.values = {}
+        self.lock = WorkerLock()
+
+    def inc(self, *labels, amount=1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        with self.lock:
+            for labels, value in sorted(self.values.items()):
+                lines.append(f'{self.name}{_labels(self.label_names, labels)} {value}')
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name, self.help, self.label_names, self.buckets = name, help, labels, buckets
+        self.values = {}
+        self.lock = WorkerLock()
+
+    def observe(self, value, *labels):
+        with self.lock:
+            counts, total, count = self.values.get(labels, ([0] * len(self.buckets), 0, 0))
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+            self.values[labels] = (counts, total + value, count + 1)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        with self.lock:
+            for labels, (counts, total, count) in sorted(self.values.items()):
+                for bound, bucket_count in zip(self.buckets + ('+Inf',), counts + [count]):
+                    bucket = 'le="%s"' % bound
+                    lines.append(f'{self.name}_bucket{_labels(self.label_names, labels, bucket)} {bucket_count}')
+                lines.append(f'{self.name}_sum{_labels(self.label_names, labels)} {total}')
+                lines.append(f'{self.name}_count{_labels(self.label_names, labels)} {count}')
+        return lines
+
+
+# Metrics are per process; with several workers Prometheus scrapes each one
+http_requests = Counter('trello_http_requests_total', 'HTTP requests by endpoint and status.',
+                        ('method', 'endpoint', 'status'))
+http_latency = Histogram('trello_http_request_duration_seconds', 'HTTP request latency.', ('method', 'endpoint'))
+http_response_size = Histogram('trello_http_response_size_bytes', 'HTTP response body size.', ('endpoint',),
+                               SIZE_BUCKETS)
+http_queries = Histogram('trello_http_request_sql_queries', 'SQL statements issued per HTTP request.',
+                         ('endpoint',), QUERY_BUCKETS)
+socket_events = Counter('trello_socketio_events_total', 'Socket.IO events handled, by outcome.', ('event', 'outcome'))
+socket_latency = Histogram('trello_socketio_event_duration_seconds', 'Socket.IO handler latency.', ('event',))
+socket_payload_size = Histogram('trello_socketio_event_payload_bytes', 'Size of incoming Socket.IO payloads.',
+                                ('event',), SIZE_BUCKETS)
+socket_queries = Histogram('trello_socketio_event_sql_queries', 'SQL statements issued per Socket.IO event.',
+                           ('event',), QUERY_BUCKETS)
+sql_statements = Counter('trello_sql_statements_total', 'SQL statements executed, by operation.', ('operation',))
+sql_latency = Histogram('trello_sql_statement_duration_seconds', 'SQL statement latency.', ('operation',))
+cache_requests = Counter('trello_response_cache_requests_total', 'Response cache lookups, by listing and outcome.',
+                         ('cache', 'outcome'))
+REGISTRY = (http_requests, http_latency, http_response_size, http_queries, socket_events, socket_latency,
+            socket_payload_size, socket_queries, sql_statements, sql_latency, cache_requests)
+
+_current_span = ContextVar('metrics_span', default=None)
+_profiling = WorkerLock()
+
+
+class Span:
+    """Timing, SQL accounting and sampled profiling for one request or socket event."""
+
+    def __init__(self):
+        self.queries = 0
+        self.sql_seconds = 0.0
+        self.profiler = None
+        rate = app.config['PROFILE_SAMPLE_RATE']
+        # cProfile can only follow one request per thread at a time
+        if rate and random.random() < rate and _profiling.acquire(blocking=False):
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        self.token = _current_span.set(self)
+        self.started = perf_counter()
+
+    def finish(self, label):
+        elapsed = perf_counter() - self.started
+        _current_span.reset(self.token)
+        if self.profiler:
+            self.profiler.disable()
+            _profiling.release()
+        if elapsed * 1000 >= app.config['SLOW_REQUEST_MS']:
+            app.logger.warning('Slow %s: %.1f ms, %d queries, %.1f ms in SQL',
+                               label, elapsed * 1000, self.queries, self.sql_seconds * 1000)
+        if self.profiler and elapsed * 1000 >= app.config['PROFILE_THRESHOLD_MS']:
+            output = io.StringIO()
+            pstats.Stats(self.profiler, stream=output).sort_stats('cumulative').print_stats(25)
+            app.logger.warning('Profile of %s:\n%s', label, output.getvalue())
+        return elapsed
+
+
+# Helper functions for timing SQL statements through the engine events
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('metrics_started', []).append(perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = perf_counter() - conn.info['metrics_started'].pop()
+    operation = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else 'OTHER'
+    sql_statements.inc(operation)
+    sql_latency.observe(elapsed, operation)
+    span = _current_span.get()
+    if span is not None:
+        span.queries += 1
+        span.sql_seconds += elapsed
+    if elapsed * 1000 >= app.config['SLOW_QUERY_MS']:
+        app.logger.warning('Slow query: %.1f ms: %s', elapsed * 1000, ' '.join(statement.split())[:1000])
+
+
+def _handle_error(exception_context):
+    started = exception_context.connection.info.get('metrics_started') if exception_context.connection else None
+    if started:
+        started.pop()
+
+
+with app.app_context():
+    event.listen(db.engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(db.engine, 'after_cursor_execute', _after_cursor_execute)
+    event.listen(db.engine, 'handle_error', _handle_error)
+
+
+@app.before_request
+def start_request_span():
+    request.metrics_span = Span()
+
+
+@app.after_request
+def record_request(response):
+    span = getattr(request, 'metrics_span', None)
+    if span is None:
+        return response
+    endpoint = request.endpoint or 'unmatched'
+    elapsed = span.finish(f'{request.method} {request.path}')
+    http_requests.inc(request.method, endpoint, str(response.status_code))
+    http_latency.observe(elapsed, request.method, endpoint)
+    http_queries.observe(span.queries, endpoint)
+    if response.content_length is not None:
+        http_response_size.observe(response.content_length, endpoint)
+    return response
+
+
+def instrumented(message):
+    """Decorate a Socket.IO handler for ``message`` with timing, SQL accounting and payload size."""
+    def decorate(handler):
+        signature = inspect.signature(handler)
+
+        @wraps(handler)
+        def wrapper(*args):
+            # Flask-SocketIO retries connect handlers without the auth argument when they refuse it;
+            # fail that first call before it is counted
+            signature.bind(*args)
+            span = Span()
+            outcome = 'ok'
+            try:
+                return handler(*args)
+            except Exception:
+                outcome = 'error'
+                raise
+            finally:
+                elapsed = span.finish(f'socket event {message}')
+                socket_events.inc(message, outcome)
+                socket_latency.observe(elapsed, message)
+                socket_queries.observe(span.queries, message)
+                if args and message not in ('connect', 'disconnect'):
+                    payload = args[0]
+                    size = len(payload) if isinstance(payload, (str, bytes)) else len(json.dumps(payload, default=str))
+                    socket_payload_size.observe(size, message)
+        return wrapper
+    return decorate
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    # Only served to scrapers presenting METRICS_TOKEN; without one configured the endpoint is off
+    token = app.config['METRICS_TOKEN']
+    supplied = request.headers.get('Authorization', '')
+    if not token or not hmac.compare_digest(supplied.encode(), f'Bearer {token}'.encode()):
+        abort(404)
+    lines = []
+    for metric in REGISTRY:
+        lines += metric.render()
+    return app.response_class('\n'.join(lines) + '\n', mimetype='text/plain; version=0.0.4')
@@ -1,12 +1,19 @@
+import json
 from datetime import datetime
 from app import db
 
+# Helper function to render naive UTC datetimes consistently across the API
+def format_datetime(value):
+    return value.isoformat() + 'Z' if value else None
+
 class Workspace(db.Model):
     __tablename__ = 'workspace'
 
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(80), nullable=False)
     description = db.Column(db.String(120))
+    # Bumped on every task/subtask change; drives delta sync and ETags
+    version = db.Column(db.Integer, nullable=False, default=0)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
@@ -18,12 +25,23 @@ class Workspace(db.Model):
             'id': self.id,
             'name': self.name,
             'description': self.description,
-            'created_at': self.created_at,
-            'updated_at': self.updated_at
+            'created_at': format_datetime(self.created_at),
+            'updated_at': format_datetime(self.updated_at)
         }
 
 class Task(db.Model):
     __tablename__ = 'task'
+    __table_args__ = (
+        db.Index('ix_task_workspace_updated', 'workspace_id', 'updated_at', 'id'),
+        db.Index('ix_task_workspace_sync_version', 'workspace_id', 'sync_version'),
+        db.Index('ix_task_workspace_status', 'workspace_id', 'status'),
+        db.Index('ix_task_workspace_due_date', 'workspace_id', 'due_date'),
+        db.Index('ix_task_assignee', 'assignee_id'),
+        # Board order: a column is a range scan already sorted by position
+        db.Index('ix_task_workspace_status_position', 'workspace_id', 'status', 'position'),
+        # Never hand out the id of a deleted or archived task again
+        {'sqlite_autoincrement': True},
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(80), nullable=False)
@@ -35,10 +53,17 @@ class Task(db.Model):
     priority = db.Column(db.String(10), default='medium')
     workspace_id = db.Column(db.Integer, db.ForeignKey('workspace.id'), nullable=False)
     assignee_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+    # Fractional key ordering the card within its column (see positions.py)
+    position = db.Column(db.String(255))
+    sync_version = db.Column(db.Integer, nullable=False, default=0)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    # Every write stamps a new sync_version, so it doubles as the row version for If-Match
+    version = db.synonym('sync_version')
 
-    subtasks = db.relationship('SubTask', backref='task', lazy=True)
+    # Deleting a task takes its subtasks with it, through the same hooks as single deletes
+    subtasks = db.relationship('SubTask', backref='task', lazy=True, cascade='all, delete-orphan',
+                               order_by='(SubTask.position, SubTask.id)')
 
     def to_dict(self):
         return {
@@ -48,25 +73,35 @@ class Task(db.Model):
             'status': self.status,
             'estimated_time': self.estimated_time,
             'actual_time': self.actual_time,
-            'due_date': self.due_date.isoformat() + 'Z' if self.due_date else None,
+            'due_date': format_datetime(self.due_date),
             'priority': self.priority,
             'workspace_id': self.workspace_id,
             'assignee_id': self.assignee_id,
-            'created_at': self.created_at.isoformat() + 'Z',
-            'updated_at': self.updated_at.isoformat() + 'Z',
+            'position': self.position,
+            'version': self.sync_version,
+            'created_at': format_datetime(self.created_at),
+            'updated_at': format_datetime(self.updated_at),
             'subtasks': [subtask.to_dict() for subtask in self.subtasks]
         }
 
 class SubTask(db.Model):
     __tablename__ = 'subtask'
+    __table_args__ = (
+        db.Index('ix_subtask_task_sync_version', 'task_id', 'sync_version'),
+        db.Index('ix_subtask_task_position', 'task_id', 'position'),
+        {'sqlite_autoincrement': True},
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     task_id = db.Column(db.Integer, db.ForeignKey('task.id'), nullable=False)
     title = db.Column(db.String(80), nullable=False)
     is_completed = db.Column(db.Boolean, default=False)
     assignee_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+    position = db.Column(db.String(255))
+    sync_version = db.Column(db.Integer, nullable=False, default=0)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    version = db.synonym('sync_version')
 
     def to_dict(self):
         return {
@@ -75,19 +110,10 @@ class SubTask(db.Model):
             'title': self.title,
             'is_completed': self.is_completed,
             'assignee_id': self.assignee_id,
-            'created_at': self.created_at.isoformat() + 'Z',
-            'updated_at': self.updated_at.isoformat() + 'Z'
-        }
-
-    def to_dict(self):
-        return {
-            'id': self.id,
-            'task_id': self.task_id,
-            'title': self.title,
-            'is_completed': self.is_completed,
-            'assignee_id': self.assignee_id,
-            'created_at': self.created_at,
-            'updated_at': self.updated_at
+            'position': self.position,
+            'version': self.sync_version,
+            'created_at': format_datetime(self.created_at),
+            'updated_at': format_datetime(self.updated_at)
         }
 
 class User(db.Model):
@@ -98,7 +124,8 @@ class User(db.Model):
     email = db.Column(db.String(120), unique=True, nullable=False)
     password_hash = db.Column(db.String(128), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    # Indexed for the user directory's incremental refresh
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
 
     tasks = db.relationship('Task', backref='assignee', lazy=True)
     subtasks = db.relationship('SubTask', backref='assignee', lazy=True)
@@ -109,12 +136,16 @@ class User(db.Model):
             'id': self.id,
             'username': self.username,
             'email': self.email,
-            'created_at': self.created_at,
-            'updated_at': self.updated_at
+            'created_at': format_datetime(self.created_at),
+            'updated_at': format_datetime(self.updated_at)
         }
 
 class UserWorkspaceRole(db.Model):
     __tablename__ = 'userworkspacerole'
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'workspace_id', name='uq_userworkspacerole_user_workspace'),
+        db.Index('ix_userworkspacerole_workspace', 'workspace_id'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
@@ -129,6 +160,146 @@ class UserWorkspaceRole(db.Model):
             'user_id': self.user_id,
             'workspace_id': self.workspace_id,
             'role': self.role,
-            'created_at': self.created_at,
-            'updated_at': self.updated_at
+            'created_at': format_datetime(self.created_at),
+            'updated_at': format_datetime(self.updated_at)
+        }
+
+class ArchivedTask(db.Model):
+    """Cold copy of a task moved off its board; the hot ``task`` table never sees it again until restored."""
+    __tablename__ = 'archived_task'
+    __table_args__ = (
+        db.Index('ix_archived_task_workspace_archived', 'workspace_id', 'archived_at', 'id'),
+        db.Index('ix_archived_task_source', 'source_id'),
+        {'sqlite_autoincrement': True},
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    # The id the task had on the board
+    source_id = db.Column(db.Integer, nullable=False)
+    title = db.Column(db.String(80), nullable=False)
+    description = db.Column(db.String(200), nullable=True)
+    status = db.Column(db.String(20))
+    estimated_time = db.Column(db.Integer, nullable=True)
+    actual_time = db.Column(db.Integer, nullable=True)
+    due_date = db.Column(db.DateTime, nullable=True)
+    priority = db.Column(db.String(10))
+    workspace_id = db.Column(db.Integer, nullable=False)
+    assignee_id = db.Column(db.Integer)
+    position = db.Column(db.String(255))
+    sync_version = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime)
+    updated_at = db.Column(db.DateTime)
+    archived_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    version = db.synonym('sync_version')
+
+class ArchivedSubTask(db.Model):
+    __tablename__ = 'archived_subtask'
+    __table_args__ = (
+        db.Index('ix_archived_subtask_task', 'task_id'),
+        db.Index('ix_archived_subtask_workspace', 'workspace_id'),
+        {'sqlite_autoincrement': True},
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    source_id = db.Column(db.Integer, nullable=False)
+    # The archived task's id, not the one it had on the board
+    task_id = db.Column(db.Integer, db.ForeignKey('archived_task.id'), nullable=False)
+    # Denormalized so a workspace's cold rows can be found without the task
+    workspace_id = db.Column(db.Integer, nullable=False)
+    title = db.Column(db.String(80), nullable=False)
+    is_completed = db.Column(db.Boolean)
+    assignee_id = db.Column(db.Integer)
+    position = db.Column(db.String(255))
+    sync_version = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime)
+    updated_at = db.Column(db.DateTime)
+    version = db.synonym('sync_version')
+
+class Tombstone(db.Model):
+    __tablename__ = 'tombstone'
+    __table_args__ = (
+        db.Index('ix_tombstone_workspace_version', 'workspace_id', 'version'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    workspace_id = db.Column(db.Integer, nullable=False)
+    entity_type = db.Column(db.String(20), nullable=False)
+    entity_id = db.Column(db.Integer, nullable=False)
+    version = db.Column(db.Integer, nullable=False)
+    deleted_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+
+    def to_dict(self):
+        return {
+            'type': self.entity_type,
+            'id': self.entity_id,
+            'version': self.version,
+            'deleted_at': format_datetime(self.deleted_at)
+        }
+
+class SearchToken(db.Model):
+    __tablename__ = 'search_token'
+    __table_args__ = (
+        db.Index('ix_search_token_lookup', 'workspace_id', 'token', 'entity_type', 'entity_id'),
+        db.Index('ix_search_token_entity', 'entity_type', 'entity_id'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    workspace_id = db.Column(db.Integer, nullable=False)
+    token = db.Column(db.String(64), nullable=False)
+    entity_type = db.Column(db.String(20), nullable=False)
+    entity_id = db.Column(db.Integer, nullable=False)
+    task_id = db.Column(db.Integer, nullable=False)
+    weight = db.Column(db.Integer, nullable=False, default=1)
+
+class WorkspaceStat(db.Model):
+    """One aggregate per (workspace, metric, bucket), e.g. ('status', 'Done') -> task count."""
+    __tablename__ = 'workspace_stat'
+    __table_args__ = (
+        db.UniqueConstraint('workspace_id', 'metric', 'bucket', name='uq_workspace_stat_metric_bucket'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    workspace_id = db.Column(db.Integer, nullable=False)
+    metric = db.Column(db.String(32), nullable=False)
+    bucket = db.Column(db.String(50), nullable=False, default='')
+    value = db.Column(db.Integer, nullable=False, default=0)
+
+class Job(db.Model):
+    """A queued background operation; the table doubles as the queue workers claim from."""
+    __tablename__ = 'job'
+    __table_args__ = (
+        db.Index('ix_job_status_id', 'status', 'id'),
+        db.Index('ix_job_workspace_id', 'workspace_id', 'id'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(50), nullable=False)
+    # Not a foreign key: a workspace deletion job outlives its workspace
+    workspace_id = db.Column(db.Integer, nullable=True)
+    user_id = db.Column(db.Integer, nullable=True)
+    params = db.Column(db.Text, nullable=True)
+    status = db.Column(db.String(20), nullable=False, default='queued')
+    progress = db.Column(db.Integer, nullable=False, default=0)
+    total = db.Column(db.Integer, nullable=True)
+    result = db.Column(db.Text, nullable=True)
+    error = db.Column(db.String(500), nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime, nullable=True)
+    # Renewed by the runner holding the job; a running job whose lease lapsed is claimed again
+    claimed_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'workspace_id': self.workspace_id,
+            'status': self.status,
+            'progress': self.progress,
+            'total': self.total,
+            'result': json.loads(self.result) if self.result else None,
+            'error': self.error,
+            'created_at': format_datetime(self.created_at),
+            'started_at': format_datetime(self.started_at),
+            'finished_at': format_datetime(self.finished_at)
         }
@@ -0,0 +1,33 @@
+from concurrent.futures import ThreadPoolExecutor
+from werkzeug.security import generate_password_hash, check_password_hash
+from app import app, socketio
+
+# pbkdf2 is CPU bound and would stall the eventlet hub (and with it every
+# socket) if run inline, so it runs on a bounded pool of OS threads. hashlib
+# releases the GIL while hashing, so the pool also hashes in parallel.
+if socketio.async_mode == 'eventlet':
+    from eventlet import tpool
+    tpool.set_num_threads(app.config['PASSWORD_HASH_WORKERS'])
+
+    def _run(fn, *args):
+        return tpool.execute(fn, *args)
+elif socketio.async_mode == 'gevent':
+    import gevent
+
+    def _run(fn, *args):
+        return gevent.get_hub().threadpool.apply(fn, args)
+else:
+    _executor = ThreadPoolExecutor(max_workers=app.config['PASSWORD_HASH_WORKERS'],
+                                   thread_name_prefix='password-hash')
+
+    def _run(fn, *args):
+        return _executor.submit(fn, *args).result()
+
+
+def hash_password(password):
+    method = f"pbkdf2:sha256:{app.config['PASSWORD_HASH_ITERATIONS']}"
+    return _run(generate_password_hash, password, method)
+
+
+def verify_password(password_hash, password):
+    return _run(check_password_hash, password_hash, password)
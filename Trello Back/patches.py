@@ -0,0 +1,285 @@
+from datetime import datetime
+from flask import request, jsonify, g
+from flask_jwt_extended import jwt_required
+from app import app, db
+from models import Task, SubTask
+from authz import workspace_role_required
+from pubsub import publish, publish_update
+from batch import task_values, subtask_values
+from serializers import task_update_payload
+from sync import bump_workspace_version
+import jobs
+import positions
+import search
+import stats
+
+# Fields whose old values feed the workspace aggregates or the search index
+STAT_FIELDS = {Task: {'status', 'priority', 'estimated_time', 'actual_time'}, SubTask: {'is_completed'}}
+SEARCH_FIELDS = {Task: {'title', 'description'}, SubTask: {'title'}}
+
+
+class VersionConflict(Exception):
+    def __init__(self, current_version):
+        super().__init__(f'Row is at version {current_version}')
+        self.current_version = current_version
+
+
+class NeighbourConflict(Exception):
+    """The neighbours named by a move are no longer adjacent in the target list."""
+
+    def __init__(self, rebalance=False):
+        super().__init__('Neighbours changed')
+        # Set when the keys themselves leave no slot, rather than the client being behind
+        self.rebalance = rebalance
+
+
+def apply_patch(model, entity_id, values, workspace_id, expected_version=None, task_id=None):
+    """Write ``values`` to one task or subtask with a single conditional UPDATE.
+
+    The row is not loaded first; when ``expected_version`` is given the UPDATE
+    only matches while the row is still at that version. Returns the new
+    version and timestamp, or None if the row does not exist, and raises
+    VersionConflict if it changed in the meantime. Like the batch endpoint
+    this bypasses the session hooks, so versions, aggregates and the search
+    index are maintained here.
+    """
+    session = db.session
+    ids = ([entity_id], []) if model is Task else ([], [entity_id])
+    scope = [model.id == entity_id]
+    scope.append(Task.workspace_id == workspace_id if model is Task else SubTask.task_id == task_id)
+
+    track_stats = bool(STAT_FIELDS[model] & values.keys())
+    before = stats.snapshot(session, *ids) if track_stats else None
+    version = bump_workspace_version(session, workspace_id)
+    updated_at = datetime.utcnow()
+    statement = db.update(model).where(*scope)
+    if expected_version is not None:
+        statement = statement.where(model.sync_version == expected_version)
+    result = session.execute(
+        statement.values(**values, sync_version=version, updated_at=updated_at)
+        .execution_options(synchronize_session=False)
+    )
+    if result.rowcount == 0:
+        session.rollback()
+        # Only a failed write pays for telling a missing row from a stale one
+        current = session.execute(db.select(model.sync_version).where(*scope)).scalar()
+        if current is None:
+            return None
+        raise VersionConflict(current)
+
+    if track_stats:
+        stats.apply_snapshot_diff(session, before, stats.snapshot(session, *ids))
+    if SEARCH_FIELDS[model] & values.keys():
+        search.reindex(session, *ids)
+    session.commit()
+    return version, updated_at
+
+
+# Helper function to read the expected row version from If-Match or the body
+def expected_version(data):
+    if request.if_match:
+        if request.if_match.star_tag:
+            return None
+        tags = request.if_match.as_set()
+        if len(tags) != 1:
+            raise ValueError('If-Match must name a single version')
+        return int(tags.pop())
+    return parse_version(data.pop('version', None))
+
+
+def parse_version(value):
+    if value is None:
+        return None
+    if isinstance(value, bool) or not isinstance(value, (int, str)):
+        raise ValueError('version must be an integer')
+    return int(value)
+
+
+def conflict_response(error):
+    # 412 answers a failed If-Match precondition, 409 a stale version in the body
+    status = 412 if request.if_match else 409
+    response = jsonify({"error": "Version conflict", "version": error.current_version})
+    response.set_etag(str(error.current_version))
+    return response, status
+
+
+def _parse_patch(parse_values):
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        raise ValueError('Request body must be a JSON object')
+    version = expected_version(data)
+    values = parse_values(data)
+    if not values:
+        raise ValueError('No updatable fields in request')
+    return values, version
+
+
+@app.route('/workspaces/<int:workspace_id>/tasks/<int:task_id>', methods=['PATCH'])
+@jwt_required()
+@workspace_role_required()
+def patch_task(workspace_id, task_id):
+    try:
+        values, version = _parse_patch(task_values)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    try:
+        result = apply_patch(Task, task_id, values, workspace_id, version)
+    except VersionConflict as e:
+        return conflict_response(e)
+    if result is None:
+        return jsonify({"error": "Task not found"}), 404
+
+    payload = task_update_payload(task_id, *result, values)
+    publish_update('task_response', payload, workspace_id, task_id)
+    response = jsonify(payload['task'])
+    response.set_etag(str(result[0]))
+    return response, 200
+
+
+@app.route('/tasks/<int:task_id>/subtasks/<int:subtask_id>', methods=['PATCH'])
+@jwt_required()
+@workspace_role_required()
+def patch_subtask(task_id, subtask_id):
+    try:
+        values, version = _parse_patch(subtask_values)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    try:
+        result = apply_patch(SubTask, subtask_id, values, g.workspace_id, version, task_id=task_id)
+    except VersionConflict as e:
+        return conflict_response(e)
+    if result is None:
+        return jsonify({"error": "Subtask not found"}), 404
+
+    version, updated_at = result
+    subtask_data = dict(values, id=subtask_id, task_id=task_id, version=version, updated_at=updated_at)
+    publish('subtask_response', {'message': 'Subtask updated successfully', 'subtask': subtask_data}, g.workspace_id)
+    response = jsonify(subtask_data)
+    response.set_etag(str(version))
+    return response, 200
+
+
+def _neighbour_keys(model, entity_id, scope, after_id, before_id):
+    # The keys either side of the requested slot; a missing side is looked up next to the given one
+    session = db.session
+    named = [row_id for row_id in (after_id, before_id) if row_id is not None]
+    if entity_id in named:
+        raise ValueError('A row cannot be moved next to itself')
+    found = dict(session.execute(db.select(model.id, model.position).where(*scope, model.id.in_(named))).all())
+    if any(row_id not in found for row_id in named):
+        raise NeighbourConflict()
+    if any(found[row_id] is None for row_id in named):
+        raise NeighbourConflict(rebalance=True)
+    after, before = found.get(after_id), found.get(before_id)
+
+    others = [*scope, model.id != entity_id]
+    if after_id is None and before_id is None:
+        after = session.execute(db.select(db.func.max(model.position)).where(*others)).scalar()
+    elif before_id is None:
+        before = session.execute(db.select(db.func.min(model.position)).where(*others, model.position > after)).scalar()
+    elif after_id is None:
+        after = session.execute(db.select(db.func.max(model.position)).where(*others, model.position < before)).scalar()
+    if after is not None and before is not None and after >= before:
+        raise NeighbourConflict(rebalance=True)
+    return after, before
+
+
+def move(model, entity_id, workspace_id, data, task_id=None):
+    """Place one task or subtask between ``after_id`` and ``before_id`` by rewriting only its key.
+
+    Tasks may also change column through ``status``. Publishes the new key
+    and returns it with the row's new version, or None if the row does not
+    exist. Raises ValueError for a malformed move, VersionConflict for a
+    stale ``version`` and NeighbourConflict when the client's view of the list
+    is out of date; lists whose keys no longer allow a slot are queued for a
+    rebalance.
+    """
+    if model is Task:
+        current = db.session.execute(
+            db.select(Task.status).where(Task.id == entity_id, Task.workspace_id == workspace_id)
+        ).first()
+        if current is None:
+            return None
+        status = data.get('status', current.status)
+        if not isinstance(status, str):
+            raise ValueError('status must be a string')
+        params = {'status': status}
+    else:
+        params = {'task_id': task_id}
+    scope = positions.list_scope(model, workspace_id, **params)
+
+    try:
+        after_id = int(data['after_id']) if data.get('after_id') is not None else None
+        before_id = int(data['before_id']) if data.get('before_id') is not None else None
+        version = int(data['version']) if data.get('version') is not None else None
+    except (TypeError, ValueError):
+        raise ValueError('after_id, before_id and version must be integers')
+    try:
+        after, before = _neighbour_keys(model, entity_id, scope, after_id, before_id)
+    except NeighbourConflict as e:
+        db.session.rollback()
+        if e.rebalance:
+            schedule_rebalance(workspace_id, params)
+        raise
+    if before is None:
+        key = positions.key_after(after)
+    else:
+        key = positions.key_between(after, before)
+
+    values = {'position': key}
+    if model is Task and status != current.status:
+        values['status'] = status
+    result = apply_patch(model, entity_id, values, workspace_id, version, task_id=task_id)
+    if result is None:
+        return None
+
+    moved = dict(values, id=entity_id, version=result[0], updated_at=result[1])
+    if model is Task:
+        publish('task_moved', moved, workspace_id)
+    else:
+        publish('subtask_moved', dict(moved, task_id=task_id), workspace_id)
+    if positions.needs_rebalance(key):
+        schedule_rebalance(workspace_id, params)
+    return moved
+
+
+def schedule_rebalance(workspace_id, params):
+    if jobs.active_job('rebalance_positions', workspace_id, **params) is None:
+        jobs.enqueue('rebalance_positions', workspace_id, **params)
+
+
+def _run_move(model, entity_id, workspace_id, task_id=None):
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({"error": "Request body must be a JSON object"}), 400
+    try:
+        if request.if_match:
+            data['version'] = expected_version({})
+        moved = move(model, entity_id, workspace_id, data, task_id)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except VersionConflict as e:
+        return conflict_response(e)
+    except NeighbourConflict:
+        return jsonify({"error": "The list changed; reload it and retry the move"}), 409
+    if moved is None:
+        return jsonify({"error": f"{'Task' if model is Task else 'Subtask'} not found"}), 404
+    response = jsonify(moved)
+    response.set_etag(str(moved['version']))
+    return response, 200
+
+
+@app.route('/workspaces/<int:workspace_id>/tasks/<int:task_id>/move', methods=['POST'])
+@jwt_required()
+@workspace_role_required()
+def move_task(workspace_id, task_id):
+    return _run_move(Task, task_id, workspace_id)
+
+
+@app.route('/tasks/<int:task_id>/subtasks/<int:subtask_id>/move', methods=['POST'])
+@jwt_required()
+@workspace_role_required()
+def move_subtask(task_id, subtask_id):
+    return _run_move(SubTask, subtask_id, g.workspace_id, task_id)
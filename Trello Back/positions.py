@@ -0,0 +1,154 @@
+"""Fractional position keys for ordering cards within a column and subtasks within a task.
+
+A key is a base-36 fraction written as its digits ("i" is 0.5, "i9" a bit
+more). A key can always be generated between two others, so moving a card
+rewrites only that card's row. Lowercase digits sort the same under binary
+and case-insensitive collations.
+"""
+from sqlalchemy import event
+from app import app, db
+from models import Task, SubTask
+
+DIGITS = '0123456789abcdefghijklmnopqrstuvwxyz'
+BASE = len(DIGITS)
+# Rebalanced lists are spread between these keys, leaving room at both ends
+REBALANCE_LOW, REBALANCE_HIGH = '9', 'r'
+
+
+def _midpoint(a, b):
+    # ``a`` is a key or '' for the start, ``b`` a key or None for the end
+    if b is not None:
+        common = 0
+        while common < len(b) and (a[common] if common < len(a) else '0') == b[common]:
+            common += 1
+        if common:
+            return b[:common] + _midpoint(a[common:], b[common:])
+    low = DIGITS.index(a[0]) if a else 0
+    high = DIGITS.index(b[0]) if b else BASE
+    if high - low > 1:
+        return DIGITS[(low + high) // 2]
+    if b and len(b) > 1:
+        return b[0]
+    return DIGITS[low] + _midpoint(a[1:], None)
+
+
+def key_between(a, b):
+    """Return a key sorting strictly between ``a`` and ``b``; None stands for either end."""
+    if a is not None and b is not None and a >= b:
+        raise ValueError(f'{a!r} does not sort before {b!r}')
+    return _midpoint(a or '', b)
+
+
+def key_after(a):
+    """Return a key after ``a``; appending grows keys far slower than repeated midpoints."""
+    if a is None or a == '':
+        return DIGITS[BASE // 2]
+    index = DIGITS.index(a[0])
+    if index < BASE - 1:
+        return DIGITS[index + 1]
+    return a[0] + key_after(a[1:])
+
+
+def keys_between(a, b, count):
+    """Return ``count`` ascending keys between ``a`` and ``b``, kept short by bisecting evenly."""
+    if count <= 0:
+        return []
+    middle = key_between(a, b)
+    left = (count - 1) // 2
+    return keys_between(a, middle, left) + [middle] + keys_between(middle, b, count - 1 - left)
+
+
+def keys_after(a, count):
+    """Return ``count`` ascending keys after ``a``, stepping like single appends while that stays short."""
+    if count <= BASE // 4:
+        keys = [key_after(a)]
+        while len(keys) < count:
+            keys.append(key_after(keys[-1]))
+        return keys
+    return keys_between(a, None, count)
+
+
+def is_key(value):
+    """Tell whether ``value`` is a key these functions could have produced; no key ends in '0'."""
+    return (isinstance(value, str) and 0 < len(value) <= Task.__table__.c.position.type.length
+            and value[-1] != '0' and all(digit in DIGITS for digit in value))
+
+
+def needs_rebalance(key):
+    return len(key) > app.config['POSITION_MAX_LENGTH']
+
+
+# Helper functions for the last key of a column or of a task's subtasks
+def last_task_position(session, workspace_id, status):
+    return session.execute(
+        db.select(db.func.max(Task.position)).where(Task.workspace_id == workspace_id, Task.status == status)
+    ).scalar()
+
+
+def last_subtask_position(session, task_id):
+    return session.execute(db.select(db.func.max(SubTask.position)).where(SubTask.task_id == task_id)).scalar()
+
+
+def _default_status():
+    return Task.__table__.c.status.default.arg
+
+
+# Append new cards to the end of their column unless a position was given
+@event.listens_for(db.session, 'before_flush')
+def assign_positions(session, flush_context, instances):
+    last = {}
+    with session.no_autoflush:
+        for obj in session.new:
+            if isinstance(obj, Task) and obj.position is None and obj.workspace_id is not None:
+                status = obj.status if obj.status is not None else _default_status()
+                column = ('task', obj.workspace_id, status)
+                if column not in last:
+                    last[column] = last_task_position(session, obj.workspace_id, status)
+            elif isinstance(obj, SubTask) and obj.position is None and obj.task_id is not None:
+                column = ('subtask', obj.task_id)
+                if column not in last:
+                    last[column] = last_subtask_position(session, obj.task_id)
+            else:
+                continue
+            obj.position = last[column] = key_after(last[column])
+
+
+def assign_task_positions(session, workspace_id, rows):
+    """Give bulk-inserted task rows consecutive keys at the end of their columns."""
+    by_status = {}
+    for row in rows:
+        if row.get('position') is None:
+            by_status.setdefault(row.get('status', _default_status()), []).append(row)
+    for status, column in by_status.items():
+        for row, key in zip(column, keys_after(last_task_position(session, workspace_id, status), len(column))):
+            row['position'] = key
+
+
+def assign_subtask_positions(session, rows, new_task_ids=()):
+    """Same for subtask rows; tasks created in the same batch start out empty."""
+    by_task = {}
+    for row in rows:
+        if row.get('position') is None:
+            by_task.setdefault(row['task_id'], []).append(row)
+    for task_id, subtasks in by_task.items():
+        last = None if task_id in new_task_ids else last_subtask_position(session, task_id)
+        for row, key in zip(subtasks, keys_after(last, len(subtasks))):
+            row['position'] = key
+
+
+def list_scope(model, workspace_id, status=None, task_id=None):
+    if model is Task:
+        return [Task.workspace_id == workspace_id, Task.status == status]
+    return [SubTask.task_id == task_id]
+
+
+def rebalanced_rows(session, model, scope):
+    """Return ``{id, position}`` rows respacing one list's keys while keeping its order.
+
+    Rows without a key yet (created before positions existed) come first.
+    """
+    ids = session.execute(
+        db.select(model.id).where(*scope).order_by(model.position, model.id)
+    ).scalars().all()
+    keys = keys_between(REBALANCE_LOW, REBALANCE_HIGH, len(ids))
+    return [{'id': row_id, 'position': key} for row_id, key in zip(ids, keys)]
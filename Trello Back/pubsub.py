@@ -0,0 +1,197 @@
+import pickle
+import uuid
+import socketio
+from flask import current_app
+from locks import WorkerLock
+import wire
+
+
+class LocalManager(socketio.PubSubManager):
+    """In-process pub/sub backend for the Socket.IO layer.
+
+    Every server in this process listening on the same channel receives every
+    published message, the way separate workers would through a shared broker.
+    Useful for tests and for exercising the multi-node code path on one host.
+    """
+    name = 'local'
+    _subscribers = {}
+
+    def __init__(self, url='local://', channel='flask-socketio', write_only=False, logger=None):
+        super().__init__(channel=channel, write_only=write_only, logger=logger)
+        self.url = url
+
+    def _publish(self, data):
+        message = pickle.dumps(data)
+        for queue in list(self._subscribers.get(self.channel, [])):
+            queue.put(message)
+
+    def _listen(self):
+        queue = self.server.eio.create_queue()
+        self._subscribers.setdefault(self.channel, []).append(queue)
+        while True:
+            yield queue.get()
+
+
+def message_queue_options(url, channel='flask-socketio'):
+    """Return the SocketIO keyword arguments for the configured message queue.
+
+    ``None`` keeps the single-process in-memory manager, ``local://`` uses
+    :class:`LocalManager`, and any other URL (``redis://``, ``kafka://``,
+    ``zmq+tcp://``, ``amqp://``...) is handed to Flask-SocketIO, which picks
+    the matching backend.
+    """
+    if not url:
+        return {}
+    if url.startswith('local://'):
+        return {'client_manager': LocalManager(url, channel=channel)}
+    return {'message_queue': url, 'channel': channel}
+
+
+def _queue_class(url):
+    # The backend Flask-SocketIO picks for a message queue URL
+    if url.startswith('local://'):
+        return LocalManager
+    if url.startswith(('redis://', 'rediss://')):
+        return socketio.RedisManager
+    if url.startswith('kafka://'):
+        return socketio.KafkaManager
+    if url.startswith('zmq'):
+        return socketio.ZmqManager
+    return socketio.KombuManager
+
+
+def _decode(message):
+    # Backends hand back what they published either decoded or pickled
+    if isinstance(message, dict):
+        return message
+    try:
+        return pickle.loads(message)
+    except Exception:
+        return None
+
+
+class MembershipChannel:
+    """Carries membership changes to the other nodes sharing the message queue.
+
+    It is a channel of its own on the same backend, next to the one Socket.IO
+    emits travel on, used through the ``_publish``/``_listen`` pair every
+    backend implements (see :class:`LocalManager`). A node applies its own
+    changes directly and skips them when they come back.
+    """
+
+    def __init__(self, manager):
+        self.manager = manager
+        self.host_id = uuid.uuid4().hex
+        self.listener = None
+
+    def start(self, server, listener):
+        """Call ``listener(user_id, workspace_id)`` for changes published by other nodes."""
+        if self.listener is not None:
+            return
+        self.listener = listener
+        # Backends create their queues and listening tasks through the Socket.IO server
+        self.manager.set_server(server)
+        server.start_background_task(self.listen, server)
+
+    def publish(self, user_id, workspace_id):
+        self.manager._publish({'host_id': self.host_id, 'user_id': user_id, 'workspace_id': workspace_id})
+
+    def listen(self, server):
+        for message in self.manager._listen():
+            data = _decode(message)
+            if not isinstance(data, dict) or data.get('host_id') in (None, self.host_id):
+                continue
+            try:
+                self.listener(data.get('user_id'), data['workspace_id'])
+            except Exception:
+                server.logger.exception('Applying a membership change failed')
+
+
+def membership_channel(url, channel='flask-socketio'):
+    """Return the :class:`MembershipChannel` for a message queue URL, or ``None`` without one."""
+    if not url:
+        return None
+    return MembershipChannel(_queue_class(url)(url, channel=f'{channel}-membership'))
+
+
+def workspace_room(workspace_id, encoding='json'):
+    # Connections that negotiated a binary encoding share a room per encoding
+    room = f'workspace_{workspace_id}'
+    return room if encoding == 'json' else f'{room}.{encoding}'
+
+
+def _has_members(server, room):
+    manager = server.manager
+    # Behind a queue the room's members may all be on other nodes
+    if isinstance(manager, socketio.PubSubManager):
+        return True
+    return bool(manager.rooms.get('/', {}).get(room))
+
+
+def emit_to_workspace(socketio, encodings, event, payload, workspace_id):
+    # Each event is encoded once per encoding in use, not once per connection
+    for encoding in encodings:
+        room = workspace_room(workspace_id, encoding)
+        if encoding == 'json' or _has_members(socketio.server, room):
+            socketio.emit(event, wire.encode(payload, encoding), to=room)
+
+
+def _merge(previous, payload):
+    # Later values win; nested dicts such as the changed task fields accumulate
+    merged = dict(previous)
+    for key, value in payload.items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = dict(merged[key], **value)
+        else:
+            merged[key] = value
+    return merged
+
+
+class Coalescer:
+    """Collects updates per (event, workspace, key) and emits each once per tick."""
+
+    def __init__(self):
+        self.pending = {}
+        self.lock = WorkerLock()
+        self.socketio = None
+        self.encodings = ('json',)
+
+    def add(self, socketio, interval, event, payload, workspace_id, key):
+        self.encodings = current_app.config['SOCKET_ENCODINGS']
+        with self.lock:
+            slot = (event, workspace_id, key)
+            self.pending[slot] = _merge(self.pending[slot], payload) if slot in self.pending else payload
+            if self.socketio is None:
+                self.socketio = socketio
+                socketio.start_background_task(self.run, interval)
+
+    def run(self, interval):
+        while True:
+            self.socketio.sleep(interval)
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            pending, self.pending = self.pending, {}
+        for (event, workspace_id, _), payload in pending.items():
+            emit_to_workspace(self.socketio, self.encodings, event, payload, workspace_id)
+
+
+coalescer = Coalescer()
+
+
+def publish(event, payload, workspace_id):
+    """Emit ``event`` to a workspace's room on every node sharing the queue."""
+    # Send anything still waiting in the coalescer first so events keep their order
+    coalescer.flush()
+    emit_to_workspace(current_app.extensions['socketio'], current_app.config['SOCKET_ENCODINGS'],
+                      event, payload, workspace_id)
+
+
+def publish_update(event, payload, workspace_id, key):
+    """Like :func:`publish`, but merges updates to the same ``key`` within one tick."""
+    interval = current_app.config['SOCKET_COALESCE_INTERVAL']
+    if interval <= 0:
+        publish(event, payload, workspace_id)
+    else:
+        coalescer.add(current_app.extensions['socketio'], interval, event, payload, workspace_id, key)
@@ -1,38 +1,120 @@
+import base64
+import zlib
 from datetime import datetime
-from flask import request, jsonify
+from flask import request, jsonify, g, abort
+from sqlalchemy import and_, or_
+from sqlalchemy.exc import IntegrityError
 from app import app, db
 from models import Workspace, Task, SubTask, User, UserWorkspaceRole
+from authz import workspace_role_required, invalidate_role, validate_role
+from pubsub import publish, publish_update
+from passwords import hash_password
+from sync import bump_workspace_version, board_etag, changes_since, parse_since, changed_fields
+from serializers import TASK_UPDATE_FIELDS, task_update_payload, json_response, task_dicts, subtask_dicts, workspace_dicts, user_dicts, role_dicts
+import search
+import stats
+import jobs
+import cache
+import directory
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from werkzeug.security import generate_password_hash, check_password_hash
 
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+# Query parameters that switch user listings to the paged directory
+DIRECTORY_ARGS = ('prefix', 'limit', 'cursor')
 
 
 
-# Helper function to get current user
-def get_current_user():
-    user_id = get_jwt_identity()
-    return User.query.get(user_id)
 
 # Helper function to parse datetime
 def parse_datetime(datetime_str):
     return datetime.strptime(datetime_str, "%Y-%m-%dT%H:%M:%S.%fZ") if datetime_str else None
 
+# Helper functions for keyset pagination over (updated_at, id)
+def encode_cursor(updated_at, row_id):
+    raw = f'{updated_at.isoformat()}|{row_id}'
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def decode_cursor(cursor):
+    raw = base64.urlsafe_b64decode(cursor.encode()).decode()
+    updated_at, row_id = raw.rsplit('|', 1)
+    return datetime.fromisoformat(updated_at), int(row_id)
+
+def parse_page_size(value):
+    if value is None:
+        return DEFAULT_PAGE_SIZE
+    return max(1, min(int(value), MAX_PAGE_SIZE))
+
+def paginate_tasks(query, cursor):
+    if cursor:
+        updated_at, last_id = decode_cursor(cursor)
+        query = query.filter(or_(
+            Task.updated_at > updated_at,
+            and_(Task.updated_at == updated_at, Task.id > last_id)
+        ))
+    return query.order_by(Task.updated_at, Task.id)
+
+# Helper functions for task filters and sort keys given as query parameters
+TASK_SORT_KEYS = {
+    'created_at': Task.created_at,
+    'updated_at': Task.updated_at,
+    'due_date': Task.due_date,
+    'priority': Task.priority,
+    'status': Task.status,
+    'title': Task.title,
+}
+
+def wants_overdue(args):
+    return args.get('overdue') in ('1', 'true')
+
+def filter_tasks(query, args):
+    if 'status' in args:
+        query = query.filter(Task.status.in_(args.getlist('status')))
+    if 'priority' in args:
+        query = query.filter(Task.priority.in_(args.getlist('priority')))
+    if 'assignee_id' in args:
+        query = query.filter(Task.assignee_id == int(args['assignee_id']))
+    if 'due_after' in args:
+        query = query.filter(Task.due_date >= parse_since(args['due_after']))
+    if 'due_before' in args:
+        query = query.filter(Task.due_date < parse_since(args['due_before']))
+    if wants_overdue(args):
+        query = query.filter(Task.due_date < datetime.utcnow(),
+                             Task.status.notin_(app.config['TASK_DONE_STATUSES']))
+    return query
+
+def sort_tasks(query, sort):
+    column = TASK_SORT_KEYS.get(sort.lstrip('-'))
+    if column is None:
+        raise ValueError(f'Unknown sort key: {sort}')
+    return query.order_by(column.desc() if sort.startswith('-') else column, Task.id)
+
+# Helper functions for keying cached listings on a workspace's version; the
+# creation time tells apart a deleted workspace whose id was reused
+def workspace_generation(workspace_id):
+    return db.session.query(Workspace.version, Workspace.created_at).filter_by(id=workspace_id).first()
+
+def generation_key(workspace_id, generation):
+    version, created_at = generation
+    return f'{workspace_id}:{version}:{created_at.timestamp() if created_at else 0}'
+
 # Workspace Routes
 
 @app.route('/workspaces', methods=['GET'])
 @jwt_required()
 def get_workspaces():
-    current_user = get_current_user()
-    user_roles = UserWorkspaceRole.query.filter_by(user_id=current_user.id).all()
-    workspace_ids = [role.workspace_id for role in user_roles]
-    workspaces = Workspace.query.filter(Workspace.id.in_(workspace_ids)).all()
-    return jsonify([workspace.to_dict() for workspace in workspaces]), 200
+    user_id = get_jwt_identity()
+    query = Workspace.query.join(UserWorkspaceRole).filter(UserWorkspaceRole.user_id == user_id)
+    # The ids and versions of the user's workspaces change with every membership or workspace edit
+    generation = zlib.crc32(repr(query.with_entities(Workspace.id, Workspace.version).order_by(Workspace.id).all()).encode())
+    return cache.cached_response('workspaces', f'{user_id}:{generation:08x}',
+                                 lambda: (json_response(workspace_dicts(query)), 200))
 
 @app.route('/workspaces', methods=['POST'])
 @jwt_required()
 def create_workspace():
     data = request.get_json()
-    current_user = get_current_user()
+    user_id = get_jwt_identity()
     new_workspace = Workspace(
         name=data['name'],
         description=data.get('description', '')
@@ -42,66 +124,129 @@ def create_workspace():
 
     # Add the creator as the admin of the workspace
     new_role = UserWorkspaceRole(
-        user_id=current_user.id,
+        user_id=user_id,
         workspace_id=new_workspace.id,
         role='admin'
     )
     db.session.add(new_role)
     db.session.commit()
+    invalidate_role(user_id, new_workspace.id)
     return jsonify(new_workspace.to_dict()), 201
 
 @app.route('/workspaces/<int:workspace_id>', methods=['GET'])
 @jwt_required()
+@workspace_role_required()
 def get_workspace(workspace_id):
-    current_user = get_current_user()
-    role = UserWorkspaceRole.query.filter_by(workspace_id=workspace_id, user_id=current_user.id).first_or_404()
     workspace = Workspace.query.get_or_404(workspace_id)
     return jsonify(workspace.to_dict()), 200
 
 @app.route('/workspaces/<int:workspace_id>', methods=['PUT'])
 @jwt_required()
+@workspace_role_required(admin=True)
 def update_workspace(workspace_id):
     data = request.get_json()
-    current_user = get_current_user()
-    role = UserWorkspaceRole.query.filter_by(workspace_id=workspace_id, user_id=current_user.id).first_or_404()
-    if role.role != 'admin':
-        return jsonify({"error": "Not authorized"}), 403
 
     workspace = Workspace.query.get_or_404(workspace_id)
     workspace.name = data['name']
     workspace.description = data.get('description', '')
+    # Workspace and member edits also bump the version that keys the cached listings
+    bump_workspace_version(db.session, workspace_id)
     db.session.commit()
-    return jsonify(workspace.to_dict()), 200
+    workspace_data = workspace.to_dict()
+    publish('workspace_response', {'message': 'Workspace updated successfully', 'workspace': workspace_data}, workspace_id)
+    return jsonify(workspace_data), 200
 
 @app.route('/workspaces/<int:workspace_id>', methods=['DELETE'])
 @jwt_required()
+@workspace_role_required(admin=True)
 def delete_workspace(workspace_id):
-    current_user = get_current_user()
-    role = UserWorkspaceRole.query.filter_by(workspace_id=workspace_id, user_id=current_user.id).first_or_404()
-    if role.role != 'admin':
-        return jsonify({"error": "Not authorized"}), 403
-
-    workspace = Workspace.query.get_or_404(workspace_id)
-    db.session.delete(workspace)
-    db.session.commit()
-    return '', 204
+    Workspace.query.get_or_404(workspace_id)
+    # Large workspaces are deleted in chunks by a background job; progress is
+    # reported at /jobs/<id> and as job_response events in the workspace room
+    job = jobs.active_job('delete_workspace', workspace_id) or \
+        jobs.enqueue('delete_workspace', workspace_id, int(get_jwt_identity()))
+    return jobs.job_response(job)
 
 # Task Routes
 
 @app.route('/workspaces/<int:workspace_id>/tasks', methods=['GET'])
 @jwt_required()
+@workspace_role_required()
 def get_tasks(workspace_id):
-    current_user = get_current_user()
-    role = UserWorkspaceRole.query.filter_by(workspace_id=workspace_id, user_id=current_user.id).first_or_404()
-    tasks = Task.query.filter_by(workspace_id=workspace_id).all()
-    return jsonify([task.to_dict() for task in tasks]), 200
+    version = workspace_generation(workspace_id)
+    if version is None:
+        abort(404)
+    # Overdue tasks change with the clock, not only with the version; never cache or 304 them
+    if wants_overdue(request.args):
+        return list_tasks(workspace_id, version[0])
+
+    # Unchanged boards are answered from the version counter alone
+    etag = board_etag(workspace_id, version[0])
+    if request.if_none_match.contains(etag):
+        response = app.response_class(status=304)
+        response.set_etag(etag)
+        return response
+
+    response, status = cache.cached_response('tasks', generation_key(workspace_id, version),
+                                             lambda: list_tasks(workspace_id, version[0]))
+    if status == 200:
+        response.set_etag(etag)
+    return response, status
+
+def list_tasks(workspace_id, version):
+    if 'since' in request.args or 'since_version' in request.args:
+        try:
+            if 'since_version' in request.args:
+                changes = changes_since(workspace_id, since_version=int(request.args['since_version']))
+            else:
+                changes = changes_since(workspace_id, since=parse_since(request.args['since']))
+        except ValueError:
+            return jsonify({"error": "Invalid since parameter"}), 400
+        changes['version'] = version
+        return json_response(changes), 200
+
+    try:
+        query = filter_tasks(Task.query.filter_by(workspace_id=workspace_id), request.args)
+    except ValueError:
+        return jsonify({"error": "Invalid filter parameters"}), 400
+
+    # Without paging parameters keep returning the whole board as a plain list
+    if 'limit' not in request.args and 'cursor' not in request.args:
+        try:
+            if 'sort' in request.args:
+                query = sort_tasks(query, request.args['sort'])
+            else:
+                # Board order, read straight off the (workspace_id, status, position) index
+                query = query.order_by(Task.status, Task.position, Task.id)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        return json_response(task_dicts(query)), 200
+
+    # Pages are always ordered by the (updated_at, id) cursor
+    if 'sort' in request.args:
+        return jsonify({"error": "sort cannot be combined with cursor pagination"}), 400
+    try:
+        limit = parse_page_size(request.args.get('limit'))
+        query = paginate_tasks(query, request.args.get('cursor'))
+    except (ValueError, UnicodeDecodeError):
+        return jsonify({"error": "Invalid pagination parameters"}), 400
+
+    # Fetch one extra row to know whether another page exists
+    tasks = task_dicts(query.limit(limit + 1))
+    next_cursor = None
+    if len(tasks) > limit:
+        tasks = tasks[:limit]
+        next_cursor = encode_cursor(tasks[-1]['updated_at'], tasks[-1]['id'])
+    return json_response({
+        'tasks': tasks,
+        'next_cursor': next_cursor
+    }), 200
 
 @app.route('/workspaces/<int:workspace_id>/tasks', methods=['POST'])
 @jwt_required()
+@workspace_role_required()
 def create_task(workspace_id):
     data = request.get_json()
-    current_user = get_current_user()
-    role = UserWorkspaceRole.query.filter_by(workspace_id=workspace_id, user_id=current_user.id).first_or_404()
 
     due_date = parse_datetime(data.get('due_date'))
 
@@ -118,22 +263,25 @@ def create_task(workspace_id):
     )
     db.session.add(new_task)
     db.session.commit()
-    return jsonify(new_task.to_dict()), 201
+    task_data = new_task.to_dict()
+    publish('task_response', {'message': 'Task created successfully', 'task': task_data}, workspace_id)
+    return jsonify(task_data), 201
 
 @app.route('/workspaces/<int:workspace_id>/tasks/<int:task_id>', methods=['GET'])
 @jwt_required()
+@workspace_role_required()
 def get_task(workspace_id, task_id):
-    current_user = get_current_user()
-    role = UserWorkspaceRole.query.filter_by(workspace_id=workspace_id, user_id=current_user.id).first_or_404()
     task = Task.query.filter_by(workspace_id=workspace_id, id=task_id).first_or_404()
-    return jsonify(task.to_dict()), 200
+    response = jsonify(task.to_dict())
+    # Clients send this back in If-Match to PATCH without clobbering other edits
+    response.set_etag(str(task.sync_version))
+    return response, 200
 
 @app.route('/workspaces/<int:workspace_id>/tasks/<int:task_id>', methods=['PUT'])
 @jwt_required()
+@workspace_role_required()
 def update_task(workspace_id, task_id):
     data = request.get_json()
-    current_user = get_current_user()
-    role = UserWorkspaceRole.query.filter_by(workspace_id=workspace_id, user_id=current_user.id).first_or_404()
 
     task = Task.query.filter_by(workspace_id=workspace_id, id=task_id).first_or_404()
 
@@ -145,39 +293,74 @@ def update_task(workspace_id, task_id):
     task.due_date = parse_datetime(data.get('due_date'))
     task.priority = data.get('priority')
     task.assignee_id = data.get('assignee_id')
+    changes = changed_fields(task, TASK_UPDATE_FIELDS)
     db.session.commit()
-    return jsonify(task.to_dict()), 200
+    task_data = task.to_dict()
+    publish_update('task_response', task_update_payload(task_id, task.sync_version, task.updated_at, changes),
+                   workspace_id, task_id)
+    return jsonify(task_data), 200
 
 @app.route('/workspaces/<int:workspace_id>/tasks/<int:task_id>', methods=['DELETE'])
 @jwt_required()
+@workspace_role_required()
 def delete_task(workspace_id, task_id):
-    current_user = get_current_user()
-    role = UserWorkspaceRole.query.filter_by(workspace_id=workspace_id, user_id=current_user.id).first_or_404()
-
     task = Task.query.filter_by(workspace_id=workspace_id, id=task_id).first_or_404()
     db.session.delete(task)
     db.session.commit()
+    publish('task_response', {'message': 'Task deleted successfully', 'id': task_id}, workspace_id)
     return '', 204
 
+@app.route('/workspaces/<int:workspace_id>/search', methods=['GET'])
+@jwt_required()
+@workspace_role_required()
+def search_tasks(workspace_id):
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({"error": "q is required"}), 400
+    try:
+        limit = parse_page_size(request.args.get('limit'))
+        offset = max(0, int(request.args.get('offset', 0)))
+    except ValueError:
+        return jsonify({"error": "Invalid pagination parameters"}), 400
+
+    # Fetch one extra hit to know whether another page exists
+    hits = search.search(workspace_id, query, limit + 1, offset)
+    next_offset = offset + limit if len(hits) > limit else None
+    hits = hits[:limit]
+
+    task_ids = [entity_id for entity_type, entity_id, _, _ in hits if entity_type == 'task']
+    subtask_ids = [entity_id for entity_type, entity_id, _, _ in hits if entity_type == 'subtask']
+    tasks = {task['id']: task for task in task_dicts(Task.query.filter(Task.id.in_(task_ids)), include_subtasks=False)}
+    subtasks = {subtask['id']: subtask for subtask in subtask_dicts(SubTask.query.filter(SubTask.id.in_(subtask_ids)))}
+
+    results = []
+    for entity_type, entity_id, task_id, score in hits:
+        item = tasks.get(entity_id) if entity_type == 'task' else subtasks.get(entity_id)
+        if item is not None:
+            results.append({'type': entity_type, 'score': score, entity_type: item})
+    return json_response({'results': results, 'next_offset': next_offset}), 200
+
+@app.route('/workspaces/<int:workspace_id>/stats', methods=['GET'])
+@jwt_required()
+@workspace_role_required()
+def get_workspace_stats(workspace_id):
+    # Read from the incrementally maintained aggregates instead of scanning tasks
+    return json_response(stats.workspace_stats(workspace_id)), 200
+
 # SubTask Routes
 
 @app.route('/tasks/<int:task_id>/subtasks', methods=['GET'])
 @jwt_required()
+@workspace_role_required()
 def get_subtasks(task_id):
-    current_user = get_current_user()
-    task = Task.query.get_or_404(task_id)
-    role = UserWorkspaceRole.query.filter_by(workspace_id=task.workspace_id, user_id=current_user.id).first_or_404()
-
-    subtasks = SubTask.query.filter_by(task_id=task_id).all()
-    return jsonify([subtask.to_dict() for subtask in subtasks]), 200
+    query = SubTask.query.filter_by(task_id=task_id).order_by(SubTask.position, SubTask.id)
+    return json_response(subtask_dicts(query)), 200
 
 @app.route('/tasks/<int:task_id>/subtasks', methods=['POST'])
 @jwt_required()
+@workspace_role_required()
 def create_subtask(task_id):
     data = request.get_json()
-    current_user = get_current_user()
-    task = Task.query.get_or_404(task_id)
-    role = UserWorkspaceRole.query.filter_by(workspace_id=task.workspace_id, user_id=current_user.id).first_or_404()
 
     new_subtask = SubTask(
         task_id=task_id,
@@ -187,43 +370,40 @@ def create_subtask(task_id):
     )
     db.session.add(new_subtask)
     db.session.commit()
-    return jsonify(new_subtask.to_dict()), 201
+    subtask_data = new_subtask.to_dict()
+    publish('subtask_response', {'message': 'Subtask created successfully', 'subtask': subtask_data}, g.workspace_id)
+    return jsonify(subtask_data), 201
 
 @app.route('/tasks/<int:task_id>/subtasks/<int:subtask_id>', methods=['GET'])
 @jwt_required()
+@workspace_role_required()
 def get_subtask(task_id, subtask_id):
-    current_user = get_current_user()
-    task = Task.query.get_or_404(task_id)
-    role = UserWorkspaceRole.query.filter_by(workspace_id=task.workspace_id, user_id=current_user.id).first_or_404()
-
     subtask = SubTask.query.filter_by(task_id=task_id, id=subtask_id).first_or_404()
     return jsonify(subtask.to_dict()), 200
 
 @app.route('/tasks/<int:task_id>/subtasks/<int:subtask_id>', methods=['PUT'])
 @jwt_required()
+@workspace_role_required()
 def update_subtask(task_id, subtask_id):
     data = request.get_json()
-    current_user = get_current_user()
-    task = Task.query.get_or_404(task_id)
-    role = UserWorkspaceRole.query.filter_by(workspace_id=task.workspace_id, user_id=current_user.id).first_or_404()
 
     subtask = SubTask.query.filter_by(task_id=task_id, id=subtask_id).first_or_404()
     subtask.title = data['title']
     subtask.is_completed = data.get('is_completed', False)
     subtask.assignee_id = data.get('assignee_id')
     db.session.commit()
-    return jsonify(subtask.to_dict()), 200
+    subtask_data = subtask.to_dict()
+    publish('subtask_response', {'message': 'Subtask updated successfully', 'subtask': subtask_data}, g.workspace_id)
+    return jsonify(subtask_data), 200
 
 @app.route('/tasks/<int:task_id>/subtasks/<int:subtask_id>', methods=['DELETE'])
 @jwt_required()
+@workspace_role_required()
 def delete_subtask(task_id, subtask_id):
-    current_user = get_current_user()
-    task = Task.query.get_or_404(task_id)
-    role = UserWorkspaceRole.query.filter_by(workspace_id=task.workspace_id, user_id=current_user.id).first_or_404()
-
     subtask = SubTask.query.filter_by(task_id=task_id, id=subtask_id).first_or_404()
     db.session.delete(subtask)
     db.session.commit()
+    publish('subtask_response', {'message': 'Subtask deleted successfully', 'id': subtask_id, 'task_id': task_id}, g.workspace_id)
     return '', 204
 
 # User Routes
@@ -231,8 +411,21 @@ def delete_subtask(task_id, subtask_id):
 @app.route('/users', methods=['GET'])
 @jwt_required()
 def get_users():
-    users = User.query.all()
-    return jsonify([user.to_dict() for user in users]), 200
+    # Callers only see the users they share a workspace with
+    scope = db.select(UserWorkspaceRole.workspace_id).where(UserWorkspaceRole.user_id == get_jwt_identity())
+    if not any(arg in request.args for arg in DIRECTORY_ARGS):
+        return json_response(user_dicts(User.query.filter(User.id.in_(directory.members(scope))))), 200
+    return user_directory_page(scope)
+
+# Helper function to answer an assignee picker query (?prefix=&limit=&cursor=)
+def user_directory_page(scope):
+    try:
+        limit = parse_page_size(request.args.get('limit'))
+        users, next_cursor = directory.find_users(scope, request.args.get('prefix', '').strip(), limit,
+                                                  request.args.get('cursor'))
+    except (ValueError, UnicodeDecodeError):
+        return jsonify({"error": "Invalid pagination parameters"}), 400
+    return json_response({'users': users, 'next_cursor': next_cursor}), 200
 
 @app.route('/users', methods=['POST'])
 def create_user():
@@ -240,7 +433,7 @@ def create_user():
     new_user = User(
         username=data['username'],
         email=data['email'],
-        password_hash=generate_password_hash(data['password'])
+        password_hash=hash_password(data['password'])
     )
     db.session.add(new_user)
     db.session.commit()
@@ -259,37 +452,43 @@ def update_user(user_id):
     user = User.query.get_or_404(user_id)
     user.username = data['username']
     user.email = data['email']
-    user.password_hash = generate_password_hash(data['password'])
+    # Only hash when a new password is sent; hashing is the expensive part
+    if data.get('password'):
+        user.password_hash = hash_password(data['password'])
     db.session.commit()
     return jsonify(user.to_dict()), 200
 
 @app.route('/users/<int:user_id>', methods=['DELETE'])
 @jwt_required()
 def delete_user(user_id):
-    user = User.query.get_or_404(user_id)
-    db.session.delete(user)
-    db.session.commit()
-    return '', 204
+    User.query.get_or_404(user_id)
+    job = jobs.active_job('delete_user', user_id=user_id) or \
+        jobs.enqueue('delete_user', requested_by=int(get_jwt_identity()), user_id=user_id)
+    return jobs.job_response(job)
 
 # UserWorkspaceRole Routes
 
 @app.route('/workspaces/<int:workspace_id>/users', methods=['GET'])
 @jwt_required()
+@workspace_role_required()
 def get_workspace_users(workspace_id):
-    current_user = get_current_user()
-    role = UserWorkspaceRole.query.filter_by(workspace_id=workspace_id, user_id=current_user.id).first_or_404()
-
-    roles = UserWorkspaceRole.query.filter_by(workspace_id=workspace_id).all()
-    return jsonify([role.to_dict() for role in roles]), 200
+    if any(arg in request.args for arg in DIRECTORY_ARGS):
+        return user_directory_page([workspace_id])
+    version = workspace_generation(workspace_id)
+    if version is None:
+        abort(404)
+    return cache.cached_response('members', generation_key(workspace_id, version), lambda: (
+        json_response(role_dicts(UserWorkspaceRole.query.filter_by(workspace_id=workspace_id))), 200))
 
 @app.route('/workspaces/<int:workspace_id>/users', methods=['POST'])
 @jwt_required()
+@workspace_role_required(admin=True)
 def add_user_to_workspace(workspace_id):
     data = request.get_json()
-    current_user = get_current_user()
-    role = UserWorkspaceRole.query.filter_by(workspace_id=workspace_id, user_id=current_user.id).first_or_404()
-    if role.role != 'admin':
-        return jsonify({"error": "Not authorized"}), 403
+    try:
+        validate_role(data.get('role'))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
     new_role = UserWorkspaceRole(
         user_id=data['user_id'],
@@ -297,32 +496,39 @@ def add_user_to_workspace(workspace_id):
         role=data['role']
     )
     db.session.add(new_role)
-    db.session.commit()
+    try:
+        bump_workspace_version(db.session, workspace_id)
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        return jsonify({"error": "User is already a member of this workspace"}), 400
+    invalidate_role(new_role.user_id, workspace_id)
     return jsonify(new_role.to_dict()), 201
 
 @app.route('/workspaces/<int:workspace_id>/users/<int:user_id>', methods=['PUT'])
 @jwt_required()
+@workspace_role_required(admin=True)
 def update_user_role(workspace_id, user_id):
     data = request.get_json()
-    current_user = get_current_user()
-    role = UserWorkspaceRole.query.filter_by(workspace_id=workspace_id, user_id=current_user.id).first_or_404()
-    if role.role != 'admin':
-        return jsonify({"error": "Not authorized"}), 403
+    try:
+        validate_role(data.get('role'))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
     user_role = UserWorkspaceRole.query.filter_by(workspace_id=workspace_id, user_id=user_id).first_or_404()
     user_role.role = data['role']
+    bump_workspace_version(db.session, workspace_id)
     db.session.commit()
+    invalidate_role(user_id, workspace_id)
     return jsonify(user_role.to_dict()), 200
 
 @app.route('/workspaces/<int:workspace_id>/users/<int:user_id>', methods=['DELETE'])
 @jwt_required()
+@workspace_role_required(admin=True)
 def remove_user_from_workspace(workspace_id, user_id):
-    current_user = get_current_user()
-    role = UserWorkspaceRole.query.filter_by(workspace_id=workspace_id, user_id=current_user.id).first_or_404()
-    if role.role != 'admin':
-        return jsonify({"error": "Not authorized"}), 403
-
     user_role = UserWorkspaceRole.query.filter_by(workspace_id=workspace_id, user_id=user_id).first_or_404()
     db.session.delete(user_role)
+    bump_workspace_version(db.session, workspace_id)
     db.session.commit()
+    invalidate_role(user_id, workspace_id)
     return '', 204
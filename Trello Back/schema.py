@@ -0,0 +1,197 @@
+"""Bring a database created by an earlier version up to the current models.
+
+``db.create_all`` only creates missing tables. Tables that already exist
+also need the columns, indexes and constraints added to their models since,
+and rows written before a feature existed need its derived data backfilled.
+Every step checks the live schema first, so running it again is a no-op.
+"""
+from sqlalchemy import Integer, inspect, literal, text
+from sqlalchemy.schema import CreateTable
+from app import db
+from models import Task, SubTask, ArchivedTask, ArchivedSubTask, Workspace, UserWorkspaceRole, WorkspaceStat
+
+# Tables whose ids must stay clear of the board ids kept in an archive table
+ARCHIVED_IDS = {Task.__tablename__: ArchivedTask, SubTask.__tablename__: ArchivedSubTask}
+
+
+def _quote(connection, name):
+    return connection.dialect.identifier_preparer.quote(name)
+
+
+def _sql_literal(connection, value):
+    return str(literal(value).compile(dialect=connection.dialect, compile_kwargs={'literal_binds': True}))
+
+
+def _add_column(connection, table, column):
+    ddl = (f'ALTER TABLE {_quote(connection, table.name)} ADD COLUMN {_quote(connection, column.name)} '
+           f'{column.type.compile(dialect=connection.dialect)}')
+    default = column.default.arg if column.default is not None and column.default.is_scalar else None
+    # Existing rows take the default; without one the column has to start out nullable
+    if default is not None:
+        ddl += f' DEFAULT {_sql_literal(connection, default)}'
+        if not column.nullable:
+            ddl += ' NOT NULL'
+    connection.execute(text(ddl))
+
+
+def add_missing_columns(connection, existing):
+    added = []
+    for table in db.metadata.sorted_tables:
+        if table.name not in existing:
+            continue
+        present = {column['name'] for column in inspect(connection).get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in present:
+                _add_column(connection, table, column)
+                added.append(f'{table.name}.{column.name}')
+    return added
+
+
+def _needs_autoincrement(connection, table):
+    if connection.dialect.name != 'sqlite' or not table.dialect_options['sqlite']['autoincrement']:
+        return False
+    sql = connection.execute(text("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = :name"),
+                             {'name': table.name}).scalar()
+    return 'AUTOINCREMENT' not in sql.upper()
+
+
+def rebuild_autoincrement(table):
+    """Recreate a SQLite table as AUTOINCREMENT so ids of deleted rows are never handed out again.
+
+    SQLite cannot change a primary key in place; the rows are copied to a new
+    table that then replaces the old one. Its indexes are recreated by
+    :func:`add_missing_indexes`.
+    """
+    with db.engine.begin() as connection:
+        name = _quote(connection, table.name)
+        staging = _quote(connection, f'{table.name}_upgrade')
+        create = str(CreateTable(table).compile(dialect=connection.dialect)).strip()
+        columns = ', '.join(_quote(connection, column.name) for column in table.columns)
+        connection.execute(text(f'DROP TABLE IF EXISTS {staging}'))
+        connection.execute(text(create.replace(f'CREATE TABLE {name} (', f'CREATE TABLE {staging} (', 1)))
+        # The copy opens the transaction, so the swap below commits or fails as a whole
+        connection.execute(text(f'INSERT INTO {staging} ({columns}) SELECT {columns} FROM {name}'))
+        connection.execute(text(f'DROP TABLE {name}'))
+        connection.execute(text(f'ALTER TABLE {staging} RENAME TO {name}'))
+        archive = ARCHIVED_IDS.get(table.name)
+        if archive is not None:
+            # Archived rows are off the table but their ids are still taken
+            last = connection.execute(db.select(db.func.max(archive.source_id))).scalar() or 0
+            updated = connection.execute(text('UPDATE sqlite_sequence SET seq = MAX(seq, :last) WHERE name = :name'),
+                                         {'last': last, 'name': table.name})
+            if updated.rowcount == 0:
+                connection.execute(text('INSERT INTO sqlite_sequence (name, seq) VALUES (:name, :last)'),
+                                   {'last': last, 'name': table.name})
+
+
+def _stats_outdated(connection, existing):
+    # Aggregates were stored as FLOAT, without the per due day buckets
+    if WorkspaceStat.__tablename__ not in existing:
+        return False
+    columns = inspect(connection).get_columns(WorkspaceStat.__tablename__)
+    return not any(column['name'] == 'value' and isinstance(column['type'], Integer) for column in columns)
+
+
+def _dedupe_memberships(connection):
+    # The (user, workspace) unique constraint can only be added once each pair has one row; the latest wins
+    connection.execute(text(
+        'DELETE FROM userworkspacerole WHERE id NOT IN '
+        '(SELECT id FROM (SELECT MAX(id) AS id FROM userworkspacerole GROUP BY user_id, workspace_id) AS latest)'
+    ))
+
+
+def add_missing_indexes(connection, existing):
+    added = []
+    for table in db.metadata.sorted_tables:
+        if table.name not in existing:
+            continue
+        inspector = inspect(connection)
+        present = {index['name'] for index in inspector.get_indexes(table.name)}
+        present |= {constraint['name'] for constraint in inspector.get_unique_constraints(table.name)}
+        for index in table.indexes:
+            if index.name not in present:
+                index.create(connection)
+                added.append(index.name)
+        for constraint in table.constraints:
+            if isinstance(constraint, db.UniqueConstraint) and constraint.name and constraint.name not in present:
+                if table.name == UserWorkspaceRole.__tablename__:
+                    _dedupe_memberships(connection)
+                # A unique index enforces the same thing and, unlike a constraint, SQLite can add it in place
+                columns = ', '.join(_quote(connection, column.name) for column in constraint.columns)
+                connection.execute(text(f'CREATE UNIQUE INDEX {_quote(connection, constraint.name)} '
+                                        f'ON {_quote(connection, table.name)} ({columns})'))
+                added.append(constraint.name)
+    return added
+
+
+def backfill_positions(session):
+    """Key cards and subtasks created before positions existed, in id order within their list."""
+    import positions
+
+    columns = session.execute(
+        db.select(Task.workspace_id, Task.status).where(Task.position.is_(None), Task.status.isnot(None)).distinct()
+    ).all()
+    for workspace_id, status in columns:
+        session.bulk_update_mappings(Task, positions.rebalanced_rows(
+            session, Task, positions.list_scope(Task, workspace_id, status)))
+    task_ids = session.execute(
+        db.select(SubTask.task_id).where(SubTask.position.is_(None)).distinct()
+    ).scalars().all()
+    for task_id in task_ids:
+        session.bulk_update_mappings(SubTask, positions.rebalanced_rows(
+            session, SubTask, positions.list_scope(SubTask, None, task_id=task_id)))
+    return len(columns) + len(task_ids)
+
+
+def backfill_derived(session, created):
+    """Fill the search index and statistics for rows written before those tables existed."""
+    import search
+    import stats
+
+    if search.index.table in created:
+        search.index_workspace(session)
+    if 'workspace_stat' in created:
+        for workspace_id in session.execute(db.select(Workspace.id)).scalars():
+            stats.rebuild(session, workspace_id)
+
+
+def existing_tables():
+    return set(inspect(db.engine).get_table_names())
+
+
+def upgrade(existing):
+    """Upgrade the tables in ``existing`` (the names present before this boot created the missing ones).
+
+    Returns a list of what changed, empty when the schema was already current.
+    """
+    import search
+
+    changes = []
+    with db.engine.begin() as connection:
+        changes += add_missing_columns(connection, existing)
+        for archive in ARCHIVED_IDS.values():
+            if f'{archive.__tablename__}.source_id' in changes:
+                # Archive rows used to keep the board id as their own id
+                connection.execute(db.update(archive).where(archive.source_id.is_(None)).values(source_id=archive.id))
+        rebuilt = [table for table in db.metadata.sorted_tables
+                   if table.name in existing and _needs_autoincrement(connection, table)]
+        if _stats_outdated(connection, existing):
+            # Derived data: recreated empty and refilled below like a new table
+            WorkspaceStat.__table__.drop(connection)
+            WorkspaceStat.__table__.create(connection)
+            existing = existing - {WorkspaceStat.__tablename__}
+    for table in rebuilt:
+        rebuild_autoincrement(table)
+        changes.append(f'{table.name} AUTOINCREMENT')
+    if existing & {Task.__tablename__, SubTask.__tablename__}:
+        if backfill_positions(db.session):
+            changes.append('positions')
+    created = {table.name for table in db.metadata.sorted_tables} | {search.index.table}
+    created -= existing
+    if existing and created:
+        backfill_derived(db.session, created)
+        changes += sorted(created)
+    db.session.commit()
+    with db.engine.begin() as connection:
+        changes += add_missing_indexes(connection, existing)
+    return changes
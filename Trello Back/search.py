@@ -0,0 +1,222 @@
+import re
+from collections import Counter
+from sqlalchemy import event, inspect, text
+from app import app, db
+from models import Task, SubTask, SearchToken
+from serializers import IN_CHUNK_SIZE
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+TITLE_WEIGHT = 2
+
+
+def tokenize(value):
+    return TOKEN_RE.findall((value or '').lower())
+
+
+def _rowid(entity_type, entity_id):
+    # Tasks and subtasks share one FTS table; interleave their ids as rowids
+    return entity_id * 2 + (1 if entity_type == 'subtask' else 0)
+
+
+def _documents(session, task_ids=(), subtask_ids=()):
+    """Load (entity_type, id, workspace_id, task_id, title, body) for the given rows."""
+    documents = []
+    task_ids, subtask_ids = list(task_ids), list(subtask_ids)
+    for start in range(0, len(task_ids), IN_CHUNK_SIZE):
+        rows = session.execute(
+            db.select(Task.id, Task.workspace_id, Task.title, Task.description)
+            .where(Task.id.in_(task_ids[start:start + IN_CHUNK_SIZE]))
+        )
+        documents += [('task', row.id, row.workspace_id, row.id, row.title, row.description or '') for row in rows]
+    for start in range(0, len(subtask_ids), IN_CHUNK_SIZE):
+        rows = session.execute(
+            db.select(SubTask.id, SubTask.task_id, Task.workspace_id, SubTask.title)
+            .join(Task, Task.id == SubTask.task_id).where(SubTask.id.in_(subtask_ids[start:start + IN_CHUNK_SIZE]))
+        )
+        documents += [('subtask', row.id, row.workspace_id, row.task_id, row.title, '') for row in rows]
+    return documents
+
+
+class FTS5Index:
+    """SQLite FTS5 virtual table; the ``ws`` column scopes matches to a workspace."""
+
+    name = 'fts5'
+    table = 'search_fts'
+
+    def create(self, connection):
+        connection.execute(text(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS search_fts USING fts5("
+            "ws, title, body, task_id UNINDEXED, tokenize = 'unicode61 remove_diacritics 2')"
+        ))
+
+    def remove(self, session, keys):
+        session.execute(text('DELETE FROM search_fts WHERE rowid = :rowid'),
+                        [{'rowid': _rowid(entity_type, entity_id)} for entity_type, entity_id in keys])
+
+    def add(self, session, documents):
+        if documents:
+            session.execute(text(
+                'INSERT INTO search_fts (rowid, ws, title, body, task_id) VALUES (:rowid, :ws, :title, :body, :task_id)'
+            ), [{'rowid': _rowid(entity_type, entity_id), 'ws': f'w{workspace_id}', 'title': title,
+                 'body': body, 'task_id': task_id}
+                for entity_type, entity_id, workspace_id, task_id, title, body in documents])
+
+    def clear(self, session, workspace_id=None):
+        if workspace_id is None:
+            session.execute(text('DELETE FROM search_fts'))
+        else:
+            session.execute(text('DELETE FROM search_fts WHERE search_fts MATCH :ws'),
+                            {'ws': f'ws:"w{workspace_id}"'})
+
+    def search(self, workspace_id, tokens, limit, offset):
+        terms = ' AND '.join('{title body}:"%s"' % token.replace('"', '""') for token in tokens)
+        rows = db.session.execute(text(
+            'SELECT rowid, task_id, bm25(search_fts, 0, :title_weight, 1, 0) AS rank FROM search_fts '
+            'WHERE search_fts MATCH :query ORDER BY rank LIMIT :limit OFFSET :offset'
+        ), {'query': f'ws:"w{workspace_id}" AND {terms}', 'title_weight': TITLE_WEIGHT,
+            'limit': limit, 'offset': offset})
+        # bm25 is lower-is-better; flip it so higher scores rank first
+        return [('subtask' if row.rowid % 2 else 'task', row.rowid // 2, row.task_id, -row.rank) for row in rows]
+
+
+class TokenIndex:
+    """Portable inverted index stored as (workspace, token) -> entity postings."""
+
+    name = 'table'
+    table = 'search_token'
+
+    def create(self, connection):
+        pass
+
+    def remove(self, session, keys):
+        for entity_type in ('task', 'subtask'):
+            ids = [entity_id for key_type, entity_id in keys if key_type == entity_type]
+            for start in range(0, len(ids), IN_CHUNK_SIZE):
+                session.execute(db.delete(SearchToken).where(
+                    SearchToken.entity_type == entity_type, SearchToken.entity_id.in_(ids[start:start + IN_CHUNK_SIZE])))
+
+    def add(self, session, documents):
+        postings = []
+        for entity_type, entity_id, workspace_id, task_id, title, body in documents:
+            weights = Counter()
+            for token in tokenize(title):
+                weights[token] += TITLE_WEIGHT
+            for token in tokenize(body):
+                weights[token] += 1
+            postings += [{'workspace_id': workspace_id, 'token': token[:64], 'entity_type': entity_type,
+                          'entity_id': entity_id, 'task_id': task_id, 'weight': weight}
+                         for token, weight in weights.items()]
+        if postings:
+            session.execute(db.insert(SearchToken), postings)
+
+    def clear(self, session, workspace_id=None):
+        statement = db.delete(SearchToken)
+        if workspace_id is not None:
+            statement = statement.where(SearchToken.workspace_id == workspace_id)
+        session.execute(statement)
+
+    def search(self, workspace_id, tokens, limit, offset):
+        score = db.func.sum(SearchToken.weight).label('score')
+        rows = db.session.execute(
+            db.select(SearchToken.entity_type, SearchToken.entity_id, SearchToken.task_id, score)
+            .where(SearchToken.workspace_id == workspace_id, SearchToken.token.in_(tokens))
+            .group_by(SearchToken.entity_type, SearchToken.entity_id, SearchToken.task_id)
+            .having(db.func.count(SearchToken.token) == len(tokens))
+            .order_by(score.desc(), SearchToken.entity_id)
+            .limit(limit).offset(offset)
+        )
+        return [(row.entity_type, row.entity_id, row.task_id, row.score) for row in rows]
+
+
+def _select_backend():
+    backend = app.config['SEARCH_BACKEND']
+    if backend == 'auto':
+        backend = 'fts5' if app.config['SQLALCHEMY_DATABASE_URI'].startswith('sqlite') else 'table'
+    return FTS5Index() if backend == 'fts5' else TokenIndex()
+
+
+index = _select_backend()
+
+
+def create_index():
+    with db.engine.begin() as connection:
+        index.create(connection)
+
+
+def reindex(session, task_ids=(), subtask_ids=()):
+    """Replace the index entries for the given tasks/subtasks with their current rows."""
+    keys = [('task', task_id) for task_id in task_ids] + [('subtask', subtask_id) for subtask_id in subtask_ids]
+    if keys:
+        index.remove(session, keys)
+        index.add(session, _documents(session, task_ids, subtask_ids))
+
+
+def unindex(session, task_ids=(), subtask_ids=()):
+    keys = [('task', task_id) for task_id in task_ids] + [('subtask', subtask_id) for subtask_id in subtask_ids]
+    if keys:
+        index.remove(session, keys)
+
+
+def index_workspace(session, workspace_id=None, chunk_size=1000):
+    """Add every task and subtask of a workspace (or of all workspaces) to the index."""
+    tasks = db.select(Task.id).order_by(Task.id)
+    subtasks = db.select(SubTask.id).join(Task, Task.id == SubTask.task_id).order_by(SubTask.id)
+    if workspace_id is not None:
+        tasks = tasks.where(Task.workspace_id == workspace_id)
+        subtasks = subtasks.where(Task.workspace_id == workspace_id)
+    for ids in session.execute(tasks).scalars().partitions(chunk_size):
+        index.add(session, _documents(session, task_ids=ids))
+    for ids in session.execute(subtasks).scalars().partitions(chunk_size):
+        index.add(session, _documents(session, subtask_ids=ids))
+
+
+def rebuild(workspace_id=None):
+    """Rebuild the index from the task tables, one workspace or everything."""
+    index.clear(db.session, workspace_id)
+    index_workspace(db.session, workspace_id)
+    db.session.commit()
+
+
+def search(workspace_id, query, limit, offset):
+    tokens = list(dict.fromkeys(tokenize(query)))
+    if not tokens:
+        return []
+    return index.search(workspace_id, tokens, limit, offset)
+
+
+# Columns whose values end up in a row's search document
+INDEXED_FIELDS = {Task: ('title', 'description', 'workspace_id'), SubTask: ('title', 'task_id')}
+
+
+# Helper function to tell whether a flushed update touched the row's search document
+def _document_changed(obj):
+    attrs = inspect(obj).attrs
+    return any(attrs[field].history.has_changes() for field in INDEXED_FIELDS[type(obj)])
+
+
+# Keep the index in step with every ORM write, inside the same transaction
+@event.listens_for(db.session, 'after_flush')
+def sync_search_index(session, flush_context):
+    changed_tasks, changed_subtasks, deleted_tasks, deleted_subtasks = set(), set(), set(), set()
+    # Status, position and the like change far more often than the text; those edits leave the index alone
+    changed = list(session.new) + [obj for obj in session.dirty
+                                   if type(obj) in INDEXED_FIELDS and _document_changed(obj)]
+    for obj in changed:
+        if isinstance(obj, Task):
+            changed_tasks.add(obj.id)
+        elif isinstance(obj, SubTask):
+            changed_subtasks.add(obj.id)
+    for obj in session.deleted:
+        if isinstance(obj, Task):
+            deleted_tasks.add(obj.id)
+        elif isinstance(obj, SubTask):
+            deleted_subtasks.add(obj.id)
+    unindex(session, deleted_tasks, deleted_subtasks)
+    reindex(session, changed_tasks, changed_subtasks)
+
+
+@app.cli.command('rebuild-search-index')
+def rebuild_search_index_command():
+    """Rebuild the full-text search index from the task tables."""
+    rebuild()
+    print(f'Search index rebuilt ({index.name})')
@@ -0,0 +1,114 @@
+import json
+from datetime import date, datetime
+from flask.json import JSONEncoder as FlaskJSONEncoder
+from app import app
+from models import Workspace, Task, SubTask, User, UserWorkspaceRole, format_datetime
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson is optional
+    orjson = None
+
+TASK_FIELDS = ('id', 'title', 'description', 'status', 'estimated_time', 'actual_time', 'due_date',
+               'priority', 'workspace_id', 'assignee_id', 'position', 'version', 'created_at', 'updated_at')
+# Task fields a client can see change on an update
+TASK_UPDATE_FIELDS = ('title', 'description', 'status', 'estimated_time', 'actual_time', 'due_date',
+                      'priority', 'assignee_id')
+SUBTASK_FIELDS = ('id', 'task_id', 'title', 'is_completed', 'assignee_id', 'position', 'version',
+                  'created_at', 'updated_at')
+SUBTASK_UPDATE_FIELDS = ('title', 'is_completed', 'assignee_id')
+WORKSPACE_FIELDS = ('id', 'name', 'description', 'created_at', 'updated_at')
+USER_FIELDS = ('id', 'username', 'email', 'created_at', 'updated_at')
+ROLE_FIELDS = ('id', 'user_id', 'workspace_id', 'role', 'created_at', 'updated_at')
+
+# Keeps IN lists well under the bound-parameter limits of every backend
+IN_CHUNK_SIZE = 500
+
+
+class JSONEncoder(FlaskJSONEncoder):
+    """Encode datetimes the same way as the models' to_dict methods."""
+
+    def default(self, o):
+        if isinstance(o, datetime):
+            return format_datetime(o)
+        if isinstance(o, date):
+            return o.isoformat()
+        return super().default(o)
+
+
+def dumps(payload):
+    if orjson is not None:
+        # Naive datetimes are UTC throughout the app; OPT_UTC_Z renders them
+        # exactly like format_datetime
+        return orjson.dumps(payload, option=orjson.OPT_NAIVE_UTC | orjson.OPT_UTC_Z)
+    return json.dumps(payload, cls=JSONEncoder, separators=(',', ':')).encode()
+
+
+def loads(data):
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def json_response(payload, status=200):
+    return app.response_class(dumps(payload), status=status, mimetype='application/json')
+
+
+def project(query, model, fields):
+    """Run ``query`` selecting only ``fields`` and return plain dicts.
+
+    Skips ORM identity-map bookkeeping and attribute instrumentation, which
+    dominate the cost of hydrating full instances for large listings.
+    """
+    columns = [getattr(model, field) for field in fields]
+    return [dict(zip(fields, row)) for row in query.with_entities(*columns)]
+
+
+def attach_subtasks(tasks):
+    by_id = {}
+    for task in tasks:
+        task['subtasks'] = []
+        by_id[task['id']] = task
+
+    task_ids = list(by_id)
+    for start in range(0, len(task_ids), IN_CHUNK_SIZE):
+        chunk = task_ids[start:start + IN_CHUNK_SIZE]
+        subtask_query = SubTask.query.filter(SubTask.task_id.in_(chunk)).order_by(SubTask.position, SubTask.id)
+        for subtask in project(subtask_query, SubTask, SUBTASK_FIELDS):
+            by_id[subtask['task_id']]['subtasks'].append(subtask)
+    return tasks
+
+
+def task_dicts(query, include_subtasks=True):
+    tasks = project(query, Task, TASK_FIELDS)
+    if include_subtasks:
+        attach_subtasks(tasks)
+    return tasks
+
+
+def subtask_dicts(query):
+    return project(query, SubTask, SUBTASK_FIELDS)
+
+
+def workspace_dicts(query):
+    return project(query, Workspace, WORKSPACE_FIELDS)
+
+
+def user_dicts(query):
+    return project(query, User, USER_FIELDS)
+
+
+def role_dicts(query):
+    return project(query, UserWorkspaceRole, ROLE_FIELDS)
+
+
+app.json_encoder = JSONEncoder
+
+
+def task_update_payload(task_id, version, updated_at, changes):
+    """Socket payload for an edited task: only the changed fields plus its sync version."""
+    return {
+        'message': 'Task updated successfully',
+        'version': version,
+        'task': dict(changes, id=task_id, version=version, updated_at=format_datetime(updated_at))
+    }
@@ -0,0 +1,98 @@
+"""Production entry point: gunicorn with eventlet/gevent workers and a preloaded app.
+
+    python serve.py [--workers N] [--bind HOST:PORT] [--dev]
+
+The schema is created, or upgraded (see schema.py), once in the master process
+before the workers fork, so worker boots only import the already loaded
+application.
+"""
+import argparse
+import sys
+from gunicorn.app.base import BaseApplication
+
+# Flask-SocketIO async mode -> gunicorn worker class
+WORKER_CLASSES = {
+    'eventlet': 'eventlet',
+    'gevent': 'gevent',
+    'gevent_uwsgi': 'gevent',
+    'threading': 'gthread',
+}
+
+
+class Server(BaseApplication):
+    def __init__(self, application, options):
+        self.application = application
+        self.options = options
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+
+    def load(self):
+        return self.application
+
+
+def server_options(app, db, socketio, workers, bind):
+    if workers > 1 and not app.config['SOCKETIO_MESSAGE_QUEUE']:
+        # Each worker has its own rooms; only a shared queue reaches clients on the others
+        raise SystemExit('SOCKETIO_MESSAGE_QUEUE is required when running more than one worker')
+    return {
+        'bind': bind,
+        'workers': workers,
+        'worker_class': WORKER_CLASSES.get(socketio.async_mode, 'gthread'),
+        'worker_connections': app.config['SERVER_WORKER_CONNECTIONS'],
+        'timeout': app.config['SERVER_TIMEOUT'],
+        'preload_app': True,
+        'post_worker_init': lambda worker: _init_worker(app, db),
+    }
+
+
+def _init_worker(app, db):
+    import jobs
+    import locks
+    import sockets
+    # Workers monkey patch the standard library after forking; replace the locks
+    # and pool preloaded in the master so they are green ones
+    locks.reset_all()
+    with app.app_context():
+        db.engine.dispose()
+    # Drain jobs left queued, or orphaned by a dead worker, without waiting for a new one
+    jobs.runner.start()
+    sockets.start_membership_relay()
+
+
+def main(argv=None):
+    from app import app, db, socketio, init_db
+    import directory
+
+    parser = argparse.ArgumentParser(description='Run the Trello API server.')
+    parser.add_argument('--workers', type=int, default=app.config['SERVER_WORKERS'])
+    parser.add_argument('--bind', help=f"address to listen on (default {app.config['SERVER_BIND']})")
+    parser.add_argument('--dev', action='store_true', help='run the single-process debug server instead')
+    args = parser.parse_args(argv)
+
+    options = None
+    if not args.dev:
+        options = server_options(app, db, socketio, args.workers, args.bind or app.config['SERVER_BIND'])
+
+    with app.app_context():
+        init_db()
+        # Warmed before forking so every worker starts with the index
+        directory.warm()
+        # Don't hand pooled connections opened by the master to the forked workers
+        db.engine.dispose()
+
+    if args.dev:
+        import jobs
+        import sockets
+        jobs.runner.start()
+        sockets.start_membership_relay()
+        host, _, port = (args.bind or '127.0.0.1:5000').rpartition(':')
+        socketio.run(app, host=host, port=int(port), debug=True)
+        return
+    Server(app, options).run()
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
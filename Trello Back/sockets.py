@@ -1,13 +1,125 @@
-from flask_socketio import emit, disconnect
+from flask_socketio import emit, disconnect, join_room, leave_room, rooms
 from flask_jwt_extended import decode_token
-from app import socketio, db
+from app import app, socketio, db
 from models import Task, Workspace, SubTask, User, UserWorkspaceRole
+from authz import get_task_workspace_id, role_listeners, forget_roles
+from pubsub import publish, publish_update, workspace_room, membership_channel
+import wire
+from serializers import task_update_payload
+from batch import task_values
+from patches import apply_patch, parse_version, move, VersionConflict, NeighbourConflict
 from datetime import datetime
 from flask import request
 import json
+import time
+import metrics
 
-@socketio.on('connect')
+
+class SocketSession:
+    """A connection's user, workspace roles and payload encoding, loaded once at connect.
+
+    Handlers authorize against it in memory. Role changes update it right
+    away, in other processes through the message queue; as a fallback it is
+    reloaded once it is older than the REST role cache TTL.
+    """
+    __slots__ = ('sid', 'user_id', 'roles', 'loaded_at', 'encoding')
+
+    def __init__(self, sid, user_id, encoding='json'):
+        self.sid = sid
+        self.user_id = int(user_id)
+        self.encoding = encoding
+        self.roles = {}
+        self.load()
+
+    def load(self):
+        previous = self.roles
+        self.roles = dict(db.session.query(UserWorkspaceRole.workspace_id, UserWorkspaceRole.role)
+                          .filter_by(user_id=self.user_id))
+        self.loaded_at = time.monotonic()
+        for workspace_id in previous.keys() - self.roles.keys():
+            self.leave(workspace_id)
+
+    def leave(self, workspace_id):
+        # Stop the connection receiving a workspace's events once it is no longer a member
+        socketio.server.leave_room(self.sid, workspace_room(workspace_id, self.encoding), namespace='/')
+
+    def role(self, workspace_id):
+        if time.monotonic() - self.loaded_at > app.config['AUTHZ_CACHE_TTL']:
+            self.load()
+        try:
+            return self.roles.get(int(workspace_id))
+        except (TypeError, ValueError):
+            return None
+
+
+# Socket id -> SocketSession of the authenticated connection
+connected_users = {}
+
+
+def current_role(workspace_id):
+    session = connected_users.get(request.sid)
+    return session.role(workspace_id) if session is not None else None
+
+
+def current_encoding():
+    session = connected_users.get(request.sid)
+    return session.encoding if session is not None else 'json'
+
+
+def reply(event, payload):
+    # Answer the sender in the encoding it negotiated
+    emit(event, wire.encode(payload, current_encoding()))
+
+
+def refresh_sessions(user_id, workspace_id):
+    """Apply a membership change to the open connections and drop them from rooms they lost."""
+    affected = [session for session in list(connected_users.values())
+                if (session.user_id == user_id if user_id is not None else workspace_id in session.roles)]
+    if not affected:
+        return
+    query = db.session.query(UserWorkspaceRole.user_id, UserWorkspaceRole.role).filter_by(workspace_id=workspace_id)
+    if user_id is not None:
+        query = query.filter_by(user_id=user_id)
+    roles = dict(query)
+    for session in affected:
+        role = roles.get(session.user_id)
+        if role is not None:
+            session.roles[workspace_id] = role
+        elif session.roles.pop(workspace_id, None) is not None:
+            session.leave(workspace_id)
+
+
+def _refresh_from_queue(user_id, workspace_id):
+    # Another node changed a membership; its caches and sessions were updated there
+    with app.app_context():
+        forget_roles(user_id, workspace_id)
+        refresh_sessions(user_id, workspace_id)
+
+
+# Carries membership changes between nodes when a message queue connects them
+membership = membership_channel(app.config['SOCKETIO_MESSAGE_QUEUE'])
+
+
+def start_membership_relay():
+    """Start applying other nodes' membership changes here (see serve.py); connecting starts it too."""
+    if membership is not None:
+        membership.start(socketio.server, _refresh_from_queue)
+
+
+# Helper function to register a handler with its metrics wrapped around it
+def on(message):
+    def register(handler):
+        return socketio.on(message)(metrics.instrumented(message)(handler))
+    return register
+
+
+role_listeners.append(refresh_sessions)
+if membership is not None:
+    role_listeners.append(membership.publish)
+
+@on('connect')
 def handle_connect():
+    start_membership_relay()
     token = request.args.get('token')
     if not token:
         disconnect()
@@ -15,26 +127,49 @@ def handle_connect():
     try:
         decoded_token = decode_token(token)
         user_id = decoded_token['sub']
+        encoding = wire.negotiate(request.args.get('encoding'), app.config['SOCKET_ENCODINGS'])
+        connected_users[request.sid] = SocketSession(request.sid, user_id, encoding)
         print(f'User {user_id} connected')
-        emit('response', {'data': 'Connected'})
+        reply('response', {'data': 'Connected', 'encoding': encoding})
     except Exception as e:
         print(f'JWT decode error: {e}')
         disconnect()
 
-@socketio.on('message')
+@on('message')
 def handle_message(msg):
     try:
         data = json.loads(msg)
         print(f'Message: {data}')
-        emit('response', {'message': data}, broadcast=True)
+        room = workspace_room(data.get('workspace_id'), current_encoding())
+        if room not in rooms():
+            reply('response', {'error': 'Join the workspace before sending messages'})
+            return
+        publish('response', {'message': data}, data.get('workspace_id'))
     except json.JSONDecodeError:
         print(f'Invalid message format: {msg}')
-        emit('response', {'error': 'Invalid message format'}, broadcast=True)
+        reply('response', {'error': 'Invalid message format'})
 
-    except ValueError:
+    except (ValueError, AttributeError):
         print(f'Invalid message format: {msg}')
-        emit('response', {'error': 'Invalid message format'}, broadcast=True)
-@socketio.on('create_task')
+        reply('response', {'error': 'Invalid message format'})
+
+@on('join_workspace')
+def handle_join_workspace(data):
+    workspace_id = data.get('workspace_id')
+    if current_role(workspace_id) is None:
+        reply('workspace_response', {'message': 'Workspace not found'})
+        return
+
+    join_room(workspace_room(workspace_id, current_encoding()))
+    reply('workspace_response', {'message': 'Joined workspace', 'workspace_id': workspace_id})
+
+@on('leave_workspace')
+def handle_leave_workspace(data):
+    workspace_id = data.get('workspace_id')
+    leave_room(workspace_room(workspace_id, current_encoding()))
+    reply('workspace_response', {'message': 'Left workspace', 'workspace_id': workspace_id})
+
+@on('create_task')
 def handle_create_task(data):
     title = data.get('title')
     description = data.get('description')
@@ -47,7 +182,10 @@ def handle_create_task(data):
     assignee_id = data.get('assignee_id')
 
     if not title or not workspace_id:
-        emit('task_response', {'message': 'Title and Workspace ID are required'}, broadcast=True)
+        reply('task_response', {'message': 'Title and Workspace ID are required'})
+        return
+    if current_role(workspace_id) is None:
+        reply('task_response', {'message': 'Workspace not found'})
         return
 
     new_task = Task(
@@ -66,43 +204,80 @@ def handle_create_task(data):
 
     db.session.add(new_task)
     db.session.commit()
-    emit('task_response', {'message': 'Task created successfully', 'task': new_task.to_dict()}, broadcast=True)
+    publish('task_response', {'message': 'Task created successfully', 'task': new_task.to_dict()}, workspace_id)
 
-@socketio.on('update_task')
+@on('update_task')
 def handle_update_task(data):
     task_id = data.get('id')
-    task = Task.query.get(task_id)
+    workspace_id = get_task_workspace_id(task_id)
 
-    if not task:
-        emit('task_response', {'message': 'Task not found'}, broadcast=True)
+    if workspace_id is None or current_role(workspace_id) is None:
+        reply('task_response', {'message': 'Task not found'})
         return
 
-    task.title = data.get('title', task.title)
-    task.description = data.get('description', task.description)
-    task.status = data.get('status', task.status)
-    task.estimated_time = data.get('estimated_time', task.estimated_time)
-    task.actual_time = data.get('actual_time', task.actual_time)
-    task.due_date = data.get('due_date', task.due_date)
-    task.priority = data.get('priority', task.priority)
-    task.assignee_id = data.get('assignee_id', task.assignee_id)
-    task.updated_at = datetime.utcnow()
+    # Only the fields sent are written; a version makes the write conditional
+    try:
+        values = task_values(data)
+        version = parse_version(data.get('version'))
+    except ValueError as e:
+        reply('task_response', {'message': 'Invalid task data', 'error': str(e), 'id': task_id})
+        return
+    if not values:
+        reply('task_response', {'message': 'No fields to update', 'id': task_id})
+        return
 
-    db.session.commit()
-    emit('task_response', {'message': 'Task updated successfully', 'task': task.to_dict()}, broadcast=True)
+    try:
+        result = apply_patch(Task, task_id, values, workspace_id, version)
+    except VersionConflict as e:
+        reply('task_response', {'message': 'Version conflict', 'id': task_id, 'version': e.current_version})
+        return
+    if result is None:
+        reply('task_response', {'message': 'Task not found'})
+        return
+    publish_update('task_response', task_update_payload(task_id, *result, values), workspace_id, task_id)
 
-@socketio.on('delete_task')
+@on('move_task')
+def handle_move_task(data):
+    task_id = data.get('id')
+    workspace_id = get_task_workspace_id(task_id)
+
+    if workspace_id is None or current_role(workspace_id) is None:
+        reply('task_response', {'message': 'Task not found'})
+        return
+
+    # The room receives 'task_moved' with just the new key; errors go back to the sender
+    try:
+        moved = move(Task, task_id, workspace_id, data)
+    except ValueError as e:
+        reply('task_response', {'message': str(e), 'id': task_id})
+        return
+    except VersionConflict as e:
+        reply('task_response', {'message': 'Version conflict', 'id': task_id, 'version': e.current_version})
+        return
+    except NeighbourConflict:
+        reply('task_response', {'message': 'Neighbours changed', 'id': task_id})
+        return
+    if moved is None:
+        reply('task_response', {'message': 'Task not found'})
+
+@on('delete_task')
 def handle_delete_task(data):
     task_id = data.get('id')
-    task = Task.query.get(task_id)
+    workspace_id = get_task_workspace_id(task_id)
 
-    if not task:
-        emit('task_response', {'message': 'Task not found'}, broadcast=True)
+    if workspace_id is None or current_role(workspace_id) is None:
+        reply('task_response', {'message': 'Task not found'})
         return
 
+    task = Task.query.get(task_id)
+    if not task:
+        reply('task_response', {'message': 'Task not found'})
+        return
     db.session.delete(task)
     db.session.commit()
-    emit('task_response', {'message': 'Task deleted successfully'}, broadcast=True)
+    publish('task_response', {'message': 'Task deleted successfully', 'id': task_id}, workspace_id)
 
-@socketio.on('disconnect')
+@on('disconnect')
 def handle_disconnect():
+    connected_users.pop(request.sid, None)
     print('Client disconnected')
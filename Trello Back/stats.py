@@ -0,0 +1,256 @@
+from collections import Counter
+from datetime import datetime
+from sqlalchemy import event
+from sqlalchemy.orm import attributes
+from app import app, db
+from models import Task, SubTask, WorkspaceStat
+from serializers import IN_CHUNK_SIZE
+from sync import _workspace_id_for
+
+TASK_STAT_FIELDS = ('status', 'priority', 'estimated_time', 'actual_time', 'due_date')
+
+
+def due_bucket(due_date):
+    return due_date.date().isoformat()
+
+
+def is_open(status):
+    # Matches status NOT IN (...), which is never true for NULL
+    return status is not None and status not in app.config['TASK_DONE_STATUSES']
+
+
+def task_contribution(status, priority, estimated_time, actual_time, due_date):
+    """Aggregate rows a single task adds to its workspace, as (metric, bucket) -> value."""
+    contribution = Counter({
+        ('tasks', ''): 1,
+        ('status', status or ''): 1,
+        ('priority', priority or ''): 1,
+        ('estimated_time', ''): estimated_time or 0,
+        ('actual_time', ''): actual_time or 0,
+    })
+    # Open tasks are also counted per due day, so the overdue count is a sum over past days
+    if due_date is not None and is_open(status):
+        contribution[('due', due_bucket(due_date))] = 1
+    return contribution
+
+
+def subtask_contribution(is_completed):
+    return Counter({('subtasks', ''): 1, ('subtasks_completed', ''): 1 if is_completed else 0})
+
+
+def _new_value(obj, field):
+    # The INSERT leaves out None for columns with a default, which then fills them in;
+    # count a new row the way it will be stored
+    value = getattr(obj, field)
+    default = obj.__table__.c[field].default
+    if value is None and default is not None and default.is_scalar:
+        return default.arg
+    return value
+
+
+def _old_value(obj, field):
+    history = attributes.get_history(obj, field)
+    if history.deleted:
+        return history.deleted[0]
+    return getattr(obj, field)
+
+
+def apply_deltas(session, deltas):
+    """Add ``{workspace_id: Counter((metric, bucket) -> delta)}`` to the aggregate table."""
+    rows = [{'workspace_id': workspace_id, 'metric': metric, 'bucket': bucket, 'value': value}
+            for workspace_id, counter in deltas.items()
+            for (metric, bucket), value in counter.items() if value]
+    if not rows:
+        return
+
+    dialect = db.engine.dialect.name
+    if dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+        statement = insert(WorkspaceStat)
+        statement = statement.on_conflict_do_update(
+            index_elements=['workspace_id', 'metric', 'bucket'],
+            set_={'value': WorkspaceStat.value + statement.excluded.value})
+    elif dialect == 'mysql':
+        from sqlalchemy.dialects.mysql import insert
+        statement = insert(WorkspaceStat)
+        statement = statement.on_duplicate_key_update(value=WorkspaceStat.value + statement.inserted.value)
+    else:
+        for row in rows:
+            updated = session.execute(
+                db.update(WorkspaceStat)
+                .where(WorkspaceStat.workspace_id == row['workspace_id'],
+                       WorkspaceStat.metric == row['metric'], WorkspaceStat.bucket == row['bucket'])
+                .values(value=WorkspaceStat.value + row['value'])
+            )
+            if updated.rowcount == 0:
+                session.execute(db.insert(WorkspaceStat), row)
+        return
+    for row in rows:
+        session.execute(statement, row)
+
+
+# Fold every ORM task/subtask write into the aggregates within the same transaction
+@event.listens_for(db.session, 'before_flush')
+def update_workspace_stats(session, flush_context, instances):
+    deltas = {}
+    with session.no_autoflush:
+        for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+            if not isinstance(obj, (Task, SubTask)):
+                continue
+            if obj in session.dirty and not session.is_modified(obj, include_collections=False):
+                continue
+            workspace_id = _workspace_id_for(session, obj)
+            if workspace_id is None:
+                continue
+            delta = deltas.setdefault(workspace_id, Counter())
+
+            current_value = _new_value if obj in session.new else getattr
+            if isinstance(obj, Task):
+                current = task_contribution(*(current_value(obj, field) for field in TASK_STAT_FIELDS))
+                previous = task_contribution(*(_old_value(obj, field) for field in TASK_STAT_FIELDS))
+            else:
+                current = subtask_contribution(current_value(obj, 'is_completed'))
+                previous = subtask_contribution(_old_value(obj, 'is_completed'))
+
+            if obj in session.new:
+                delta.update(current)
+            elif obj in session.deleted:
+                delta.subtract(previous)
+            else:
+                delta.update(current)
+                delta.subtract(previous)
+    apply_deltas(session, deltas)
+
+
+def snapshot(session, task_ids=(), subtask_ids=()):
+    """Sum the contributions of the given rows as they currently are in the database.
+
+    Bulk writes skip the flush hook; callers diff a snapshot taken before the
+    statements with one taken after them.
+    """
+    totals = {}
+    task_ids, subtask_ids = list(task_ids), list(subtask_ids)
+    for start in range(0, len(task_ids), IN_CHUNK_SIZE):
+        rows = session.execute(
+            db.select(Task.workspace_id, *[getattr(Task, field) for field in TASK_STAT_FIELDS])
+            .where(Task.id.in_(task_ids[start:start + IN_CHUNK_SIZE]))
+        )
+        for workspace_id, *values in rows:
+            totals.setdefault(workspace_id, Counter()).update(task_contribution(*values))
+    for start in range(0, len(subtask_ids), IN_CHUNK_SIZE):
+        rows = session.execute(
+            db.select(Task.workspace_id, SubTask.is_completed)
+            .join(Task, Task.id == SubTask.task_id).where(SubTask.id.in_(subtask_ids[start:start + IN_CHUNK_SIZE]))
+        )
+        for workspace_id, is_completed in rows:
+            totals.setdefault(workspace_id, Counter()).update(subtask_contribution(is_completed))
+    return totals
+
+
+def apply_snapshot_diff(session, before, after):
+    deltas = {}
+    for workspace_id in set(before) | set(after):
+        delta = Counter(after.get(workspace_id, Counter()))
+        delta.subtract(before.get(workspace_id, Counter()))
+        deltas[workspace_id] = delta
+    apply_deltas(session, deltas)
+
+
+def clear(session, workspace_id):
+    session.execute(db.delete(WorkspaceStat).where(WorkspaceStat.workspace_id == workspace_id))
+
+
+def rebuild(session, workspace_id):
+    """Recompute one workspace's aggregates from the task tables."""
+    clear(session, workspace_id)
+    totals = Counter()
+    task_rows = session.execute(
+        db.select(Task.status, Task.priority, db.func.count(), db.func.sum(Task.estimated_time),
+                  db.func.sum(Task.actual_time))
+        .where(Task.workspace_id == workspace_id).group_by(Task.status, Task.priority)
+    )
+    for status, priority, count, estimated_time, actual_time in task_rows:
+        totals[('tasks', '')] += count
+        totals[('status', status or '')] += count
+        totals[('priority', priority or '')] += count
+        totals[('estimated_time', '')] += estimated_time or 0
+        totals[('actual_time', '')] += actual_time or 0
+    due_rows = session.execute(
+        db.select(Task.due_date, db.func.count())
+        .where(Task.workspace_id == workspace_id, Task.due_date.isnot(None),
+               Task.status.notin_(app.config['TASK_DONE_STATUSES']))
+        .group_by(Task.due_date)
+    )
+    for due_date, count in due_rows:
+        totals[('due', due_bucket(due_date))] += count
+    subtask_rows = session.execute(
+        db.select(SubTask.is_completed, db.func.count())
+        .join(Task, Task.id == SubTask.task_id).where(Task.workspace_id == workspace_id)
+        .group_by(SubTask.is_completed)
+    )
+    for is_completed, count in subtask_rows:
+        totals[('subtasks', '')] += count
+        if is_completed:
+            totals[('subtasks_completed', '')] += count
+    apply_deltas(session, {workspace_id: totals})
+
+
+def overdue_query(workspace_id, since=None):
+    # Tasks overdue since ``since``; the read only needs the ones due earlier today
+    query = db.session.query(db.func.count(Task.id)).filter(
+        Task.workspace_id == workspace_id,
+        Task.due_date < datetime.utcnow(),
+        Task.status.notin_(app.config['TASK_DONE_STATUSES'])
+    )
+    return query.filter(Task.due_date >= since) if since is not None else query
+
+
+def workspace_stats(workspace_id):
+    today = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+    values = Counter()
+    by_status, by_priority = {}, {}
+    overdue = 0
+    for metric, bucket, value in db.session.execute(
+        db.select(WorkspaceStat.metric, WorkspaceStat.bucket, WorkspaceStat.value)
+        .where(WorkspaceStat.workspace_id == workspace_id)
+    ):
+        if metric == 'status' and value:
+            by_status[bucket] = value
+        elif metric == 'priority' and value:
+            by_priority[bucket] = value
+        elif metric == 'due':
+            # ISO dates compare in date order
+            if bucket < due_bucket(today):
+                overdue += value
+        else:
+            values[metric] = value
+
+    # Only today's bucket depends on the time of day
+    overdue += overdue_query(workspace_id, since=today).scalar()
+
+    subtasks = values['subtasks']
+    completed = values['subtasks_completed']
+    return {
+        'tasks': values['tasks'],
+        'by_status': by_status,
+        'by_priority': by_priority,
+        'estimated_time': values['estimated_time'],
+        'actual_time': values['actual_time'],
+        'overdue': overdue,
+        'subtasks': {
+            'total': subtasks,
+            'completed': completed,
+            'completion_ratio': completed / subtasks if subtasks else None
+        }
+    }
+
+
+@app.cli.command('rebuild-workspace-stats')
+def rebuild_workspace_stats_command():
+    """Recompute every workspace's aggregate statistics to repair drift."""
+    from models import Workspace
+    workspace_ids = db.session.execute(db.select(Workspace.id)).scalars().all()
+    for workspace_id in workspace_ids:
+        rebuild(db.session, workspace_id)
+    db.session.commit()
+    print(f'Rebuilt statistics for {len(workspace_ids)} workspaces')
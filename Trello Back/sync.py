@@ -0,0 +1,99 @@
+import zlib
+from datetime import datetime
+from flask import request
+from sqlalchemy import event, inspect
+from app import db
+from models import Workspace, Task, SubTask, Tombstone
+from serializers import task_dicts, subtask_dicts
+
+
+def bump_workspace_version(session, workspace_id):
+    """Increment and return a workspace's change counter inside the current transaction."""
+    session.execute(
+        db.update(Workspace)
+        .where(Workspace.id == workspace_id)
+        .values(version=Workspace.version + 1, updated_at=Workspace.updated_at)
+    )
+    return session.execute(db.select(Workspace.version).where(Workspace.id == workspace_id)).scalar()
+
+
+def _workspace_id_for(session, obj):
+    if isinstance(obj, Task):
+        return obj.workspace_id
+    if obj.task_id is None:
+        return None
+    return session.execute(db.select(Task.workspace_id).where(Task.id == obj.task_id)).scalar()
+
+
+# Stamp every task/subtask write with the workspace's next version and leave
+# tombstones behind for deletes, so delta sync covers every write path
+@event.listens_for(db.session, 'before_flush')
+def stamp_sync_versions(session, flush_context, instances):
+    changed = [obj for obj in session.new if isinstance(obj, (Task, SubTask))]
+    changed += [obj for obj in session.dirty
+                if isinstance(obj, (Task, SubTask)) and session.is_modified(obj, include_collections=False)]
+    deleted = [obj for obj in session.deleted if isinstance(obj, (Task, SubTask))]
+    if not changed and not deleted:
+        return
+
+    versions = {}
+    with session.no_autoflush:
+        for obj in changed + deleted:
+            workspace_id = _workspace_id_for(session, obj)
+            if workspace_id is None:
+                continue
+            if workspace_id not in versions:
+                versions[workspace_id] = bump_workspace_version(session, workspace_id)
+            obj.sync_version = versions[workspace_id]
+            if obj in deleted:
+                session.add(Tombstone(
+                    workspace_id=workspace_id,
+                    entity_type='task' if isinstance(obj, Task) else 'subtask',
+                    entity_id=obj.id,
+                    version=versions[workspace_id]
+                ))
+
+
+def changed_fields(obj, fields):
+    """Return ``{field: value}`` for the attributes modified since ``obj`` was loaded.
+
+    Must be called before the commit, which expires the change history.
+    """
+    attrs = inspect(obj).attrs
+    return {field: getattr(obj, field) for field in fields if attrs[field].history.has_changes()}
+
+
+def board_etag(workspace_id, version):
+    # The variant keeps different filters/pages of the same board apart
+    variant = zlib.crc32(request.query_string)
+    return f'{workspace_id}-{version}-{variant:08x}'
+
+
+def parse_since(value):
+    return datetime.fromisoformat(value[:-1] if value.endswith('Z') else value)
+
+
+def change_queries(workspace_id, since=None, since_version=None):
+    tasks = Task.query.filter(Task.workspace_id == workspace_id)
+    subtasks = SubTask.query.join(Task).filter(Task.workspace_id == workspace_id)
+    tombstones = Tombstone.query.filter(Tombstone.workspace_id == workspace_id)
+
+    if since_version is not None:
+        tasks = tasks.filter(Task.sync_version > since_version)
+        subtasks = subtasks.filter(SubTask.sync_version > since_version)
+        tombstones = tombstones.filter(Tombstone.version > since_version)
+    else:
+        tasks = tasks.filter(Task.updated_at > since)
+        subtasks = subtasks.filter(SubTask.updated_at > since)
+        tombstones = tombstones.filter(Tombstone.deleted_at > since)
+    return tasks, subtasks, tombstones
+
+
+def changes_since(workspace_id, since=None, since_version=None):
+    """Return tasks, subtasks and tombstones changed after a timestamp or version."""
+    tasks, subtasks, tombstones = change_queries(workspace_id, since, since_version)
+    return {
+        'tasks': task_dicts(tasks.order_by(Task.sync_version), include_subtasks=False),
+        'subtasks': subtask_dicts(subtasks.order_by(SubTask.sync_version)),
+        'deleted': [tombstone.to_dict() for tombstone in tombstones.order_by(Tombstone.version).all()]
+    }
@@ -0,0 +1,117 @@
+"""Check that the listing endpoints' queries use indexes.
+
+Runs each endpoint through the test client against a scratch SQLite
+database, captures every SELECT it sends with a ``before_cursor_execute``
+listener and fails if ``EXPLAIN QUERY PLAN`` for any of them walks a whole
+table:
+
+    python -m pytest test_query_plans.py
+"""
+import os
+import tempfile
+
+import pytest
+
+# The app reads its configuration on import; listings must reach the database rather than the response cache
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='trello-plans-'), 'plans.db')}"
+os.environ['RESPONSE_CACHE'] = 'none'
+
+from sqlalchemy import event  # noqa: E402
+from app import app, db, init_db  # noqa: E402
+
+# Query strings accepted by GET /workspaces/<id>/tasks
+TASK_LISTINGS = (
+    '',
+    '?status=Planned',
+    '?priority=high',
+    '?assignee_id=1',
+    '?due_after=2024-01-01T00:00:00Z&due_before=2024-02-01T00:00:00Z',
+    '?overdue=true',
+    '?sort=due_date',
+    '?sort=-updated_at',
+    '?limit=2',
+    '?limit=2&cursor={cursor}',
+    '?since_version=1',
+    '?since=2024-01-01T00:00:00Z',
+)
+ENDPOINTS = tuple(f'tasks{query}' for query in TASK_LISTINGS) + (
+    'subtasks', 'archive', 'stats', 'workspace users', 'workspaces', 'move after', 'move before', 'move to end')
+
+
+@pytest.fixture(scope='module')
+def board():
+    """A workspace with a few tasks, a subtask and an archived task, plus auth headers."""
+    with app.app_context():
+        init_db()
+    client = app.test_client()
+    client.post('/auth/signup', json={'username': 'plans', 'email': 'plans@example.com', 'password': 'plans'})
+    token = client.post('/auth/login', json={'username': 'plans', 'password': 'plans'}).get_json()['token']
+    headers = {'Authorization': f"Bearer {token['access_token']}"}
+    workspace_id = client.post('/workspaces', json={'name': 'Plans'}, headers=headers).get_json()['id']
+    task_ids = [client.post(f'/workspaces/{workspace_id}/tasks', json={
+        'title': f'Task {i}', 'due_date': '2020-01-01T00:00:00.000Z'}, headers=headers).get_json()['id']
+        for i in range(4)]
+    client.post(f'/tasks/{task_ids[0]}/subtasks', json={'title': 'Step'}, headers=headers)
+    client.put(f'/workspaces/{workspace_id}/tasks/{task_ids[3]}', json={'title': 'Task 3', 'status': 'Done'},
+               headers=headers)
+    client.post(f'/workspaces/{workspace_id}/archive', json={'task_ids': [task_ids[3]]}, headers=headers)
+    cursor = client.get(f'/workspaces/{workspace_id}/tasks?limit=1', headers=headers).get_json()['next_cursor']
+    return {'client': client, 'headers': headers, 'workspace_id': workspace_id, 'task_ids': task_ids,
+            'cursor': cursor}
+
+
+def endpoint_requests(board):
+    """Label -> (method, url, JSON body) for every listing endpoint checked."""
+    workspace_id, task_ids = board['workspace_id'], board['task_ids']
+    requests = {f'tasks{query}': ('GET', f'/workspaces/{workspace_id}/tasks' + query.format(cursor=board['cursor']),
+                                  None) for query in TASK_LISTINGS}
+    requests.update({
+        'subtasks': ('GET', f'/tasks/{task_ids[0]}/subtasks', None),
+        'archive': ('GET', f'/workspaces/{workspace_id}/archive', None),
+        'stats': ('GET', f'/workspaces/{workspace_id}/stats', None),
+        'workspace users': ('GET', f'/workspaces/{workspace_id}/users', None),
+        'workspaces': ('GET', '/workspaces', None),
+        # Each side of a move looks its missing neighbour up differently
+        'move after': ('POST', f'/workspaces/{workspace_id}/tasks/{task_ids[1]}/move', {'after_id': task_ids[2]}),
+        'move before': ('POST', f'/workspaces/{workspace_id}/tasks/{task_ids[2]}/move', {'before_id': task_ids[0]}),
+        'move to end': ('POST', f'/workspaces/{workspace_id}/tasks/{task_ids[0]}/move', {}),
+    })
+    return requests
+
+
+def captured_selects(board, method, url, body):
+    statements = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith('SELECT'):
+            statements.append((statement, parameters))
+
+    with app.app_context():
+        event.listen(db.engine, 'before_cursor_execute', capture)
+    try:
+        response = board['client'].open(url, method=method, json=body, headers=board['headers'])
+    finally:
+        with app.app_context():
+            event.remove(db.engine, 'before_cursor_execute', capture)
+    assert response.status_code < 400, response.get_data(as_text=True)
+    return statements
+
+
+def is_full_scan(plan_row):
+    # "SCAN task [USING INDEX ...]" walks every row; "SEARCH ... USING INDEX" seeks.
+    # Constant rows and subqueries over them are not tables
+    detail = plan_row[-1]
+    return detail.startswith('SCAN ') and not detail.startswith(('SCAN CONSTANT ROW', 'SCAN (subquery'))
+
+
+@pytest.mark.parametrize('label', ENDPOINTS)
+def test_listing_queries_use_indexes(board, label):
+    method, url, body = endpoint_requests(board)[label]
+    statements = captured_selects(board, method, url, body)
+    assert statements
+    scans = []
+    with app.app_context(), db.engine.connect() as connection:
+        for statement, parameters in statements:
+            plan = connection.exec_driver_sql('EXPLAIN QUERY PLAN ' + statement, parameters).all()
+            scans += [f'{row[-1]} in: {statement}' for row in plan if is_full_scan(row)]
+    assert not scans, '\n'.join(scans)
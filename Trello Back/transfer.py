@@ -0,0 +1,286 @@
+from flask import request, jsonify, stream_with_context
+from flask_jwt_extended import jwt_required, get_jwt_identity
+from app import app, db
+from models import Workspace, Task, SubTask, User, UserWorkspaceRole
+from authz import workspace_role_required, invalidate_role, validate_role
+from serializers import dumps, loads, TASK_FIELDS, SUBTASK_FIELDS, WORKSPACE_FIELDS
+from sync import bump_workspace_version, parse_since
+import positions
+import search
+import stats
+
+MEMBER_FIELDS = ('user_id', 'username', 'email', 'role')
+IMPORTED_TASK_FIELDS = ('title', 'description', 'status', 'estimated_time', 'actual_time',
+                        'due_date', 'priority', 'assignee_id', 'position', 'created_at', 'updated_at')
+IMPORTED_SUBTASK_FIELDS = ('title', 'is_completed', 'assignee_id', 'position', 'created_at', 'updated_at')
+DATETIME_FIELDS = ('due_date', 'created_at', 'updated_at')
+
+
+def _stream_rows(statement, fields, record_type, chunk_size):
+    """Yield NDJSON chunks for ``statement`` using a server-side cursor."""
+    result = db.session.execute(statement.execution_options(stream_results=True, max_row_buffer=chunk_size))
+    for rows in result.partitions(chunk_size):
+        yield b''.join(dumps({'type': record_type, 'data': dict(zip(fields, row))}) + b'\n' for row in rows)
+
+
+def export_records(workspace_id, workspace, chunk_size):
+    """Yield a workspace as NDJSON: the workspace, its members, tasks and subtasks."""
+    yield dumps({'type': 'workspace', 'data': dict(zip(WORKSPACE_FIELDS, workspace))}) + b'\n'
+    yield from _stream_rows(
+        db.select(UserWorkspaceRole.user_id, User.username, User.email, UserWorkspaceRole.role)
+        .join(User, User.id == UserWorkspaceRole.user_id)
+        .where(UserWorkspaceRole.workspace_id == workspace_id),
+        MEMBER_FIELDS, 'member', chunk_size)
+    yield from _stream_rows(
+        db.select(*[getattr(Task, field) for field in TASK_FIELDS])
+        .where(Task.workspace_id == workspace_id).order_by(Task.id),
+        TASK_FIELDS, 'task', chunk_size)
+    yield from _stream_rows(
+        db.select(*[getattr(SubTask, field) for field in SUBTASK_FIELDS])
+        .join(Task, Task.id == SubTask.task_id)
+        .where(Task.workspace_id == workspace_id).order_by(SubTask.id),
+        SUBTASK_FIELDS, 'subtask', chunk_size)
+
+
+def load_workspace_row(workspace_id):
+    return db.session.execute(
+        db.select(*[getattr(Workspace, field) for field in WORKSPACE_FIELDS]).where(Workspace.id == workspace_id)
+    ).first()
+
+
+@app.route('/workspaces/<int:workspace_id>/export', methods=['GET'])
+@jwt_required()
+@workspace_role_required()
+def export_workspace(workspace_id):
+    chunk_size = app.config['EXPORT_CHUNK_SIZE']
+    workspace = load_workspace_row(workspace_id)
+    if workspace is None:
+        return jsonify({"error": "Workspace not found"}), 404
+
+    records = export_records(workspace_id, workspace, chunk_size)
+    response = app.response_class(stream_with_context(records), mimetype='application/x-ndjson')
+    response.headers['Content-Disposition'] = f'attachment; filename=workspace-{workspace_id}.ndjson'
+    return response
+
+
+def _validate(model, values):
+    # Imported here: batch imports routes, which reaches this module through jobs
+    from batch import validate_values
+    return validate_values(model, values)
+
+
+def _insert_rows(model, rows):
+    from batch import insert_rows
+    insert_rows(db.session, model, rows)
+
+
+def _read_record(line):
+    try:
+        record = loads(line)
+    except ValueError:
+        raise ValueError('not valid JSON')
+    if not isinstance(record, dict) or 'type' not in record or not isinstance(record.get('data'), dict):
+        raise ValueError('expected an object with a type and a data object')
+    return record['type'], record['data']
+
+
+# Helper function to check that a record carries the keys it cannot be imported without
+def _require(data, fields):
+    missing = [field for field in fields if field not in data]
+    if missing:
+        raise ValueError(f"missing {', '.join(missing)}")
+
+
+# Helper function to read an id from the source instance, used only to link records in the file
+def _source_id(data, field, nullable=False):
+    value = data.get(field)
+    if value is None and nullable:
+        return None
+    if isinstance(value, bool) or not isinstance(value, int):
+        raise ValueError(f'{field} must be an integer')
+    return value
+
+
+def _pick(model, data, fields):
+    values = {field: data[field] for field in fields if field in data}
+    for field in DATETIME_FIELDS:
+        if values.get(field) is None:
+            continue
+        if not isinstance(values[field], str):
+            raise ValueError(f'{field} must be a date string')
+        try:
+            values[field] = parse_since(values[field])
+        except ValueError:
+            raise ValueError(f'{field} must be an ISO 8601 date')
+    if values.get('position') is not None and not positions.is_key(values['position']):
+        raise ValueError('position must be a position key')
+    return _validate(model, values)
+
+
+def _workspace_values(data):
+    _require(data, ('name',))
+    return _validate(Workspace, {'name': data['name'], 'description': data.get('description', '')})
+
+
+class _Importer:
+    """Buffers imported rows and writes them with bulk inserts, committing each batch.
+
+    The workspace has no members until the import finishes, so committed
+    batches stay invisible in the meantime.
+    """
+
+    def __init__(self, workspace_id, version, batch_size):
+        self.workspace_id = workspace_id
+        self.version = version
+        self.batch_size = batch_size
+        self.members = {}
+        self.user_ids = None
+        self.task_ids = {}
+        self.last_task_id = 0
+        self.tasks = []
+        self.subtasks = []
+        self.counts = {'member': 0, 'task': 0, 'subtask': 0}
+
+    def add_member(self, data):
+        _require(data, ('user_id', 'username', 'role'))
+        _validate(User, {'username': data['username']})
+        validate_role(data['role'])
+        self.members[_source_id(data, 'user_id')] = (data['username'], data['role'])
+
+    def resolve_members(self):
+        # Exported user ids belong to the source instance; match accounts by username
+        if self.user_ids is not None:
+            return
+        usernames = {username: old_id for old_id, (username, _) in self.members.items()}
+        self.user_ids = {}
+        if usernames:
+            for local_id, username in db.session.query(User.id, User.username).filter(User.username.in_(list(usernames))):
+                self.user_ids[usernames[username]] = local_id
+
+    def add_task(self, data):
+        _require(data, ('id', 'title'))
+        old_id = _source_id(data, 'id')
+        _source_id(data, 'assignee_id', nullable=True)
+        row = _pick(Task, data, IMPORTED_TASK_FIELDS)
+        self.resolve_members()
+        row.update(workspace_id=self.workspace_id, sync_version=self.version,
+                   assignee_id=self.user_ids.get(row.get('assignee_id')))
+        self.tasks.append((old_id, row))
+        if len(self.tasks) >= self.batch_size:
+            self.flush_tasks()
+
+    def add_subtask(self, data):
+        _require(data, ('task_id', 'title'))
+        old_task_id = _source_id(data, 'task_id')
+        _source_id(data, 'assignee_id', nullable=True)
+        row = _pick(SubTask, data, IMPORTED_SUBTASK_FIELDS)
+        # Exports list every task before the first subtask
+        self.resolve_members()
+        self.flush_tasks()
+        task_id = self.task_ids.get(old_task_id)
+        if task_id is None:
+            return
+        row.update(task_id=task_id, sync_version=self.version,
+                   assignee_id=self.user_ids.get(row.get('assignee_id')))
+        self.subtasks.append(row)
+        if len(self.subtasks) >= self.batch_size:
+            self.flush_subtasks()
+
+    def flush_tasks(self):
+        if not self.tasks:
+            return
+        rows = [row for _, row in self.tasks]
+        # Exports from before positions existed carry none; append those in file order
+        positions.assign_task_positions(db.session, self.workspace_id, rows)
+        _insert_rows(Task, rows)
+        # Nothing else writes to the workspace during the import, so the new ids are the ones above the last batch
+        new_ids = db.session.execute(
+            db.select(Task.id).where(Task.workspace_id == self.workspace_id, Task.id > self.last_task_id)
+            .order_by(Task.id)
+        ).scalars().all()
+        for (old_id, _), new_id in zip(self.tasks, new_ids):
+            self.task_ids[old_id] = new_id
+        self.last_task_id = new_ids[-1]
+        db.session.commit()
+        self.counts['task'] += len(rows)
+        self.tasks = []
+
+    def flush_subtasks(self):
+        if not self.subtasks:
+            return
+        positions.assign_subtask_positions(db.session, self.subtasks)
+        _insert_rows(SubTask, self.subtasks)
+        db.session.commit()
+        self.counts['subtask'] += len(self.subtasks)
+        self.subtasks = []
+
+    def flush(self):
+        self.flush_tasks()
+        self.flush_subtasks()
+
+    def member_roles(self, owner_id):
+        self.resolve_members()
+        roles = {self.user_ids[old_id]: role for old_id, (_, role) in self.members.items() if old_id in self.user_ids}
+        roles[owner_id] = 'admin'
+        return roles
+
+
+def _discard_import(workspace_id):
+    # Batches are committed as they go, so a failed import is deleted like any other workspace
+    import jobs
+    db.session.rollback()
+    jobs.enqueue('delete_workspace', workspace_id)
+
+
+@app.route('/workspaces/import', methods=['POST'])
+@jwt_required()
+def import_workspace():
+    """Create a workspace from an NDJSON export, reading the upload line by line."""
+    user_id = get_jwt_identity()
+    workspace = None
+    importer = None
+
+    for line_number, line in enumerate(request.stream, start=1):
+        if not line.strip():
+            continue
+        try:
+            record_type, data = _read_record(line)
+            if workspace is None:
+                if record_type != 'workspace':
+                    db.session.rollback()
+                    return jsonify({"error": "Export must start with a workspace record"}), 400
+                workspace = Workspace(**_workspace_values(data))
+                db.session.add(workspace)
+                db.session.flush()
+                importer = _Importer(workspace.id, bump_workspace_version(db.session, workspace.id),
+                                     app.config['IMPORT_BATCH_SIZE'])
+                db.session.commit()
+            elif record_type == 'member':
+                importer.add_member(data)
+            elif record_type == 'task':
+                importer.add_task(data)
+            elif record_type == 'subtask':
+                importer.add_subtask(data)
+        except ValueError as e:
+            if workspace is None:
+                db.session.rollback()
+            else:
+                _discard_import(workspace.id)
+            return jsonify({"error": f"Invalid record on line {line_number}: {e}"}), 400
+
+    if workspace is None:
+        return jsonify({"error": "Empty import"}), 400
+    importer.flush()
+    search.index_workspace(db.session, workspace.id)
+    stats.rebuild(db.session, workspace.id)
+
+    roles = importer.member_roles(int(user_id))
+    db.session.bulk_insert_mappings(UserWorkspaceRole, [
+        {'user_id': member_id, 'workspace_id': workspace.id, 'role': role} for member_id, role in roles.items()
+    ])
+    db.session.commit()
+    for member_id in roles:
+        invalidate_role(member_id, workspace.id)
+
+    importer.counts['member'] = len(roles)
+    return jsonify({'workspace': workspace.to_dict(), 'imported': importer.counts}), 201
@@ -0,0 +1,41 @@
+from datetime import datetime, timedelta, timezone
+import msgpack
+
+# Encodings a client can ask for with ?encoding= when it connects; JSON is the default
+ENCODINGS = ('json', 'msgpack')
+# Sent as integer milliseconds since the epoch in binary payloads
+TIMESTAMP_FIELDS = {'created_at', 'updated_at', 'due_date', 'deleted_at', 'started_at', 'finished_at'}
+EPOCH = datetime(1970, 1, 1)
+
+
+def negotiate(requested, enabled):
+    return requested if requested in enabled else 'json'
+
+
+def epoch_millis(value):
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return (value - EPOCH) // timedelta(milliseconds=1)
+
+
+def _compact(value, key=None):
+    # Replace datetimes, and the ISO strings to_dict already made of them, with epoch milliseconds
+    if isinstance(value, dict):
+        return {k: _compact(v, k) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_compact(item) for item in value]
+    if isinstance(value, datetime):
+        return epoch_millis(value)
+    if key in TIMESTAMP_FIELDS and isinstance(value, str):
+        try:
+            return epoch_millis(datetime.fromisoformat(value[:-1] if value.endswith('Z') else value))
+        except ValueError:
+            return value
+    return value
+
+
+def encode(payload, encoding):
+    """Return ``payload`` in the form emitted to clients that negotiated ``encoding``."""
+    if encoding == 'json':
+        return payload
+    return msgpack.packb(_compact(payload))